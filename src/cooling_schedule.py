@@ -0,0 +1,113 @@
+"""
+Cooling schedules of `SimulatedAnnealing`. Every step the annealing asks its schedule for the next temperature, and
+after every step that evaluated a neighbor it tells the schedule the current energy and whether it switched.
+"""
+import logging
+from abc import ABC, abstractmethod
+from math import exp
+from statistics import pstdev
+
+from src.models.otml_configuration import RunConfiguration
+
+logger = logging.getLogger(__name__)
+
+
+class CoolingSchedule(ABC):
+    @classmethod
+    @abstractmethod
+    def from_config(cls, config: RunConfiguration) -> "CoolingSchedule":
+        pass
+
+    @abstractmethod
+    def get_next_temperature(self, temperature: float) -> float:
+        pass
+
+    def record_step(self, temperature: float, energy: int, switched: bool) -> None:
+        pass
+
+    def get_expected_number_of_steps(self, initial_temp: float, threshold: float) -> int:
+        step = 0
+        temp = initial_temp
+        while temp > threshold:
+            step += 1
+            temp = self.get_next_temperature(temp)
+        return step
+
+
+class GeometricCoolingSchedule(CoolingSchedule):
+    """The temperature is multiplied by `cooling_factor` every step"""
+
+    def __init__(self, cooling_factor: float):
+        self.cooling_factor = cooling_factor
+
+    @classmethod
+    def from_config(cls, config: RunConfiguration) -> "GeometricCoolingSchedule":
+        return cls(config.cooling_factor)
+
+    def get_next_temperature(self, temperature: float) -> float:
+        return temperature * self.cooling_factor
+
+
+class AdaptiveCoolingSchedule(GeometricCoolingSchedule):
+    """
+    A geometric schedule whose factor is tuned again after every window of evaluated steps, between
+    `base_cooling_factor ** speedup` (fastest) and `base_cooling_factor ** (1 / speedup)` (slowest):
+
+    - If the acceptance ratio of the window is out of [min_acceptance_ratio, max_acceptance_ratio] - i.e. nearly
+      everything or nearly nothing is accepted - the temperature makes no difference, so cooling is the fastest.
+    - Otherwise the factor is exp(-variance_factor * T / sigma), where sigma is the standard deviation of the
+      energy over the window (Huang et al., 1986): cooling slows down where the energy fluctuates the most.
+
+    The expected number of steps is estimated with the base factor.
+    """
+
+    def __init__(self, base_cooling_factor: float, window: int, min_acceptance_ratio: float,
+                 max_acceptance_ratio: float, speedup: float, variance_factor: float):
+        super().__init__(base_cooling_factor)
+        self.base_cooling_factor = base_cooling_factor
+        self.window = window
+        self.min_acceptance_ratio = min_acceptance_ratio
+        self.max_acceptance_ratio = max_acceptance_ratio
+        self.speedup = speedup
+        self.variance_factor = variance_factor
+
+        self._window_energies: list[int] = list()
+        self._window_number_of_switches = 0
+
+    @classmethod
+    def from_config(cls, config: RunConfiguration) -> "AdaptiveCoolingSchedule":
+        adaptive_cooling = config.adaptive_cooling
+        return cls(config.cooling_factor, adaptive_cooling.window, adaptive_cooling.min_acceptance_ratio,
+                   adaptive_cooling.max_acceptance_ratio, adaptive_cooling.speedup, adaptive_cooling.variance_factor)
+
+    def record_step(self, temperature: float, energy: int, switched: bool) -> None:
+        self._window_energies.append(energy)
+        self._window_number_of_switches += switched
+        if len(self._window_energies) < self.window:
+            return
+
+        fastest_cooling_factor = self.base_cooling_factor ** self.speedup
+        slowest_cooling_factor = self.base_cooling_factor ** (1 / self.speedup)
+        acceptance_ratio = self._window_number_of_switches / len(self._window_energies)
+        energy_deviation = pstdev(self._window_energies)
+        if not self.min_acceptance_ratio <= acceptance_ratio <= self.max_acceptance_ratio or not energy_deviation:
+            self.cooling_factor = fastest_cooling_factor
+        else:
+            cooling_factor = exp(-self.variance_factor * temperature / energy_deviation)
+            self.cooling_factor = min(max(cooling_factor, fastest_cooling_factor), slowest_cooling_factor)
+        logger.info(f"Acceptance ratio: {acceptance_ratio:.3f}, energy deviation: {energy_deviation:.1f} - "
+                    f"cooling factor set to {self.cooling_factor}")
+
+        self._window_energies = list()
+        self._window_number_of_switches = 0
+
+
+COOLING_SCHEDULES: dict[str, type[CoolingSchedule]] = {
+    "geometric": GeometricCoolingSchedule,
+    "adaptive": AdaptiveCoolingSchedule,
+}
+
+
+def get_cooling_schedule(config: RunConfiguration) -> CoolingSchedule:
+    """the cooling schedule named by the `cooling_schedule` setting"""
+    return COOLING_SCHEDULES[config.cooling_schedule].from_config(config)
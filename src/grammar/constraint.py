@@ -1,8 +1,8 @@
 import abc
 import logging
+import random
 import sys
 from itertools import permutations
-from random import randint, choice
 
 from six import StringIO, with_metaclass
 
@@ -10,16 +10,18 @@ from src.exceptions import ConstraintError
 from src.exceptions import GrammarParseError
 from src.grammar.feature_bundle import FeatureBundle
 from src.grammar.features.feature_table import NULL_SEGMENT, JOKER_SEGMENT
-from src.models.otml_configuration import settings
+from src.grammar.undo_log import UndoLog
+from src.models.cache_manager import CacheManager, interned_constraint_keys
+from src.models.otml_configuration import RunConfiguration
 from src.models.transducer import CostVector, Arc, State, Transducer
+from src.models.transducer_disk_cache import transducer_disk_cache
+from src.utils.fingerprint_tools import get_string_fingerprint
 
 logger = logging.getLogger(__name__)
 
 # Global variable that holds all the names of constraint classes that inherit from ConstraintMetaClass
 _all_constraints = list()
 
-constraint_transducers = dict()
-
 
 def _get_number_of_constraints():
     return len(_all_constraints)
@@ -50,10 +52,43 @@ class Constraint(with_metaclass(ConstraintMetaClass)):
                 self.feature_bundles.append(bundle)
             else:
                 raise GrammarParseError("Not a dict or FeatureBundle")
-
-    def augment_feature_bundle(self) -> bool:
-        success = choice(self.feature_bundles).augment_feature_bundle()
+        self._key: tuple
+        self._key_fingerprint: int
+        self._key, self._key_fingerprint = self._make_key()
+
+    def get_key(self) -> tuple:
+        """
+        (name, sorted (feature, value) pairs of every bundle) - equal for constraints that print the same.
+        It identifies the constraint in the caches, see `_update_key`
+        """
+        return self._key
+
+    def get_key_fingerprint(self) -> int:
+        """the fingerprint of the key, computed when the key is interned"""
+        return self._key_fingerprint
+
+    def _make_key(self) -> tuple[tuple, int]:
+        """(the interned key, its fingerprint)"""
+        key = (self.get_constraint_name(),
+               tuple(tuple(sorted(bundle.get_feature_dict().items())) for bundle in self.feature_bundles))
+        interned_key = interned_constraint_keys.get(key)
+        if interned_key is None:
+            interned_key = interned_constraint_keys[key] = (key, get_string_fingerprint(repr(key)))
+        return interned_key
+
+    def _set_key(self, key: tuple, key_fingerprint: int):
+        self._key = key
+        self._key_fingerprint = key_fingerprint
+
+    def _update_key(self, undo_log: UndoLog):
+        """Every mutation of the feature bundles calls this after it"""
+        undo_log.record(self._set_key, self._key, self._key_fingerprint)
+        self._key, self._key_fingerprint = self._make_key()
+
+    def augment_feature_bundle(self, undo_log: UndoLog, rng: random.Random, config: RunConfiguration) -> bool:
+        success = rng.choice(self.feature_bundles).augment_feature_bundle(undo_log, rng, config)
         if success:
+            self._update_key(undo_log)
             return True
         return False
 
@@ -75,28 +110,23 @@ class Constraint(with_metaclass(ConstraintMetaClass)):
         return transducer, segments, state
 
     @classmethod
-    def generate_random(cls, feature_table):
-        random_feature_bundle = FeatureBundle.generate_random(feature_table)
+    def generate_random(cls, feature_table, rng: random.Random, config: RunConfiguration):
+        random_feature_bundle = FeatureBundle.generate_random(feature_table, rng, config)
         constraint_class = Constraint.get_constraint_class_by_name(cls.get_constraint_name())
         return constraint_class([random_feature_bundle], feature_table)
 
-    def get_transducer(self):
-        constraint_key = str(self)
-        if constraint_key in constraint_transducers:
-            return constraint_transducers[constraint_key]
-        else:
-            transducer = self._make_transducer()
-            constraint_transducers[constraint_key] = transducer
-            return transducer
-
-    @staticmethod
-    def clear_caching():
-        global constraint_transducers
-        constraint_transducers = dict()
+    def get_transducer(self, cache_manager: CacheManager, config: RunConfiguration):
+        constraint_transducers = cache_manager.constraint_transducers
+        transducer = constraint_transducers.get(self._key)
+        if transducer is None:
+            transducer = transducer_disk_cache.get_transducer("constraint", self.feature_table, self._key,
+                                                              lambda: self._make_transducer(config), config)
+            constraint_transducers[self._key] = transducer
+        return transducer
 
     def __eq__(self, other):
         if type(self) is type(other):
-            return self.feature_bundles == other.feature_bundles
+            return self._key == other._key
         return False
 
     def __str__(self):
@@ -117,7 +147,7 @@ class Constraint(with_metaclass(ConstraintMetaClass)):
         return str_io.getvalue()
 
     def __hash__(self):
-        return hash(str(self))
+        return hash(self._key)
 
     @classmethod
     @abc.abstractmethod
@@ -130,7 +160,7 @@ class MaxConstraint(Constraint):
         super(MaxConstraint, self).__init__(bundles_list, False, feature_table)
         self.feature_bundle = self.feature_bundles[0]
 
-    def _make_transducer(self):
+    def _make_transducer(self, config: RunConfiguration):
         transducer, segments, state = super(MaxConstraint, self)._base_faithfulness_transducer()
         for segment in segments:
             transducer.add_arc(Arc(state, segment, segment, CostVector.get_vector(1, 0), state))
@@ -139,7 +169,7 @@ class MaxConstraint(Constraint):
             value = 1 if segment.has_feature_bundle(self.feature_bundle) else 0
             transducer.add_arc(Arc(state, segment, NULL_SEGMENT, CostVector.get_vector(1, value), state))
 
-        if settings.allow_candidates_with_changed_segments:
+        if config.allow_candidates_with_changed_segments:
             for first_segment, second_segment in permutations(segments, 2):
                 transducer.add_arc(Arc(state, first_segment, second_segment, CostVector.get_vector(1, 0), state))
 
@@ -155,7 +185,7 @@ class DepConstraint(Constraint):
         super(DepConstraint, self).__init__(bundles_list, False, feature_table)
         self.feature_bundle = self.feature_bundles[0]
 
-    def _make_transducer(self):
+    def _make_transducer(self, config: RunConfiguration):
         transducer, segments, state = super(DepConstraint, self)._base_faithfulness_transducer()
         for segment in segments:
             transducer.add_arc(Arc(state, segment, segment, CostVector.get_vector(1, 0), state))
@@ -164,7 +194,7 @@ class DepConstraint(Constraint):
             value = 1 if segment.has_feature_bundle(self.feature_bundle) else 0
             transducer.add_arc(Arc(state, NULL_SEGMENT, segment, CostVector.get_vector(1, value), state))
 
-        if settings.allow_candidates_with_changed_segments:
+        if config.allow_candidates_with_changed_segments:
             for first_segment, second_segment in permutations(segments, 2):
                 transducer.add_arc(Arc(state, first_segment, second_segment, CostVector.get_vector(1, 0), state))
 
@@ -180,7 +210,7 @@ class IdentConstraint(Constraint):
         super(IdentConstraint, self).__init__(bundles_list, False, feature_table)
         self.feature_bundle = self.feature_bundles[0]
 
-    def _make_transducer(self):
+    def _make_transducer(self, config: RunConfiguration):
         transducer, segments, state = super(IdentConstraint, self)._base_faithfulness_transducer()
         for segment in segments:
             transducer.add_arc(Arc(state, segment, segment, CostVector.get_vector(1, 0), state))
@@ -212,14 +242,14 @@ class FaithConstraint(Constraint):
     def __init__(self, bundles_list, feature_table):
         super(FaithConstraint, self).__init__([], False, feature_table)
 
-    def _make_transducer(self):
+    def _make_transducer(self, config: RunConfiguration):
         transducer, segments, state = super(FaithConstraint, self)._base_faithfulness_transducer()
         for segment in segments:
             transducer.add_arc(Arc(state, NULL_SEGMENT, segment, CostVector.get_vector(1, 1), state))
             transducer.add_arc(Arc(state, segment, NULL_SEGMENT, CostVector.get_vector(1, 1), state))
             transducer.add_arc(Arc(state, segment, segment, CostVector.get_vector(1, 0), state))
 
-        if settings.allow_candidates_with_changed_segments:
+        if config.allow_candidates_with_changed_segments:
             for first_segment, second_segment in permutations(segments, 2):
                 transducer.add_arc(Arc(state, first_segment, second_segment, CostVector.get_vector(1, 1), state))
 
@@ -234,29 +264,34 @@ class PhonotacticConstraint(Constraint):
     def __init__(self, bundles_list, feature_table):
         super(PhonotacticConstraint, self).__init__(bundles_list, True, feature_table)
 
-    def insert_feature_bundle(self):
-        if len(self.feature_bundles) < settings.max_feature_bundles_in_phonotactic_constraint:
-            new_feature_bundle = FeatureBundle.generate_random(self.feature_table)
-            if settings.random_position_for_feature_bundle_insertion_in_phonotactic:
-                self.feature_bundles.insert(randint(0, len(self.feature_bundles)), new_feature_bundle)
+    def insert_feature_bundle(self, undo_log: UndoLog, rng: random.Random, config: RunConfiguration):
+        if len(self.feature_bundles) < config.max_feature_bundles_in_phonotactic_constraint:
+            new_feature_bundle = FeatureBundle.generate_random(self.feature_table, rng, config)
+            if config.random_position_for_feature_bundle_insertion_in_phonotactic:
+                index_of_insertion = rng.randint(0, len(self.feature_bundles))
             else:
-                self.feature_bundles.append(new_feature_bundle)
+                index_of_insertion = len(self.feature_bundles)
+            self.feature_bundles.insert(index_of_insertion, new_feature_bundle)
+            undo_log.record(self.feature_bundles.pop, index_of_insertion)
+            self._update_key(undo_log)
             return True
         else:
             return False
 
-    def remove_feature_bundle(self):
-        if len(self.feature_bundles) > settings.min_feature_bundles_in_phonotactic_constraint:
-            if settings.random_position_for_feature_bundle_removal_in_phonotactic:
-
-                self.feature_bundles.pop(randint(0, len(self.feature_bundles) - 1))
+    def remove_feature_bundle(self, undo_log: UndoLog, rng: random.Random, config: RunConfiguration):
+        if len(self.feature_bundles) > config.min_feature_bundles_in_phonotactic_constraint:
+            if config.random_position_for_feature_bundle_removal_in_phonotactic:
+                index_of_removal = rng.randint(0, len(self.feature_bundles) - 1)
             else:
-                self.feature_bundles.pop()
+                index_of_removal = len(self.feature_bundles) - 1
+            removed_feature_bundle = self.feature_bundles.pop(index_of_removal)
+            undo_log.record(self.feature_bundles.insert, index_of_removal, removed_feature_bundle)
+            self._update_key(undo_log)
             return True
         else:
             return False
 
-    def _make_transducer(self):
+    def _make_transducer(self, config: RunConfiguration):
 
         def compute_num_of_max_satisfied_bundle(segment):
             i = 0
@@ -344,10 +379,10 @@ class PhonotacticConstraint(Constraint):
             self.feature_bundles) + 1
 
     @classmethod
-    def generate_random(cls, feature_table):
+    def generate_random(cls, feature_table, rng: random.Random, config: RunConfiguration):
         bundles = list()
-        for i in range(settings.initial_number_of_bundles_in_phonotactic_constraint):
-            bundles.append(FeatureBundle.generate_random(feature_table))
+        for i in range(config.initial_number_of_bundles_in_phonotactic_constraint):
+            bundles.append(FeatureBundle.generate_random(feature_table, rng, config))
         return PhonotacticConstraint(bundles, feature_table)
 
 
@@ -355,7 +390,7 @@ class HeadDepConstraint(Constraint):
     def __init__(self, bundles_list, feature_table):
         super(HeadDepConstraint, self).__init__(bundles_list, True, feature_table)
 
-    def _make_transducer(self):
+    def _make_transducer(self, config: RunConfiguration):
         segments = self.feature_table.get_segments()
         transducer = Transducer(segments, name=str(self))
 
@@ -400,7 +435,7 @@ class MainLeftConstraint(Constraint):
     def __init__(self, bundles_list, feature_table):
         super(MainLeftConstraint, self).__init__(bundles_list, True, feature_table)
 
-    def _make_transducer(self):
+    def _make_transducer(self, config: RunConfiguration):
         segments = self.feature_table.get_segments()
         transducer = Transducer(segments, name=str(self))
 
@@ -448,7 +483,7 @@ class PrecedeConstraint(Constraint):
     def __init__(self, bundles_list, feature_table):
         super(PrecedeConstraint, self).__init__(bundles_list, True, feature_table)
 
-    def _make_transducer(self):
+    def _make_transducer(self, config: RunConfiguration):
         segments = self.feature_table.get_segments()
         transducer = Transducer(segments, name=str(self))
 
@@ -487,7 +522,7 @@ class ContiguityConstraint(Constraint):
     def __init__(self, bundles_list, feature_table):
         super(ContiguityConstraint, self).__init__(bundles_list, True, feature_table)
 
-    def _make_transducer(self):
+    def _make_transducer(self, config: RunConfiguration):
         segments = self.feature_table.get_segments()
         transducer = Transducer(segments, name=str(self))
 
@@ -5,14 +5,19 @@ import codecs
 import json
 import logging
 import pickle
+import random
+from functools import partial
 from math import ceil, log
-from random import choice, randrange
 
 from src.exceptions import GrammarParseError
 from src.grammar.constraint import Constraint, _get_number_of_constraints
 from src.grammar.constraint import MaxConstraint, DepConstraint, PhonotacticConstraint, IdentConstraint
-from src.models.otml_configuration import settings
+from src.grammar.undo_log import UndoLog
+from src.models.cache_manager import CacheManager
+from src.models.otml_configuration import RunConfiguration
 from src.models.transducer import Transducer
+from src.models.transducer_disk_cache import transducer_disk_cache
+from src.utils.fingerprint_tools import get_ranked_fingerprint, FINGERPRINT_MASK
 from src.utils.randomization_tools import get_weighted_list
 
 logger = logging.getLogger(__name__)
@@ -20,8 +25,6 @@ logger = logging.getLogger(__name__)
 CONSTRAINTS_DELIM = " >> "
 DEMOTE_CASHING_FLAG = True
 
-constraint_set_transducers = dict()
-
 
 class ConstraintSet:
     def __init__(self, constraint_set_list, feature_table):
@@ -35,17 +38,15 @@ class ConstraintSet:
 
             constraint_class = Constraint.get_constraint_class_by_name(constraint_name)
             self.constraints.append(constraint_class(bundles_list, feature_table))
+        self._fingerprint: int = self._get_ranking_fingerprint() & FINGERPRINT_MASK
+        self._key: tuple = tuple(constraint.get_key() for constraint in self.constraints)
+        self._constraints_encoding_length: int = sum(constraint.get_encoding_length() for constraint in self.constraints)
 
     def __str__(self):
         return f"Constraint Set: {CONSTRAINTS_DELIM.join([str(cons) for cons in self.constraints])}"
 
     def __hash__(self):
-        return hash(str(self))
-
-    @staticmethod
-    def clear_caching():
-        global constraint_set_transducers
-        constraint_set_transducers = dict()
+        return hash(self._key)
 
     @classmethod
     def loads(cls, constraint_set_json_str, feature_table):
@@ -91,34 +92,90 @@ class ConstraintSet:
 
     def get_encoding_length(self):
         k = ceil(log(_get_number_of_constraints() + self.feature_table.get_number_of_features() + 2 + 1, 2))
-        return k * (1 + sum([constraint.get_encoding_length() for constraint in self.constraints]))
+        return k * (1 + self._constraints_encoding_length)
 
-    def make_mutation(self):
+    def make_mutation(self, undo_log: UndoLog, rng: random.Random, config: RunConfiguration,
+                      cache_manager: CacheManager):
+        """cache_manager is where a demotion caches the transducer of the demoted constraint set"""
         mutation_weights = [
-            (self._insert_constraint, settings.constraint_set_mutation_weights.insert_constraint),
-            (self._remove_constraint, settings.constraint_set_mutation_weights.remove_constraint),
-            (self._demote_constraint, settings.constraint_set_mutation_weights.demote_constraint),
+            (self._insert_constraint, config.constraint_set_mutation_weights.insert_constraint),
+            (self._remove_constraint, config.constraint_set_mutation_weights.remove_constraint),
+            (partial(self._demote_constraint, cache_manager=cache_manager),
+             config.constraint_set_mutation_weights.demote_constraint),
             (self._insert_feature_bundle_phonotactic_constraint,
-             settings.constraint_set_mutation_weights.insert_feature_bundle_phonotactic_constraint),
+             config.constraint_set_mutation_weights.insert_feature_bundle_phonotactic_constraint),
             (self._remove_feature_bundle_phonotactic_constraint,
-             settings.constraint_set_mutation_weights.remove_feature_bundle_phonotactic_constraint),
+             config.constraint_set_mutation_weights.remove_feature_bundle_phonotactic_constraint),
             (self._augment_feature_bundle,
-             settings.constraint_set_mutation_weights.augment_feature_bundle)
+             config.constraint_set_mutation_weights.augment_feature_bundle)
         ]
 
         weighted_mutation_function_list = get_weighted_list(mutation_weights)
-        return choice(weighted_mutation_function_list)()
+        undo_log.record(self._set_fingerprint, self._fingerprint)
+        undo_log.record(self._set_key, self._key)
+        undo_log.record(self._set_constraints_encoding_length, self._constraints_encoding_length)
+        return rng.choice(weighted_mutation_function_list)(undo_log, rng, config)
+
+    def get_fingerprint(self) -> int:
+        """identifies the ranked constraints - it is the same for constraint sets that print the same"""
+        return self._fingerprint
+
+    def _set_fingerprint(self, fingerprint: int):
+        self._fingerprint = fingerprint
+
+    def get_key(self) -> tuple:
+        """the keys of the ranked constraints - it identifies the constraint set in the caches"""
+        return self._key
+
+    def _set_key(self, key: tuple):
+        self._key = key
+
+    def _set_constraints_encoding_length(self, constraints_encoding_length: int):
+        self._constraints_encoding_length = constraints_encoding_length
+
+    def _get_ranking_fingerprint(self, start: int = 0, stop: int | None = None) -> int:
+        """the fingerprint of the constraints ranked in [start, stop), each combined with its rank - O(1) per rank"""
+        if stop is None:
+            stop = len(self.constraints)
+        return sum(get_ranked_fingerprint(self.constraints[index].get_key_fingerprint(), index)
+                   for index in range(start, stop))
+
+    def _change_fingerprint(self, old_ranking_fingerprint: int, new_ranking_fingerprint: int):
+        """replace the fingerprint of some ranks, taken before they changed, with their new one"""
+        self._fingerprint = (self._fingerprint - old_ranking_fingerprint + new_ranking_fingerprint) & FINGERPRINT_MASK
+
+    def _mutate_constraint(self, constraint: Constraint, mutation, undo_log: UndoLog, rng: random.Random,
+                           config: RunConfiguration) -> bool:
+        index = next(index for index, other in enumerate(self.constraints) if other is constraint)
+        old_ranking_fingerprint = self._get_ranking_fingerprint(index, index + 1)
+        old_encoding_length = constraint.get_encoding_length()
+        if not mutation(undo_log, rng, config):
+            return False
+        self._constraints_encoding_length += constraint.get_encoding_length() - old_encoding_length
+        self._change_fingerprint(old_ranking_fingerprint, self._get_ranking_fingerprint(index, index + 1))
+        self._key = self._key[:index] + (constraint.get_key(),) + self._key[index + 1:]
+        return True
 
-    def _remove_constraint(self):
+    def _remove_constraint(self, undo_log: UndoLog, rng: random.Random, config: RunConfiguration):
         logger.debug("In _remove_constraint")
-        if len(self.constraints) > settings.min_constraints_in_constraint_set:
-            removable_constraints = list(filter(lambda x: x.get_constraint_name() != "Faith", self.constraints))
-            self.constraints.remove(choice(removable_constraints))
+        if len(self.constraints) > config.min_constraints_in_constraint_set:
+            # by index - `list.index` would find the first of equal constraints, and the rollback would put the chosen
+            # one in its place, twice in the list
+            removable_indices = [index for index, constraint in enumerate(self.constraints)
+                                 if constraint.get_constraint_name() != "Faith"]
+            index_of_removal = rng.choice(removable_indices)
+            old_ranking_fingerprint = self._get_ranking_fingerprint(index_of_removal)  # the lower ranks move up
+            constraint_to_remove = self.constraints.pop(index_of_removal)
+            undo_log.record(self.constraints.insert, index_of_removal, constraint_to_remove)
+            self._change_fingerprint(old_ranking_fingerprint, self._get_ranking_fingerprint(index_of_removal))
+            self._key = self._key[:index_of_removal] + self._key[index_of_removal + 1:]
+            self._constraints_encoding_length -= constraint_to_remove.get_encoding_length()
             return True
         else:  # cannot remove constraint, resulting constraint_set length will br beneath minimum length
             return False
 
-    def _insert_feature_bundle_phonotactic_constraint(self):
+    def _insert_feature_bundle_phonotactic_constraint(self, undo_log: UndoLog, rng: random.Random,
+                                                      config: RunConfiguration):
         """
         insert a feature bundle in a Phonotactic constraint
         """
@@ -126,11 +183,13 @@ class ConstraintSet:
         phonotactic_constraints = list(filter(lambda x: x.get_constraint_name() == "Phonotactic", self.constraints))
         if not phonotactic_constraints:
             return False  # there no phonotactic constraints to update
-        if choice(phonotactic_constraints).insert_feature_bundle():
+        constraint = rng.choice(phonotactic_constraints)
+        if self._mutate_constraint(constraint, constraint.insert_feature_bundle, undo_log, rng, config):
             return True
         return False  # augment_constraint did not succeed
 
-    def _remove_feature_bundle_phonotactic_constraint(self):
+    def _remove_feature_bundle_phonotactic_constraint(self, undo_log: UndoLog, rng: random.Random,
+                                                      config: RunConfiguration):
         """
         removes a feature bundle from a Phonotactic constraint
         """
@@ -138,20 +197,23 @@ class ConstraintSet:
         phonotactic_constraints = list(filter(lambda x: x.get_constraint_name() == "Phonotactic", self.constraints))
         if not phonotactic_constraints:
             return False  # there no phonotactic constraints to update
-        if choice(phonotactic_constraints).remove_feature_bundle():
+        constraint = rng.choice(phonotactic_constraints)
+        if self._mutate_constraint(constraint, constraint.remove_feature_bundle, undo_log, rng, config):
             return True
         return False  # augment_constraint did not succeed
 
-    def _augment_feature_bundle(self):
+    def _augment_feature_bundle(self, undo_log: UndoLog, rng: random.Random, config: RunConfiguration):
         logger.debug("In _augment_feature_bundle")
         augmentable_constraints = list(filter(lambda x: x.get_constraint_name() != "Faith", self.constraints))
         if augmentable_constraints:
-            if choice(augmentable_constraints).augment_feature_bundle():
+            constraint = rng.choice(augmentable_constraints)
+            if self._mutate_constraint(constraint, constraint.augment_feature_bundle, undo_log, rng, config):
                 return True
             else:  # augment_feature_bundle did not succeed
                 return False
 
-    def _demote_constraint(self):
+    def _demote_constraint(self, undo_log: UndoLog, rng: random.Random, config: RunConfiguration,
+                           cache_manager: CacheManager):
         """
         The highest-ranking constraint is at index 0
         """
@@ -161,56 +223,68 @@ class ConstraintSet:
             return False
 
         if DEMOTE_CASHING_FLAG:
-            transducer = pickle.loads(pickle.dumps(self.get_transducer(), -1))
+            transducer = pickle.loads(pickle.dumps(self.get_transducer(cache_manager, config), -1))
 
-        index_of_demotion = randrange(len(self.constraints) - 1)  # index of a random constraint
+        index_of_demotion = rng.randrange(len(self.constraints) - 1)  # index of a random constraint
         i = index_of_demotion  # (which is not the lowest ranked)
         j = index_of_demotion + 1  # index of the constraint lower by 1
-        self.constraints[i], self.constraints[j] = self.constraints[j], self.constraints[i]  # swap places
+        old_ranking_fingerprint = self._get_ranking_fingerprint(i, j + 1)
+        self._swap_constraints(i, j)
+        undo_log.record(self._swap_constraints, i, j)
+        self._change_fingerprint(old_ranking_fingerprint, self._get_ranking_fingerprint(i, j + 1))
+        self._key = self._key[:i] + (self._key[j], self._key[i]) + self._key[j + 1:]
 
         if DEMOTE_CASHING_FLAG:
             transducer.swap_weights_on_arcs(index_of_demotion, index_of_demotion + 1)
-            constraint_set_transducers[str(self)] = transducer
+            cache_manager.constraint_set_transducers[self._key] = transducer
 
         return True
 
-    def _insert_constraint(self):
+    def _swap_constraints(self, i, j):
+        self.constraints[i], self.constraints[j] = self.constraints[j], self.constraints[i]
+
+    def _insert_constraint(self, undo_log: UndoLog, rng: random.Random, config: RunConfiguration):
         logger.debug("In _insert_constraint")
-        if len(self.constraints) >= settings.max_constraints_in_constraint_set:
+        if len(self.constraints) >= config.max_constraints_in_constraint_set:
             return False
         mutation_weights_for_insert = [
-            (DepConstraint, settings.constraint_insertion_weights.dep),
-            (MaxConstraint, settings.constraint_insertion_weights.max),
-            (IdentConstraint, settings.constraint_insertion_weights.ident),
-            (PhonotacticConstraint, settings.constraint_insertion_weights.phonotactic)
+            (DepConstraint, config.constraint_insertion_weights.dep),
+            (MaxConstraint, config.constraint_insertion_weights.max),
+            (IdentConstraint, config.constraint_insertion_weights.ident),
+            (PhonotacticConstraint, config.constraint_insertion_weights.phonotactic)
         ]
 
         weighted_constraint_class_for_insert = get_weighted_list(mutation_weights_for_insert)
 
-        new_constraint_class = choice(weighted_constraint_class_for_insert)
-        new_constraint = new_constraint_class.generate_random(self.feature_table)
-        index_of_insertion = randrange(len(self.constraints) + 1)
+        new_constraint_class = rng.choice(weighted_constraint_class_for_insert)
+        new_constraint = new_constraint_class.generate_random(self.feature_table, rng, config)
+        index_of_insertion = rng.randrange(len(self.constraints) + 1)
         if new_constraint in self.constraints:  # newly generated constraint is already in constraint_set
             return False
+        old_ranking_fingerprint = self._get_ranking_fingerprint(index_of_insertion)  # the lower ranks move down
         self.constraints.insert(index_of_insertion, new_constraint)
+        undo_log.record(self.constraints.pop, index_of_insertion)
+        self._change_fingerprint(old_ranking_fingerprint, self._get_ranking_fingerprint(index_of_insertion))
+        self._key = self._key[:index_of_insertion] + (new_constraint.get_key(),) + self._key[index_of_insertion:]
+        self._constraints_encoding_length += new_constraint.get_encoding_length()
         return True
 
-    def get_transducer(self):
-        constraint_set_key = str(self)
-
-        if constraint_set_key in constraint_set_transducers:
-            return constraint_set_transducers[constraint_set_key]
+    def get_transducer(self, cache_manager: CacheManager, config: RunConfiguration):
+        transducer = cache_manager.constraint_set_transducers.get(self._key)
+        if transducer is not None:
+            return transducer
 
-        transducer = self._make_transducer()
-        constraint_set_transducers[constraint_set_key] = transducer
+        transducer = transducer_disk_cache.get_transducer("constraint_set", self.feature_table, self._key,
+                                                          lambda: self._make_transducer(cache_manager, config), config)
+        cache_manager.constraint_set_transducers[self._key] = transducer
         return transducer
 
-    def _make_transducer(self):
+    def _make_transducer(self, cache_manager: CacheManager, config: RunConfiguration):
         if len(self.constraints) == 1:  # if there is only on constraint in the
             # constraint set there is no need to intersect
-            return pickle.loads(pickle.dumps(self.constraints[0].get_transducer(), -1))
+            return pickle.loads(pickle.dumps(self.constraints[0].get_transducer(cache_manager, config), -1))
 
-        constraints_transducers = [constraint.get_transducer() for constraint in self.constraints]
+        constraints_transducers = [constraint.get_transducer(cache_manager, config) for constraint in self.constraints]
         return Transducer.intersection(*constraints_transducers)
 
 
@@ -2,13 +2,14 @@
 from __future__ import absolute_import, division, print_function, unicode_literals
 
 import logging
-from random import choice
+import random
 
 from six import iterkeys
 
 from src.exceptions import GrammarParseError
 from src.exceptions import OtmlConfigurationError
-from src.models.otml_configuration import settings
+from src.grammar.undo_log import UndoLog
+from src.models.otml_configuration import RunConfiguration
 
 logger = logging.getLogger(__name__)
 
@@ -33,28 +34,29 @@ class FeatureBundle:
     def get_feature_dict(self):
         return self.feature_dict
 
-    def augment_feature_bundle(self):
-        if len(self.feature_dict) < settings["MAX_FEATURES_IN_BUNDLE"]:
+    def augment_feature_bundle(self, undo_log: UndoLog, rng: random.Random, config: RunConfiguration):
+        if len(self.feature_dict) < config.max_features_in_bundle:
             all_feature_labels = self.feature_table.get_features()
             feature_labels_in_feature_bundle = iterkeys(self.feature_dict)
             available_feature_labels = list(set(all_feature_labels) - set(feature_labels_in_feature_bundle))
             if available_feature_labels:
-                feature_label = choice(available_feature_labels)
-                self.feature_dict[feature_label] = self.feature_table.get_random_value(feature_label)
+                feature_label = rng.choice(available_feature_labels)
+                self.feature_dict[feature_label] = self.feature_table.get_random_value(feature_label, rng)
+                undo_log.record(self.feature_dict.pop, feature_label)
                 return True
         return False
 
     @classmethod
-    def generate_random(cls, feature_table):
-        if settings.initial_number_of_features > feature_table.get_number_of_features():
+    def generate_random(cls, feature_table, rng: random.Random, config: RunConfiguration):
+        if config.initial_number_of_features > feature_table.get_number_of_features():
             raise OtmlConfigurationError("INITIAL_NUMBER_OF_FEATURES is bigger from number of available features")
 
         feature_dict = dict()
         available_feature_labels = list(feature_table.get_features())
 
-        for i in range(settings.initial_number_of_features):
-            feature_label = choice(available_feature_labels)
-            feature_dict[feature_label] = feature_table.get_random_value(feature_label)
+        for i in range(config.initial_number_of_features):
+            feature_label = rng.choice(available_feature_labels)
+            feature_dict[feature_label] = feature_table.get_random_value(feature_label, rng)
             available_feature_labels.remove(feature_label)
         return FeatureBundle(feature_dict, feature_table)
 
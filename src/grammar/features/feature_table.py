@@ -2,18 +2,22 @@ import codecs
 import json
 import logging
 import os
-from copy import deepcopy
+import random
 from io import StringIO
-from random import choice
 from typing import Any
+from weakref import WeakValueDictionary
 
 from six import iterkeys, string_types, integer_types
 
 from src.exceptions import FeatureParseError, UnknownFeatureError
 from src.grammar.features.feature_list import FeatureList
+from src.utils.fingerprint_tools import get_string_fingerprint
 
 logger = logging.getLogger(__name__)
 
+# every feature table of the process by fingerprint - the one that copies of the grammars and transducers refer to
+_feature_tables: WeakValueDictionary[int, "FeatureTable"] = WeakValueDictionary()
+
 
 class FeatureTable:
     def __init__(self, feature_table_raw: dict[str, Any]):
@@ -40,6 +44,22 @@ class FeatureTable:
 
         for symbol in self.get_alphabet():
             self._segments.append(Segment(symbol, self))
+        self._segment_by_symbol: dict[str, Segment] = {segment.symbol: segment for segment in self._segments}
+
+        self._source_json: str = json.dumps({"feature": feature_table_raw["feature"],
+                                             "feature_table": feature_table_raw["feature_table"]})
+        self._fingerprint: int = get_string_fingerprint(json.dumps(
+            [[[feature.label, feature.values] for feature in self._features], self._segment_to_feature_dict],
+            sort_keys=True))
+        _feature_tables.setdefault(self._fingerprint, self)
+
+    def __reduce__(self):
+        """
+        Feature tables are immutable, so a copy is the registered table with the same fingerprint: pickling
+        a grammar or a transducer takes only a reference to the feature table and its segments. The source of the
+        table is pickled along, for processes that don't have the table yet.
+        """
+        return _get_feature_table, (self._fingerprint, self._source_json)
 
     def __repr__(self):
         return str(self)
@@ -100,24 +120,35 @@ class FeatureTable:
 
         return feature_table_dict
 
+    def get_fingerprint(self) -> int:
+        """identifies the features and the segments' values, the same in every process"""
+        return self._fingerprint
+
     def get_number_of_features(self) -> int:
         return len(self._features)
 
     def get_features(self) -> set[str]:
         return self._features.labels
 
-    def get_random_value(self, feature: int) -> str:
-        return choice(self._features[feature])
+    def get_random_value(self, feature: int, rng: random.Random) -> str:
+        return rng.choice(self._features[feature])
 
     def get_alphabet(self) -> list[str]:
         return list(iterkeys(self._segment_to_feature_dict))
 
+    def get_segment(self, symbol: str) -> "Segment":
+        """the segment of the symbol, shared by all the words"""
+        segment = self._segment_by_symbol.get(symbol)
+        if segment is None:
+            raise UnknownFeatureError(f"{symbol} is invalid")
+        return segment
+
     def get_segments(self) -> list['Segment']:
         """Returns a ***copy*** of the segments' list"""
-        return deepcopy(self._segments)
+        return list(self._segments)
 
-    def get_random_segment(self) -> str:
-        return choice(self.get_alphabet())
+    def get_random_segment(self, rng: random.Random) -> str:
+        return rng.choice(self.get_alphabet())
 
     def get_ordered_feature_vector(self, char) -> list[str]:
         return [self[char][str(feature)] for feature in self._index_to_feature.values()]
@@ -165,6 +196,12 @@ class Segment:
 
         self.hash = hash(self.symbol)
 
+    def __reduce__(self):
+        """pickled by reference to the segment of the registered feature table, see `FeatureTable.__reduce__`"""
+        if hasattr(self, "feature_table"):
+            return self.feature_table.get_segment, (self.symbol,)
+        return Segment, (self.symbol,)
+
     @staticmethod
     def intersect(x, y):
         """Intersect two segments, a segment and a set, or two sets.
@@ -226,6 +263,13 @@ class Segment:
         return self.symbol
 
 
+def _get_feature_table(fingerprint: int, source_json: str) -> FeatureTable:
+    feature_table = _feature_tables.get(fingerprint)
+    if feature_table is None:
+        feature_table = FeatureTable(json.loads(source_json))
+    return feature_table
+
+
 # Special segments - required for transducer construction
 NULL_SEGMENT = Segment("-")
 JOKER_SEGMENT = Segment("*")
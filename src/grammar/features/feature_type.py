@@ -1,5 +1,5 @@
 from io import StringIO
-from random import choice
+import random
 
 
 class FeatureType:
@@ -7,8 +7,8 @@ class FeatureType:
         self.label: str = label
         self.values: list[str] = values
 
-    def get_random_value(self):
-        return choice(self.values)
+    def get_random_value(self, rng: random.Random):
+        return rng.choice(self.values)
 
     def __str__(self):
         values_str_io = StringIO()
@@ -2,76 +2,88 @@
 from __future__ import absolute_import, division, print_function, unicode_literals
 
 import logging
-from random import choice
+import random
+from functools import partial
 
 from src.grammar.constraint_set import ConstraintSet
 from src.grammar.features.feature_table import FeatureTable
 from src.grammar.lexicon import Word, Lexicon
-from src.models.otml_configuration import settings
+from src.grammar.undo_log import UndoLog
+from src.models.cache_manager import CacheManager, get_default_cache_manager
+from src.models.generation_store import generation_store
+from src.models.otml_configuration import RunConfiguration, settings
+from src.models.output_automaton import OutputAutomaton
 from src.models.transducer import Transducer
+from src.models.transducer_disk_cache import transducer_disk_cache
 from src.utils.debug_tools import write_to_dot
 from src.utils.randomization_tools import get_weighted_list
 from src.utils.transducers_optimization_tools import optimize_transducer_grammar_for_word, make_optimal_paths
 
 logger = logging.getLogger(__name__)
 
-generation_memoization: dict[tuple[ConstraintSet, str], str] = dict()
-
-grammar_transducers = dict()
-
 
 class Grammar:
     """This class represents an Optimality Theory grammar."""
 
     def __init__(self, feature_table: FeatureTable, constraint_set: ConstraintSet, lexicon: Lexicon,
-                 grammar_name: str = ""):
+                 grammar_name: str = "", cache_manager: CacheManager | None = None,
+                 config: RunConfiguration | None = None):
         self.feature_table: FeatureTable = feature_table
         self.constraint_set: ConstraintSet = constraint_set
         self.lexicon: Lexicon = lexicon  # all the words (probably UR) # TODO: verify if this is UR or SR
         self._grammar_name: str = grammar_name
+        # the configuration of the run - a snapshot of the active configuration unless given
+        self.config: RunConfiguration = config or settings.freeze()
+        # the transducers and outputs of this grammar are cached there - shared with the grammars that have it
+        self.cache_manager: CacheManager = cache_manager or get_default_cache_manager(feature_table, self.config)
 
     def __str__(self):
-        return f"Grammar with [{self.constraint_set}]; and [{self.lexicon}]"
+        return (f"Grammar with [{self.constraint_set}]; "
+                f"and [{self.lexicon.get_description(self.config.log_lexicon_words)}]")
 
     def __hash__(self):
         return hash(str(self))
 
-    @staticmethod
-    def clear_caching():
-        global generation_memoization
-        generation_memoization = dict()
-
-        global grammar_transducers
-        grammar_transducers = dict()
-
     def get_encoding_length(self):
         """G + D:G"""
-        return self.constraint_set.get_encoding_length() + self.lexicon.get_encoding_length()
+        return self.constraint_set.get_encoding_length() + self.lexicon.get_encoding_length(self.config)
+
+    def get_fingerprint(self) -> tuple[int, int]:
+        """identifies the constraint set ranking and the lexicon words, see `ConstraintSet.get_fingerprint`"""
+        return self.constraint_set.get_fingerprint(), self.lexicon.get_fingerprint()
 
-    def make_mutation(self):
-        """Mutate either the lexicon or the constraint set"""
-        mutation_weights = [(self.lexicon, settings.lexicon_mutation_weights.sum),
-                            (self.constraint_set, settings.constraint_set_mutation_weights.sum), ]
+    def make_mutation(self, undo_log: UndoLog, rng: random.Random):
+        """Mutate either the lexicon or the constraint set, in place. The changes are recorded in undo_log"""
+        mutation_weights = [(self.lexicon.make_mutation, self.config.lexicon_mutation_weights.sum),
+                            (partial(self.constraint_set.make_mutation, cache_manager=self.cache_manager),
+                             self.config.constraint_set_mutation_weights.sum), ]
 
-        weighted_mutatable_object_list = get_weighted_list(mutation_weights)
-        object_to_mutate = choice(weighted_mutatable_object_list)
-        mutation = object_to_mutate.make_mutation()
+        weighted_mutation_function_list = get_weighted_list(mutation_weights)
+        mutation = rng.choice(weighted_mutation_function_list)(undo_log, rng, self.config)
         return mutation
 
     def get_transducer(self):
-        constraint_set_key = str(self.constraint_set)  # constraint_set is the identifier of the grammar transducer
+        """
+        The ties between equally harmonic paths are broken when the transducer is made, by a generator seeded with the
+        fingerprint of the ranking - the transducer of a ranking is the same whichever run, process or cache makes it
+        """
+        constraint_set_key = self.constraint_set.get_key()  # constraint_set is the identifier of the grammar transducer
 
-        if constraint_set_key in grammar_transducers:
-            return grammar_transducers[constraint_set_key]
+        transducer = self.cache_manager.grammar_transducers.get(constraint_set_key)
+        if transducer is not None:
+            return transducer
 
-        transducer = self._make_transducer()
-        grammar_transducers[constraint_set_key] = transducer
+        transducer = transducer_disk_cache.get_transducer("grammar", self.feature_table, constraint_set_key,
+                                                          self._make_transducer, self.config)
+        self.cache_manager.grammar_transducers[constraint_set_key] = transducer
         return transducer
 
     def _make_transducer(self):
-        constraint_set_transducer = self.constraint_set.get_transducer()
+        constraint_set_transducer = self.constraint_set.get_transducer(self.cache_manager, self.config)
+        rng = random.Random(self.constraint_set.get_fingerprint())
         try:
-            make_optimal_paths_result = make_optimal_paths(constraint_set_transducer, self.feature_table)
+            make_optimal_paths_result = make_optimal_paths(constraint_set_transducer, self.feature_table,
+                                                           self.cache_manager, rng)
         except Exception as ex:
             logger.error("make_optimal_paths failed. transducer dot are being printed")
             # write_to_dot(constraint_set_transducer,"constraint_set_transducer")
@@ -82,21 +94,33 @@ class Grammar:
 
         return make_optimal_paths_result
 
-    def generate(self, word: Word):
+    def generate(self, word: Word) -> set[str]:
         """
         Receives a UR and generates its SR according to this grammar.
+        All the outputs are enumerated - `get_output_automaton` answers queries about them without enumerating them.
         """
-        memoization_key = (self.constraint_set, str(word))
-        if memoization_key in generation_memoization:
-            return generation_memoization[memoization_key]
-
-        outputs = self._get_outputs(word, save_to_dot=False)
-        generation_memoization[memoization_key] = outputs
-        return outputs
+        return self.get_output_automaton(word).get_outputs()
+
+    def get_output_automaton(self, word: Word) -> OutputAutomaton:
+        """the outputs of the UR, see `OutputAutomaton`"""
+        constraint_set_key = self.constraint_set.get_key()
+        memoization_key = (constraint_set_key, str(word))
+        output_automaton = self.cache_manager.generation_memoization.get(memoization_key)
+        if output_automaton is not None:
+            return output_automaton
+
+        output_automaton = generation_store.get_output_automaton(
+            self.feature_table, constraint_set_key, str(word),
+            lambda: self._get_output_automaton(word, save_to_dot=False), self.config)
+        self.cache_manager.generation_memoization[memoization_key] = output_automaton
+        return output_automaton
 
     def _get_outputs(self, word: Word, save_to_dot: bool = True):
+        return self._get_output_automaton(word, save_to_dot).get_outputs()
+
+    def _get_output_automaton(self, word: Word, save_to_dot: bool = True) -> OutputAutomaton:
         grammar_transducer = self.get_transducer()
-        word_transducer = word.get_transducer()
+        word_transducer = word.get_transducer(self.cache_manager)
 
         if save_to_dot:  # TODO: separate writing into different function
             write_to_dot(grammar_transducer, f"{self._grammar_name}_grammar_transducer")
@@ -108,8 +132,7 @@ class Grammar:
 
         intersected_transducer.clear_dead_states()
         intersected_transducer = optimize_transducer_grammar_for_word(word, intersected_transducer)
-        outputs = intersected_transducer.get_range()
-        return outputs
+        return OutputAutomaton.from_transducer(intersected_transducer).get_compact()
 
     def get_all_outputs_grammar(self, new_string_word_list=[]):
         """
@@ -3,21 +3,23 @@ from __future__ import absolute_import, division, print_function, unicode_litera
 
 import codecs
 import logging
+import random
 from ast import literal_eval
+from collections import Counter
 from math import log, ceil
-from random import choice, randint
 
 from src.grammar.features.feature_table import FeatureTable, Segment, NULL_SEGMENT, JOKER_SEGMENT
-from src.models.otml_configuration import settings
+from src.grammar.undo_log import UndoLog
+from src.models.cache_manager import CacheManager
+from src.models.otml_configuration import RunConfiguration
 from src.models.transducer import CostVector, Arc, State, Transducer
+from src.utils.fingerprint_tools import get_string_fingerprint, FINGERPRINT_MASK
 from src.utils.randomization_tools import get_weighted_list
 
 DEFAULT_LEX_CATEGORY = "default"
 
 logger = logging.getLogger(__name__)
 
-word_transducers = dict()
-
 
 class Word:
     __slots__ = ["word_string", "feature_table", "segments"]
@@ -28,17 +30,17 @@ class Word:
         """  # TODO: consider adding the lexical category here
         self.word_string: str = word_string
         self.feature_table: FeatureTable = feature_table
-        self.segments: list[Segment] = [Segment(char, self.feature_table) for char in self.word_string]
+        self.segments: list[Segment] = [self.feature_table.get_segment(char) for char in self.word_string]
 
     def __str__(self):
         return self.word_string
 
-    def change_segment(self):
+    def change_segment(self, undo_log: UndoLog, rng: random.Random):
         """changing the word_string and therefore the segments composing it
            and making sure the new segment is not identical to segment being replaced"""
         logging.debug("change_segment")
         word_string_list = list(self.word_string)  # Making a mutable list from immutable string
-        index_of_change = randint(0, len(self.word_string) - 1)
+        index_of_change = rng.randint(0, len(self.word_string) - 1)
         old_segment = word_string_list[index_of_change]
 
         segment_options_list = self.feature_table.get_alphabet()
@@ -48,10 +50,10 @@ class Word:
         if not segment_options_list:  # there are no change candidates
             return False
 
-        new_segment = choice(segment_options_list)
+        new_segment = rng.choice(segment_options_list)
         word_string_list[index_of_change] = new_segment
         new_word_string = ''.join(word_string_list)
-        self._set_word_string(new_word_string)
+        self._change_word_string(new_word_string, undo_log)
         return True
 
     @staticmethod
@@ -61,44 +63,47 @@ class Word:
         #         return False
         return True
 
-    def insert_segment(self, segment_to_insert):
+    def insert_segment(self, segment_to_insert, undo_log: UndoLog, rng: random.Random):
         logging.debug("insert_segment")
         old_word_string = self.word_string
-        index_of_insertion = randint(0, len(self.word_string))
+        index_of_insertion = rng.randint(0, len(self.word_string))
         new_word_string = self.word_string[:index_of_insertion] + segment_to_insert + \
                           self.word_string[index_of_insertion:]
 
         if self.is_appropriate(new_word_string):
-            self._set_word_string(new_word_string)
+            self._change_word_string(new_word_string, undo_log)
             # logger.info("insert_segment: put {} in {} (at position {}) ".format(segment_to_insert, new_word_string,
             #                                                               index_of_insertion))
             return True
         else:
             return False
 
-    def delete_segment(self):
+    def delete_segment(self, undo_log: UndoLog, rng: random.Random):
         logging.debug("delete_segment")
         old_word_string = self.word_string
-        index_of_deletion = randint(0, len(self.word_string) - 1)
+        index_of_deletion = rng.randint(0, len(self.word_string) - 1)
         new_word_string = self.word_string[:index_of_deletion] + self.word_string[index_of_deletion + 1:]
         if not self.is_appropriate(new_word_string):
             return False
-        self._set_word_string(new_word_string)
+        self._change_word_string(new_word_string, undo_log)
         # print(f"delete segment: {old_word_string} -> {new_word_string}")
         return True
 
+    def _change_word_string(self, new_word_string, undo_log: UndoLog):
+        undo_log.record(self._set_word_string, self.word_string)
+        self._set_word_string(new_word_string)
+
     def _set_word_string(self, new_word_string):
         self.word_string = new_word_string
-        self.segments = [Segment(char, self.feature_table) for char in self.word_string]
+        self.segments = [self.feature_table.get_segment(char) for char in self.word_string]
 
-    def get_transducer(self):
-        word_key = str(self)
-        if word_key in word_transducers:
-            return word_transducers[word_key]
-        else:
+    def get_transducer(self, cache_manager: CacheManager):
+        word_transducers = cache_manager.word_transducers
+        transducer = word_transducers.get(self.word_string)
+        if transducer is None:
             transducer = self._make_transducer()
-            word_transducers[word_key] = transducer
-            return transducer
+            word_transducers[self.word_string] = transducer
+        return transducer
 
     def _make_transducer(self):
         segments = self.feature_table.get_segments()
@@ -123,11 +128,6 @@ class Word:
     def get_segments(self):
         return self.segments
 
-    @staticmethod
-    def clear_caching():
-        global word_transducers
-        word_transducers = dict()
-
     def __str__(self):
         return self.word_string
 
@@ -149,9 +149,24 @@ class Lexicon:
         """
         self.words: list[Word] = [Word(word_string, feature_table) for word_string in words]
         self.feature_table: FeatureTable = feature_table
+        # (old word string, new word string) for every word changed by mutations. None stands for no word
+        self._word_changes: list[tuple[str | None, str | None]] = list()
+        self._fingerprint: int = sum(get_string_fingerprint(word_string) for word_string in words) & FINGERPRINT_MASK
+
+        # kept up to date by every word change, for the encoding length
+        self._word_counts: Counter[str] = Counter()
+        self._segment_counts: Counter[str] = Counter()
+        self._number_of_segments: int = 0
+        self._segments_encoding_length: int = 0  # of all the segments of all the words
+        for word_string in words:
+            self._count_word_change(None, word_string)
 
     def __str__(self):
-        if settings.log_lexicon_words:
+        return self.get_description(log_words=False)
+
+    def get_description(self, log_words: bool) -> str:
+        """with the words themselves if log_words, see the `log_lexicon_words` setting"""
+        if log_words:
             return (f"Lexicon: {len(self.words)} words: {[str(word) for word in self.words]} "
                     f"with {self._get_number_of_segments()} segments in total")
         else:
@@ -164,54 +179,123 @@ class Lexicon:
     def __len__(self):
         return len(self.words)
 
-    def make_mutation(self):
+    def make_mutation(self, undo_log: UndoLog, rng: random.Random, config: RunConfiguration):
         """
         rtype: boolean - the mutation success
         """
-        mutation_weights = [(self._insert_segment, settings.lexicon_mutation_weights.insert_segment),
-                            (self._delete_segment, settings.lexicon_mutation_weights.delete_segment),
-                            (self._change_segment, settings.lexicon_mutation_weights.change_segment)]
+        undo_log.record(self._truncate_word_changes, len(self._word_changes))
+        mutation_weights = [(self._insert_segment, config.lexicon_mutation_weights.insert_segment),
+                            (self._delete_segment, config.lexicon_mutation_weights.delete_segment),
+                            (self._change_segment, config.lexicon_mutation_weights.change_segment)]
 
         weighted_mutation_function_list = get_weighted_list(mutation_weights)
-        return choice(weighted_mutation_function_list)()
+        return rng.choice(weighted_mutation_function_list)(undo_log, rng)
 
-    def _change_segment(self):
-        return choice(self.words).change_segment()
+    def _change_segment(self, undo_log: UndoLog, rng: random.Random):
+        selected_word = rng.choice(self.words)
+        old_word_string = str(selected_word)
+        if selected_word.change_segment(undo_log, rng):
+            self._add_word_change(old_word_string, str(selected_word), undo_log)
+            return True
+        return False
 
-    def _insert_segment(self):
-        segment_to_insert = self.feature_table.get_random_segment()
+    def _insert_segment(self, undo_log: UndoLog, rng: random.Random):
+        segment_to_insert = self.feature_table.get_random_segment(rng)
         n = len(self.words)
-        index_of_word_to_change = randint(0, n)
+        index_of_word_to_change = rng.randint(0, n)
         if index_of_word_to_change == n:
             w = Word(segment_to_insert, self.feature_table)  # create a new monosegmental word
             self.words.append(w)
+            undo_log.record(self.words.pop)
+            self._add_word_change(None, segment_to_insert, undo_log)
             return True
         else:
-            return self.words[index_of_word_to_change].insert_segment(segment_to_insert)
+            selected_word = self.words[index_of_word_to_change]
+            old_word_string = str(selected_word)
+            if selected_word.insert_segment(segment_to_insert, undo_log, rng):
+                self._add_word_change(old_word_string, str(selected_word), undo_log)
+                return True
+            return False
 
-    def _delete_segment(self):
+    def _delete_segment(self, undo_log: UndoLog, rng: random.Random):
         try:
-            selected_word = choice(self.words)
+            selected_word = rng.choice(self.words)
         except IndexError:
             pass
+        old_word_string = str(selected_word)
         if len(selected_word) == 1:
-            self.words.remove(selected_word)
+            index_of_deletion = self.words.index(selected_word)  # of the first word that is equal to it
+            deleted_word = self.words.pop(index_of_deletion)
+            undo_log.record(self.words.insert, index_of_deletion, deleted_word)
+            self._add_word_change(old_word_string, None, undo_log)
             return True
-        else:
-            return selected_word.delete_segment()
+        elif selected_word.delete_segment(undo_log, rng):
+            self._add_word_change(old_word_string, str(selected_word), undo_log)
+            return True
+        return False
+
+    def _add_word_change(self, old_word_string: str | None, new_word_string: str | None, undo_log: UndoLog):
+        self._word_changes.append((old_word_string, new_word_string))
+        self._count_word_change(old_word_string, new_word_string)
+        undo_log.record(self._count_word_change, new_word_string, old_word_string)
+        undo_log.record(self._set_fingerprint, self._fingerprint)
+        fingerprint = self._fingerprint
+        if old_word_string is not None:
+            fingerprint -= get_string_fingerprint(old_word_string)
+        if new_word_string is not None:
+            fingerprint += get_string_fingerprint(new_word_string)
+        self._fingerprint = fingerprint & FINGERPRINT_MASK
+
+    def _count_word_change(self, old_word_string: str | None, new_word_string: str | None):
+        for word_string, sign in ((old_word_string, -1), (new_word_string, 1)):
+            if word_string is None:
+                continue
+            self._word_counts[word_string] += sign
+            if not self._word_counts[word_string]:
+                del self._word_counts[word_string]
+            for symbol in word_string:
+                self._segment_counts[symbol] += sign
+                if not self._segment_counts[symbol]:
+                    del self._segment_counts[symbol]
+                self._segments_encoding_length += sign * len(self.feature_table[symbol])
+            self._number_of_segments += sign * len(word_string)
+
+    def get_fingerprint(self) -> int:
+        """identifies the multiset of the lexicon words - it is the same for lexicons with the same words"""
+        return self._fingerprint
+
+    def _set_fingerprint(self, fingerprint: int):
+        self._fingerprint = fingerprint
+
+    def get_word_changes(self) -> list[tuple[str | None, str | None]]:
+        """the word changes that `pop_word_changes` would return, which are kept"""
+        return list(self._word_changes)
+
+    def pop_word_changes(self) -> list[tuple[str | None, str | None]]:
+        """
+        Returns the (old word string, new word string) pairs of the words changed since the last call.
+        None stands for no word - i.e. a word that was added or removed.
+        """
+        word_changes = self._word_changes
+        self._word_changes = list()
+        return word_changes
 
-    def get_encoding_length(self):
-        if settings.restriction_on_alphabet:
+    def _truncate_word_changes(self, length):
+        del self._word_changes[length:]  # a no-op if the changes were already popped
+
+    def get_encoding_length(self, config: RunConfiguration):
+        if config.restriction_on_alphabet:
             alphabet_size = len(self.feature_table.get_alphabet())
-            restricted_alphabet_size = len(self.get_distinct_segments())
+            restricted_alphabet_size = len(self._segment_counts)
             number_of_bits = ceil(log(alphabet_size + 1, 2))
             restriction_set_length = number_of_bits * (restricted_alphabet_size + 1)
             number_of_bits = ceil(log(restricted_alphabet_size + 1, 2))
-            lexicon_length = number_of_bits * (sum((len(word) + 1) for word in self.words) + 1)
+            lexicon_length = number_of_bits * (self._number_of_segments + len(self.words) + 1)  # a delimiter per word
             return restriction_set_length + lexicon_length
         else:
             number_of_bits = 2
-            return number_of_bits * (sum(word.get_encoding_length() for word in self.words) + 1)
+            # the sum of `Word.get_encoding_length` over the words
+            return number_of_bits * (self._segments_encoding_length + len(self.words) + 1)
 
     def get_distinct_segments(self):
         distinct_segments = set()
@@ -223,10 +307,10 @@ class Lexicon:
         return self.words
 
     def get_number_of_distinct_words(self):
-        return len(set(self.words))
+        return len(self._word_counts)
 
     def _get_number_of_segments(self):
-        return sum([len(word) for word in self.words])
+        return self._number_of_segments
 
 
 def get_words_from_file(corpus_file_name):
@@ -250,7 +334,7 @@ def parse_words_per_category_from_file(corpus_file_name):
 
     words_raw = corpus_string.split()
     words_split = [word.split("_") for word in words_raw]
-    categories = {word[1] for word in words_split if len(word) > 1}
+    categories = sorted({word[1] for word in words_split if len(word) > 1})  # learned in this order
     words_per_category = {cat: [word[0] for word in words_split if len(word) > 1 and word[1] == cat] for cat in
                           categories}
     words_per_category[DEFAULT_LEX_CATEGORY] = [word[0] for word in words_split if len(word) == 1]
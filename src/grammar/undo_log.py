@@ -0,0 +1,27 @@
+class UndoLog:
+    """
+    Records how to revert in-place mutations, so a rejected neighbor hypothesis can be rolled back instead of
+    mutating a copy of the current one.
+
+    Every entry is a function and the arguments that revert a single change. Rolling back calls them in reverse order.
+    """
+
+    def __init__(self):
+        self._entries: list[tuple] = list()
+
+    def record(self, undo_function, *args) -> None:
+        self._entries.append((undo_function, args))
+
+    def commit(self) -> None:
+        """keep all the changes recorded so far"""
+        self._entries = list()
+
+    def rollback(self) -> None:
+        """revert all the changes recorded since the last commit"""
+        entries = self._entries
+        self._entries = list()
+        for undo_function, args in reversed(entries):
+            undo_function(*args)
+
+    def __len__(self):
+        return len(self._entries)
@@ -1,5 +1,8 @@
+import multiprocessing
 import os
+import pickle
 
+from src.exceptions import OtmlConfigurationError
 from src.grammar.constraint_set import ConstraintSet
 from src.grammar.features.feature_table import FeatureTable
 from src.grammar.grammar import Grammar
@@ -11,6 +14,8 @@ from src.simulated_annealing import SimulatedAnnealing
 
 SIMULATIONS_DIR = 'simulations'
 
+_restart_simulated_annealing: SimulatedAnnealing | None = None  # given once to every restart worker
+
 
 def init_simulated_annealing(simulation_name: str):
     """
@@ -37,7 +42,7 @@ def init_simulated_annealing(simulation_name: str):
             constraint_set, lexicon,
             grammar_name=simulation_name
         ),
-        data=corpus.get_words()
+        data=corpus.get_word_counts()
     )
     return SimulatedAnnealing(initial_hypothesis)
 
@@ -54,7 +59,8 @@ def run_simulated_annealing_with_prints(simulated_annealing: SimulatedAnnealing)
     """
     print("Starting optimization")
     initial_grammar = simulated_annealing.current_hypothesis.grammar
-    print(f'# Initial Lexicon: {initial_grammar.lexicon}')
+    log_lexicon_words = simulated_annealing.config.log_lexicon_words
+    print(f'# Initial Lexicon: {initial_grammar.lexicon.get_description(log_lexicon_words)}')
     print(f'# Initial Feature table: {initial_grammar.feature_table}')
     print(f'# Initial Constraints Set: {initial_grammar.constraint_set}')
 
@@ -63,15 +69,68 @@ def run_simulated_annealing_with_prints(simulated_annealing: SimulatedAnnealing)
 
     print(f'Ran {step} steps.')
 
+    simulated_annealing.initial_hypothesis.update_energy()  # the run evaluated a copy of it
     print(f'Initial hypothesis: {simulated_annealing.initial_hypothesis}')
     print(f'Final hypothesis: {simulated_annealing.current_hypothesis}')
 
-    print(f'# Lexicon: {final_grammar.lexicon}')
+    print(f'# Lexicon: {final_grammar.lexicon.get_description(log_lexicon_words)}')
     print(f'# Feature table: {final_grammar.feature_table}')
     print(f'# Constraints Set: {final_grammar.constraint_set}')
     return final_grammar
 
 
+def run_simulated_annealing_restarts(simulated_annealing: SimulatedAnnealing, seeds: list[int],
+                                     number_of_processes: int | None = None
+                                     ) -> tuple[int, TraversableGrammarHypothesis]:
+    """
+    Run independent restarts of a simulated annealing, one per seed, in a process pool and keep the best one.
+
+    Every worker gets the simulated annealing once and copies it for every seed it runs. The module caches are
+    cleared before each run, so a seed reproduces the result of a standalone run with that seed. The workers are
+    daemonic processes, which can't have a pool of their own, so the restarts can't make speculative steps.
+
+    Args:
+        simulated_annealing (SimulatedAnnealing): The simulated annealing to restart, not run yet.
+        seeds (list[int]): The seed of every restart.
+        number_of_processes (int | None): Size of the pool. Defaults to the number of CPUs.
+
+    Returns:
+        tuple: The number of steps and the final hypothesis of the restart with the lowest energy.
+
+    Raises:
+        OtmlConfigurationError: If the simulated annealing is configured with a `speculative_batch_size` over 1.
+    """
+    if simulated_annealing.config.speculative_batch_size > 1:
+        raise OtmlConfigurationError("Restarts can't make speculative steps",
+                                     {"speculative_batch_size": simulated_annealing.config.speculative_batch_size})
+
+    best_result = None
+    with multiprocessing.Pool(number_of_processes, initializer=_init_restart_worker,
+                              initargs=(simulated_annealing,)) as pool:
+        for seed, step, energy, hypothesis in pool.imap_unordered(_run_restart, seeds):
+            print(f'Seed {seed}: ran {step} steps, final energy {energy:,}')
+            if best_result is None or energy < best_result[2]:
+                best_result = (seed, step, energy, hypothesis)
+
+    seed, step, energy, hypothesis = best_result
+    print(f'Best seed: {seed} with energy {energy:,}')
+    return step, hypothesis
+
+
+def _init_restart_worker(simulated_annealing: SimulatedAnnealing):
+    global _restart_simulated_annealing
+    _restart_simulated_annealing = simulated_annealing
+
+
+def _run_restart(seed: int) -> tuple[int, int, int, TraversableGrammarHypothesis]:
+    simulated_annealing = pickle.loads(pickle.dumps(_restart_simulated_annealing, -1))
+    simulated_annealing.seed = seed
+    simulated_annealing.clear_modules_caching()
+    step, hypothesis = simulated_annealing.run()
+    # sent back without its energy cache
+    return seed, step, simulated_annealing.current_hypothesis_energy, hypothesis.get_detached_copy()
+
+
 def init_simulated_annealing_categories(simulation_name: str):
     """
     Initialize simulated annealing processes for multiple lexical categories.
@@ -101,7 +160,7 @@ def init_simulated_annealing_categories(simulation_name: str):
                 lexicon_per_category[cat],
                 grammar_name=f'{simulation_name}_{cat}',
             ),
-            data=corpus_per_category[cat].get_words()
+            data=corpus_per_category[cat].get_word_counts()
         ) for cat in lexical_categories}
 
     simulated_annealing_per_category = {cat: SimulatedAnnealing(initial_hypothesis) for cat, initial_hypothesis in
@@ -0,0 +1,221 @@
+"""
+The caches of transducers and generated outputs. A `Grammar` owns a `CacheManager` - by default the process-wide
+one of its feature table, `get_default_cache_manager` - and every grammar with the same cache manager shares its
+entries, also between `SimulatedAnnealing` instances (e.g. the learners of categories) and between threads: the caches
+are safe for concurrent readers and writers.
+
+The cache keys - constraint keys, constraint set keys and URs - don't identify the feature table the transducers are
+compiled over, so the grammars of different feature tables must not share a cache manager.
+
+Every cache has a budget, from the `cache_budgets` setting of the run that makes the cache manager: transducers are
+measured by their number of arcs (most of their memory) and output automata by their number of entries. When a cache
+goes over its budget it evicts its least recently used entries, except the pinned ones - the entries of the current
+hypotheses, see `CacheManager.pin_grammar`.
+In checkpoints (`CacheManager.get_state`) the transducers are saved as `CompactTransducer`s.
+"""
+import logging
+import threading
+from collections import OrderedDict
+from typing import Any, Callable, Hashable, Iterable
+
+from src.models.compact_transducer import CompactTransducer
+from src.models.otml_configuration import CacheBudgets, RunConfiguration
+from src.models.transducer_disk_cache import get_compilation_fingerprint
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CACHE_MANAGER_NAME = "default"
+INTERNED_CONSTRAINT_KEYS_BUDGET = 10_000
+
+_cache_managers: dict[str, "CacheManager"] = dict()
+_cache_managers_lock = threading.Lock()
+
+
+def get_transducer_size(transducer) -> int:
+    return len(transducer.get_arcs())
+
+
+class LRUCache:
+    def __init__(self, name: str, budget: int, get_entry_size: Callable[[Any], int] | None = None):
+        self.name = name
+        self.budget = budget
+        self._get_entry_size = get_entry_size
+        self._lock = threading.RLock()
+        self._entries: OrderedDict[Hashable, Any] = OrderedDict()
+        self._entry_sizes: dict[Hashable, int] = dict()
+        self._pinned_keys_by_owner: dict[Hashable, frozenset] = dict()
+        self.size = 0
+        self.number_of_evictions = 0
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        with self._lock:
+            if key not in self._entries:
+                return default
+            self._entries.move_to_end(key)
+            return self._entries[key]
+
+    def __contains__(self, key: Hashable) -> bool:
+        with self._lock:
+            return key in self._entries
+
+    def __setitem__(self, key: Hashable, value: Any):
+        entry_size = self._get_entry_size(value) if self._get_entry_size else 1
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = value
+            self._entry_sizes[key] = entry_size
+            self.size += entry_size
+            self._evict()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _remove(self, key: Hashable):
+        del self._entries[key]
+        self.size -= self._entry_sizes.pop(key)
+
+    def _evict(self):
+        number_of_unchecked_entries = len(self._entries)
+        while self.size > self.budget and number_of_unchecked_entries:
+            number_of_unchecked_entries -= 1
+            key = next(iter(self._entries))
+            if self._is_pinned(key):
+                self._entries.move_to_end(key)
+            else:
+                self._remove(key)
+                self.number_of_evictions += 1
+
+    def _is_pinned(self, key: Hashable) -> bool:
+        return any(key in pinned_keys for pinned_keys in self._pinned_keys_by_owner.values())
+
+    def pin(self, owner: Hashable, keys: Iterable[Hashable]):
+        """
+        Keep the entries of keys, replacing the keys previously pinned by owner. The keys don't have to be in the
+        cache
+        """
+        pinned_keys = frozenset(keys)
+        with self._lock:
+            self._pinned_keys_by_owner[owner] = pinned_keys
+
+    def unpin(self, owner: Hashable):
+        with self._lock:
+            self._pinned_keys_by_owner.pop(owner, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries = OrderedDict()
+            self._entry_sizes = dict()
+            self.size = 0
+
+    def items(self) -> list[tuple[Hashable, Any]]:
+        with self._lock:
+            return list(self._entries.items())
+
+    def update(self, entries: Iterable[tuple[Hashable, Any]]):
+        for key, value in entries:
+            self[key] = value
+
+
+# constraint key -> (one instance of the key, so that equal keys are mostly compared by identity, its fingerprint) -
+# of every feature table, see `Constraint.get_key`. An evicted key is only made again: the keys are equal anyway
+interned_constraint_keys = LRUCache("interned_constraint_keys", INTERNED_CONSTRAINT_KEYS_BUDGET)
+
+
+class CacheManager:
+    """
+    Get one with `get_default_cache_manager` or `get_cache_manager`. It is pickled by name, so copies of grammars (and
+    checkpoints) refer to the cache manager of the same name in the process that loads them, without carrying the
+    caches along.
+    """
+
+    def __init__(self, name: str, cache_budgets: CacheBudgets):
+        self.name = name
+        self.cache_budgets = cache_budgets
+        # (constraint set key, UR) -> output automaton
+        self.generation_memoization = LRUCache("generation_memoization", cache_budgets.generation_memoization)
+        self.grammar_transducers = LRUCache("grammar_transducers", cache_budgets.grammar_transducers,
+                                            get_transducer_size)
+        self.constraint_set_transducers = LRUCache("constraint_set_transducers",
+                                                   cache_budgets.constraint_set_transducers, get_transducer_size)
+        self.constraint_transducers = LRUCache("constraint_transducers", cache_budgets.constraint_transducers,
+                                               get_transducer_size)
+        self.word_transducers = LRUCache("word_transducers", cache_budgets.word_transducers, get_transducer_size)
+        self.transducer_caches: list[LRUCache] = [self.grammar_transducers, self.constraint_set_transducers,
+                                                  self.constraint_transducers, self.word_transducers]
+        self.caches: dict[str, LRUCache] = {cache.name: cache for cache in
+                                            [self.generation_memoization, self.grammar_transducers,
+                                             self.constraint_set_transducers, self.constraint_transducers,
+                                             self.word_transducers]}
+
+    def __reduce__(self):
+        return get_cache_manager, (self.name, self.cache_budgets)
+
+    def pin_grammar(self, owner: Hashable, grammar):
+        """Pin the entries that the grammar - usually the current hypothesis of owner - uses"""
+        constraint_set_key = grammar.constraint_set.get_key()
+        constraint_keys = {constraint.get_key() for constraint in grammar.constraint_set.constraints}
+        word_keys = {str(word) for word in grammar.lexicon.get_words()}
+        self.grammar_transducers.pin(owner, {constraint_set_key})
+        self.constraint_set_transducers.pin(owner, {constraint_set_key})
+        self.constraint_transducers.pin(owner, constraint_keys)
+        self.word_transducers.pin(owner, word_keys)
+        self.generation_memoization.pin(owner, {(constraint_set_key, word_key) for word_key in word_keys})
+
+    def unpin(self, owner: Hashable):
+        for cache in self.caches.values():
+            cache.unpin(owner)
+
+    def clear(self):
+        for cache in self.caches.values():
+            cache.clear()
+
+    def get_state(self) -> dict[str, list[tuple[Hashable, Any]]]:
+        """The entries of every cache, from the least recently used, as saved in checkpoints"""
+        state = {name: cache.items() for name, cache in self.caches.items()}
+        for cache in self.transducer_caches:
+            state[cache.name] = [(key, CompactTransducer.from_transducer(transducer))
+                                 for key, transducer in state[cache.name]]
+        return state
+
+    def set_state(self, state: dict[str, list[tuple[Hashable, Any]]]):
+        self.clear()
+        for name, entries in state.items():
+            if self.caches[name] in self.transducer_caches:  # checkpoints older than compact transducers keep objects
+                entries = [(key, value.to_transducer() if isinstance(value, CompactTransducer) else value)
+                           for key, value in entries]
+            self.caches[name].update(entries)
+
+    def log_usage(self):
+        for name, cache in self.caches.items():
+            logger.info(f"{name}: {len(cache):,} entries, size {cache.size:,} of {cache.budget:,}, "
+                        f"{cache.number_of_evictions:,} evictions")
+
+
+def get_cache_manager(name: str, cache_budgets: CacheBudgets) -> CacheManager:
+    """The cache manager of the name in this process, made on first use - with the budgets given then"""
+    with _cache_managers_lock:
+        if name not in _cache_managers:
+            _cache_managers[name] = CacheManager(name, cache_budgets)
+        return _cache_managers[name]
+
+
+def get_default_cache_manager(feature_table, config: RunConfiguration) -> CacheManager:
+    """
+    The cache manager in this process of the grammars over the feature table - named by the compilation fingerprint
+    (see `get_compilation_fingerprint`), which also identifies the settings that the transducers are compiled with
+    """
+    return get_cache_manager(f"{DEFAULT_CACHE_MANAGER_NAME}_{get_compilation_fingerprint(feature_table, config):016x}",
+                             config.cache_budgets)
+
+
+def clear_cache_managers():
+    """
+    Clear every cache manager in this process, and the interned constraint keys, so that the next run starts with
+    empty caches, as in a new process
+    """
+    with _cache_managers_lock:
+        cache_managers = list(_cache_managers.values())
+    for cache_manager in cache_managers:
+        cache_manager.clear()
+    interned_constraint_keys.clear()
@@ -2,24 +2,31 @@
 from __future__ import absolute_import, division, print_function, unicode_literals
 
 import textwrap
+from collections import Counter
+from typing import Iterable, Mapping
 
 from src.grammar.lexicon import Word, get_words_from_file, parse_words_per_category_from_file
 from src.models.otml_configuration import settings
 
 
 class Corpus:
+    """
+    The words of the data as a multiset: every distinct word with its multiplicity, so that duplicating the corpus
+    costs nothing and membership is O(1).
+    """
 
-    def __init__(self, string_words):
-        self.words = string_words
+    def __init__(self, string_words: Iterable[str] | Mapping[str, int]):
+        self.word_counts: Counter[str] = Counter(string_words)
 
     def __str__(self):
-        return f"Corpus with {len(self)} words: {self.words[:3]}..."
-
-    def __getitem__(self, item):
-        return self.words.__getitem__(item)
+        return f"Corpus with {len(self)} words: {list(self.word_counts)[:3]}..."
 
     def __len__(self):
-        return len(self.words)
+        """the number of words, counting multiplicities"""
+        return sum(self.word_counts.values())
+
+    def __contains__(self, word: str):
+        return word in self.word_counts
 
     @classmethod
     def load(cls, corpus_file_name):
@@ -32,24 +39,32 @@ class Corpus:
         duplication_factor_fraction = duplication_factor - int(duplication_factor)
 
         n = len(words)
-        words_after_duplication = words * duplication_factor_int
-        words_after_duplication.extend(words[:int(n * duplication_factor_fraction)])
+        word_counts = Counter()
+        if duplication_factor_int:
+            for word in words:
+                word_counts[word] += duplication_factor_int
+        for word in words[:int(n * duplication_factor_fraction)]:  # the fraction duplicates a prefix of the words
+            word_counts[word] += 1
 
-        return cls(words_after_duplication)
+        return cls(word_counts)
 
     @classmethod
     def load_corpus_per_category(cls, corpus_file_name) -> dict[str, "Corpus"]:
         words_per_category = parse_words_per_category_from_file(corpus_file_name)
         return {cat: cls.init_with_duplication(words) for cat, words in words_per_category.items()}
 
-    def get_words(self):
-        return self.words[:]
+    def get_words(self) -> list[str]:
+        """every word repeated by its multiplicity"""
+        return list(self.word_counts.elements())
+
+    def get_word_counts(self) -> Counter[str]:
+        return self.word_counts.copy()
 
     def get_word_objects(self, feature_table):
-        return [Word(word_string, feature_table) for word_string in self.words()]
+        return [Word(word_string, feature_table) for word_string in self.get_words()]
 
     def print_corpus(self):
         print("Corpus ({0} words):".format(len(self)))
-        lines = textwrap.wrap(" ".join([word for word in self.words]), width=80)
+        lines = textwrap.wrap(" ".join(self.get_words()), width=80)
         for line in lines:
             print(line)
@@ -0,0 +1,78 @@
+"""
+An optional store of the outputs of generation on disk, shared by all the runs of a simulation folder on one host -
+e.g. the processes of a seed sweep - turned on by the `generation_store` setting.
+
+It is an SQLite database in WAL mode, so any number of processes read it while one writes. The output automata (see
+`OutputAutomaton`) are keyed by the compilation fingerprint of the feature table (see `get_compilation_fingerprint`),
+the ranking (key of the constraint set) and the UR. `generation_memoization` of `src.grammar.grammar` is the
+in-process cache in front of it.
+"""
+import logging
+import os
+import sqlite3
+import threading
+from hashlib import blake2b
+from typing import Callable
+
+from src.models.otml_configuration import RunConfiguration
+from src.models.output_automaton import OutputAutomaton
+from src.models.transducer_disk_cache import get_compilation_fingerprint
+
+logger = logging.getLogger(__name__)
+
+_BUSY_TIMEOUT_SECONDS = 30
+
+
+class GenerationStore(threading.local):
+    """Every thread has its own connection"""
+
+    def __init__(self):
+        self._connection: sqlite3.Connection | None = None
+        self._connection_key: tuple[int, str] | None = None  # (process id, file) of the connection
+
+    def get_output_automaton(self, feature_table, constraint_set_key: tuple, word_string: str,
+                             make_output_automaton: Callable[[], OutputAutomaton],
+                             config: RunConfiguration) -> OutputAutomaton:
+        """Load the output automaton of the UR, or make and store it"""
+        if not config.generation_store:
+            return make_output_automaton()
+
+        key = blake2b(repr((get_compilation_fingerprint(feature_table, config), constraint_set_key,
+                            word_string)).encode(), digest_size=16).digest()
+        try:
+            row = self._get_connection(config.generation_store_file).execute(
+                "SELECT automaton FROM output_automata WHERE key = ?", (key,)).fetchone()
+        except sqlite3.Error as ex:
+            logger.warning(f"Failed reading the generation store: {ex!r}")
+            return make_output_automaton()
+        if row is not None:
+            try:
+                return OutputAutomaton.loads(row[0])
+            except (ValueError, KeyError) as ex:
+                logger.warning(f"Failed loading an output automaton of the generation store, making it again: {ex!r}")
+
+        output_automaton = make_output_automaton()
+        try:
+            with self._get_connection(config.generation_store_file) as connection:
+                connection.execute("INSERT OR REPLACE INTO output_automata VALUES (?, ?)",
+                                   (key, output_automaton.dumps()))
+        except sqlite3.Error as ex:
+            logger.warning(f"Failed writing to the generation store: {ex!r}")
+        return output_automaton
+
+    def _get_connection(self, generation_store_file: str) -> sqlite3.Connection:
+        """A connection per process - connections must not cross a fork"""
+        connection_key = (os.getpid(), generation_store_file)
+        if self._connection_key != connection_key:
+            connection = sqlite3.connect(generation_store_file, timeout=_BUSY_TIMEOUT_SECONDS)
+            connection.execute("PRAGMA journal_mode = WAL")
+            connection.execute("PRAGMA synchronous = NORMAL")  # in WAL mode, still safe against process crashes
+            with connection:
+                connection.execute("CREATE TABLE IF NOT EXISTS output_automata "
+                                   "(key BLOB PRIMARY KEY, automaton TEXT NOT NULL) WITHOUT ROWID")
+            self._connection = connection
+            self._connection_key = connection_key
+        return self._connection
+
+
+generation_store = GenerationStore()
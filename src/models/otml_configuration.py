@@ -2,7 +2,7 @@ import json
 import os
 import sys
 from io import StringIO
-from typing import Any, Self
+from typing import Any, Literal, Self
 
 from pydantic import BaseModel, field_validator, model_validator, ConfigDict, NonNegativeInt
 
@@ -16,6 +16,9 @@ DATA_FILES = {
     "constraints_file": "constraints.json",
     "features_file": "features.json",
     "corpus_file": "corpus.txt",
+    "checkpoint_file": "checkpoint.pkl",
+    "transducer_cache_folder": "transducer_cache",
+    "generation_store_file": "generation_store.sqlite",
 }
 
 
@@ -37,6 +40,13 @@ class Model(BaseModel):
     def values(self):
         return self.dict().values()
 
+    def freeze(self) -> "RunConfiguration":
+        """a frozen snapshot of the configuration, see `RunConfiguration`"""
+        return RunConfiguration(self._get_frozen_fields())
+
+    def _get_frozen_fields(self) -> "dict[str, Any]":
+        return {name: value.freeze() if isinstance(value, Model) else value for name, value in self}
+
     def __repr__(self):
         buffer = StringIO()
         name = self.__class__.__name__
@@ -46,11 +56,47 @@ class Model(BaseModel):
         return buffer.getvalue()
 
 
+class RunConfiguration:
+    """
+    A frozen snapshot of a configuration (see `Model.freeze`) with its fields as plain attributes - the weights with
+    their `sum` too. Reading a field is a plain attribute lookup, unlike reading `settings`, which goes through
+    `LazySettings` to the active configuration.
+
+    `Grammar` and `SimulatedAnnealing` keep the snapshot of their run and hand it to the mutations, the encoding
+    lengths and the compilation of transducers, so runs with different configurations can share a process.
+    """
+
+    def __init__(self, fields: dict[str, Any]):
+        self.__dict__.update(fields)
+
+    def __setattr__(self, name: str, value: Any):
+        raise AttributeError(f"{self.__class__.__name__} is frozen, can't set {name}")
+
+    def __delattr__(self, name: str):
+        raise AttributeError(f"{self.__class__.__name__} is frozen, can't delete {name}")
+
+    def __eq__(self, other):
+        return isinstance(other, RunConfiguration) and self.__dict__ == other.__dict__
+
+    def __hash__(self):
+        return hash(tuple(self.__dict__.items()))
+
+    def __repr__(self):
+        buffer = StringIO()
+        buffer.write(f"{self.__class__.__name__}:\n")
+        for key, val in self.__dict__.items():
+            buffer.write(f"\t{key}: {val}\n")
+        return buffer.getvalue()
+
+
 class Weights(Model):
     @property
     def sum(self) -> int:
         return sum(self.values())
 
+    def _get_frozen_fields(self) -> "dict[str, Any]":
+        return super()._get_frozen_fields() | {"sum": self.sum}
+
     @field_validator("*")
     @classmethod
     def parse_int(cls, value):
@@ -81,6 +127,23 @@ class ConstraintInsertionWeights(Weights):
     phonotactic: NonNegativeInt
 
 
+class AdaptiveCooling(Model):
+    window: int = 100
+    min_acceptance_ratio: float = 0.02
+    max_acceptance_ratio: float = 0.8
+    speedup: float = 4  # the cooling factor ranges between cooling_factor ** speedup and cooling_factor ** (1 / speedup)
+    variance_factor: float = 0.7
+
+
+class CacheBudgets(Model):
+    """Budgets of the caches of `src.models.cache_manager`: transducers in arcs, generated outputs in entries"""
+    generation_memoization: int = 100_000
+    grammar_transducers: int = 100_000  # an arc takes about a kilobyte
+    constraint_set_transducers: int = 100_000
+    constraint_transducers: int = 20_000
+    word_transducers: int = 50_000
+
+
 class OtmlConfiguration(Model, Singleton):
     simulation_name: str
 
@@ -90,6 +153,9 @@ class OtmlConfiguration(Model, Singleton):
     target_constraints_file: str | None = None
     features_file: str
     corpus_file: str
+    checkpoint_file: str
+    transducer_cache_folder: str
+    generation_store_file: str
 
     log_file_name: str
     log_lexicon_words: bool
@@ -117,13 +183,35 @@ class OtmlConfiguration(Model, Singleton):
     initial_temp: int
     threshold: float
     cooling_factor: float
+    cooling_schedule: Literal["geometric", "adaptive"] = "geometric"
+    adaptive_cooling: AdaptiveCooling = AdaptiveCooling()
     debug_logging_interval: int
-    clear_modules_caching_interval: int
+    clear_modules_caching_interval: int = sys.maxsize  # also wipe the caches every this many steps
     steps_limitation: int | float
 
     random_seed: bool
     seed: int
 
+    # stopping rules, besides `threshold` and `steps_limitation`
+    plateau_steps: int = sys.maxsize  # stop after this many steps without a new lowest energy
+    plateau_seconds: int | float = sys.maxsize  # stop after this many seconds without a new lowest energy
+    time_budget_seconds: int | float = sys.maxsize  # stop after this many seconds from the simulation start
+
+    checkpoint_interval: int = sys.maxsize
+    checkpoint_transducer_caches: bool = False
+
+    replica_exchange_number_of_replicas: int | None = None  # None means one replica per CPU
+    replica_exchange_swap_interval: int = 100
+    replica_exchange_min_temp: float | None = None  # None means `threshold`
+
+    speculative_batch_size: int = 1  # 1 means one neighbor per step, evaluated in this process
+    speculative_number_of_processes: int | None = None  # None means one process per CPU
+
+    cache_budgets: CacheBudgets = CacheBudgets()
+    transducer_disk_cache: bool = False  # share compiled transducers between runs, see `TransducerDiskCache`
+    generation_store: bool = False  # share the outputs of generation between runs, see `GenerationStore`
+    energy_cache_size: int = 100_000  # energies of recently evaluated grammars, see `TraversableGrammarHypothesis`
+
     data_encoding_length_multiplier: int
     grammar_encoding_length_multiplier: int
 
@@ -154,8 +242,14 @@ class OtmlConfiguration(Model, Singleton):
             config_dict.update(json.load(f))
 
         config = cls.model_validate(config_dict)
+        config.activate()
+
+    def activate(self) -> None:
+        """
+        make this configuration the one served by `settings` (e.g. inside a worker process)
+        """
         global _settings
-        _settings = config
+        _settings = self
 
     def reset(self) -> Self:
         """
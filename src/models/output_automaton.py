@@ -0,0 +1,220 @@
+"""
+The outputs of a transducer - the strings on its paths from the initial state to a final state - as an automaton
+over their characters. It answers queries about the outputs without enumerating them: their number
+(`get_number_of_outputs`), whether a string is one of them (`accepts`) and which strings of a trie are
+(`get_accepted_strings`). `get_outputs` enumerates them, like `Transducer.get_range`.
+
+`Grammar.get_output_automaton` makes the automaton of the transducer optimized for a word, whose outputs are the SRs
+of the word. Their number grows exponentially with the epentheses that the grammar allows, while the automaton stays
+about as small as the transducer.
+
+The states are the states of the transducer reachable from its initial state, 0. A position in the automaton is a
+state, or an arc in the middle of its output: (terminal state, rest of the output). Reading a character takes a set of
+positions to the next ones, so the sets of positions are the states of the deterministic automaton, which reads every
+output along a single path.
+"""
+import json
+
+from src.exceptions import TransducerError
+from src.grammar.features.feature_table import NULL_SEGMENT, JOKER_SEGMENT
+
+_END_OF_STRING = ""  # the key of the string that ends at a node of a trie, see `make_strings_trie`
+
+
+def make_strings_trie(strings) -> dict:
+    """character -> the trie of the rest of the strings, and _END_OF_STRING -> the string that ends there"""
+    trie = dict()
+    for string in strings:
+        node = trie
+        for character in string:
+            node = node.setdefault(character, dict())
+        node[_END_OF_STRING] = string
+    return trie
+
+
+class OutputAutomaton:
+    __slots__ = ["arcs", "final_states", "_number_of_outputs", "_outputs"]
+
+    def __init__(self, arcs, final_states):
+        """arcs[state] - the (output string, terminal state) of the arcs from the state; the initial state is 0"""
+        self.arcs: tuple[tuple[tuple[str, int], ...], ...] = tuple(tuple(map(tuple, state_arcs))
+                                                                   for state_arcs in arcs)
+        self.final_states: frozenset[int] = frozenset(final_states)
+        self._number_of_outputs: int | None = None
+        self._outputs: frozenset[str] | None = None  # the outputs when they are listed, see `from_outputs`
+
+    @classmethod
+    def from_transducer(cls, transducer) -> "OutputAutomaton":
+        states = [transducer.initial_state]  # the reachable states, in the order of their numbers
+        state_numbers = {transducer.initial_state: 0}
+        arcs = list()
+        for state in states:
+            state_arcs = dict()  # an ordered set of (output string, terminal state)
+            for arc in transducer.get_arcs_by_origin_state(state):
+                terminal_state = state_numbers.get(arc.terminal_state)
+                if terminal_state is None:
+                    terminal_state = state_numbers[arc.terminal_state] = len(states)
+                    states.append(arc.terminal_state)
+                for output in _get_output_strings(arc.output, transducer.alphabet):
+                    state_arcs[(output, terminal_state)] = None
+            arcs.append(tuple(state_arcs))
+        return cls(arcs, [state_numbers[state] for state in transducer.final_states if state in state_numbers])
+
+    @classmethod
+    def from_outputs(cls, outputs) -> "OutputAutomaton":
+        """the automaton with an arc for every output - which answers the queries by looking the outputs up"""
+        outputs = frozenset(outputs)
+        output_automaton = cls([[(output, 1) for output in sorted(outputs)], []], [1])
+        output_automaton._outputs = outputs
+        output_automaton._number_of_outputs = len(outputs)
+        return output_automaton
+
+    @classmethod
+    def loads(cls, output_automaton_json_str: str) -> "OutputAutomaton":
+        output_automaton_json = json.loads(output_automaton_json_str)
+        if "outputs" in output_automaton_json:
+            return cls.from_outputs(output_automaton_json["outputs"])
+        return cls(output_automaton_json["arcs"], output_automaton_json["final_states"])
+
+    def dumps(self) -> str:
+        if self._outputs is not None:
+            return json.dumps({"outputs": sorted(self._outputs)})
+        return json.dumps({"arcs": self.arcs, "final_states": sorted(self.final_states)})
+
+    def get_compact(self) -> "OutputAutomaton":
+        """this automaton, or `from_outputs` of its outputs if they are fewer than its arcs - usually one output"""
+        if self._outputs is not None or self.get_number_of_outputs() >= sum(map(len, self.arcs)):
+            return self
+        return OutputAutomaton.from_outputs(self.get_outputs())
+
+    def get_number_of_outputs(self) -> int:
+        """
+        The number of distinct outputs - the number of paths of the deterministic automaton
+
+        :raise TransducerError: if there are infinitely many outputs - a cycle of arcs outputs a non-empty string
+        """
+        if self._number_of_outputs is None:
+            numbers_of_outputs = dict()  # positions -> the number of outputs from them, None while it is counted
+
+            def get_number_of_outputs_from(positions: frozenset) -> int:
+                if positions in numbers_of_outputs:
+                    if numbers_of_outputs[positions] is None:
+                        raise TransducerError("Cyclic output automaton: infinitely many outputs")
+                    return numbers_of_outputs[positions]
+                numbers_of_outputs[positions] = None
+                numbers_of_outputs[positions] = (self._is_final(positions) +
+                                                 sum(get_number_of_outputs_from(next_positions) for next_positions
+                                                     in self._get_next_positions(positions).values()))
+                return numbers_of_outputs[positions]
+
+            self._number_of_outputs = get_number_of_outputs_from(self._get_initial_positions())
+        return self._number_of_outputs
+
+    def accepts(self, string: str) -> bool:
+        if self._outputs is not None:
+            return string in self._outputs
+        positions = self._get_initial_positions()
+        for character in string:
+            positions = self._read(positions, character)
+            if not positions:
+                return False
+        return self._is_final(positions)
+
+    def get_accepted_strings(self, strings_trie: dict) -> list[str]:
+        """the outputs among the strings of the trie (see `make_strings_trie`), walking the trie and the automaton
+        together - along the common prefixes of the strings and the outputs only"""
+        if self._outputs is not None:
+            return [output for output, _ in self.arcs[0] if _get_trie_string(strings_trie, output) is not None]
+        accepted_strings = list()
+        nodes_to_explore = [(strings_trie, self._get_initial_positions())]
+        while nodes_to_explore:
+            node, positions = nodes_to_explore.pop()
+            if _END_OF_STRING in node and self._is_final(positions):
+                accepted_strings.append(node[_END_OF_STRING])
+            for character, next_positions in self._get_next_positions(positions).items():
+                if character in node:
+                    nodes_to_explore.append((node[character], next_positions))
+        return accepted_strings
+
+    def get_outputs(self) -> set[str]:
+        """all the outputs - their number may be exponential in the size of the automaton, or infinite"""
+        if self._outputs is not None:
+            return set(self._outputs)
+        outputs = set()
+        prefixes_to_explore = [("", self._get_initial_positions())]
+        while prefixes_to_explore:
+            prefix, positions = prefixes_to_explore.pop()
+            if self._is_final(positions):
+                outputs.add(prefix)
+            for character, next_positions in self._get_next_positions(positions).items():
+                prefixes_to_explore.append((prefix + character, next_positions))
+        return outputs
+
+    def _get_initial_positions(self) -> frozenset:
+        return self._get_closure({0}) if self.arcs else frozenset()
+
+    def _is_final(self, positions: frozenset) -> bool:
+        return not self.final_states.isdisjoint(positions)
+
+    def _get_closure(self, positions: set) -> frozenset:
+        """the positions, and the states that the arcs with empty outputs lead to from them"""
+        states_to_explore = [position for position in positions if type(position) is int]
+        while states_to_explore:
+            for output, terminal_state in self.arcs[states_to_explore.pop()]:
+                if not output and terminal_state not in positions:
+                    positions.add(terminal_state)
+                    states_to_explore.append(terminal_state)
+        return frozenset(positions)
+
+    def _read(self, positions: frozenset, character: str) -> frozenset:
+        """the positions after reading the character"""
+        next_positions = set()
+        for position in positions:
+            if type(position) is int:
+                for output, terminal_state in self.arcs[position]:
+                    if output and output[0] == character:
+                        next_positions.add(_get_position_after_first_character(output, terminal_state))
+            elif position[1][0] == character:
+                next_positions.add(_get_position_after_first_character(position[1], position[0]))
+        return self._get_closure(next_positions)
+
+    def _get_next_positions(self, positions: frozenset) -> dict[str, frozenset]:
+        """character -> the positions after reading it, for every character that can be read"""
+        next_positions_by_character = dict()
+        for position in positions:
+            if type(position) is int:
+                for output, terminal_state in self.arcs[position]:
+                    if output:
+                        next_positions_by_character.setdefault(output[0], set()).add(
+                            _get_position_after_first_character(output, terminal_state))
+            else:
+                terminal_state, output = position
+                next_positions_by_character.setdefault(output[0], set()).add(
+                    _get_position_after_first_character(output, terminal_state))
+        return {character: self._get_closure(next_positions)
+                for character, next_positions in next_positions_by_character.items()}
+
+
+def _get_trie_string(strings_trie: dict, string: str) -> str | None:
+    """the string if it is in the trie"""
+    node = strings_trie
+    for character in string:
+        node = node.get(character)
+        if node is None:
+            return None
+    return node.get(_END_OF_STRING)
+
+
+def _get_position_after_first_character(output: str, terminal_state: int):
+    return terminal_state if len(output) == 1 else (terminal_state, output[1:])
+
+
+def _get_output_strings(output, alphabet) -> list[str] | set[str]:
+    """the strings that an arc output stands for: a set of strings, or a segment - NULL for none, JOKER for any"""
+    if isinstance(output, set):
+        return output
+    if output == NULL_SEGMENT:
+        return [""]
+    if output == JOKER_SEGMENT:
+        return [segment.get_symbol() for segment in alphabet]
+    return [output.get_symbol()]
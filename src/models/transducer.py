@@ -4,6 +4,7 @@ from __future__ import absolute_import, division, print_function, unicode_litera
 import functools
 import itertools
 import logging
+import operator
 import sys
 from collections import defaultdict
 from copy import deepcopy
@@ -12,6 +13,7 @@ from six import PY3, StringIO, itervalues
 
 from src.exceptions import CostVectorOperationError
 from src.grammar.features.feature_table import Segment, NULL_SEGMENT, JOKER_SEGMENT
+from src.models.transducer_graph import get_live_states, get_topological_order
 
 logger = logging.getLogger(__name__)
 
@@ -80,74 +82,21 @@ class Transducer:
         or
         a state that cannot reach a final state by following any path (impasse state)
         """
-        # logger.debug("clear_dead_states: transducer before: %s", self)
-        # clear unreachable states:
-        state_unreachable_dict = {state: True for state in self.states}  # all states are unreachable at first
-        state_unreachable_dict[self.initial_state] = False  # except for initial state
-
-        while True:  # "do while" loop
-            change_in_dict = False
-            for arc in self._arcs:
-                if not state_unreachable_dict[arc.origin_state] and state_unreachable_dict[arc.terminal_state]:
-                    state_unreachable_dict[arc.terminal_state] = False
-                    change_in_dict = True
-
-            if not change_in_dict:
-                break
-
-        unreachable_states = [state for state in state_unreachable_dict if state_unreachable_dict[state]]
-
-        # remove arcs from arcs_by_state_dict
-        for state in unreachable_states:
-            self.arcs_by_state_dict.pop(state, None)  # TODO add None for Yimas
-
-        for origin_state in self.arcs_by_state_dict.keys():  # TODO maybe we don't need this due to the nature of cliques
-            for state in unreachable_states:
-                self.arcs_by_state_dict[origin_state].pop(state, None)
-
-        # remove arcs for _arcs
-        self._arcs[:] = [arc for arc in self._arcs if ((arc.origin_state not in unreachable_states) and
-                                                       (arc.terminal_state not in unreachable_states))]
-
-        # remove states
-        self.states[:] = [state for state in self.states if state not in unreachable_states]
-        self.final_states[:] = [state for state in self.final_states if state not in unreachable_states]
-
-        if with_impasse_states:
-            # clear impasse states:
-            state_impasse_dict = {state: True for state in self.states}  # all states are impasse at first
-            for final_state in self.final_states:  # except for the final states
-                state_impasse_dict[final_state] = False
-
-            while True:  # "do while" loop
-                change_in_dict = False
-                for arc in self._arcs:
-                    if not state_impasse_dict[arc.terminal_state] and state_impasse_dict[arc.origin_state]:
-                        state_impasse_dict[arc.origin_state] = False
-                        change_in_dict = True
-
-                if not change_in_dict:
-                    break
-
-            impasse_states = [state for state in state_impasse_dict if state_impasse_dict[state]]
-
-            # remove arcs from arcs_by_state_dict
-            for state in impasse_states:
-                self.arcs_by_state_dict.pop(state, None)
-
-            for origin_state in self.arcs_by_state_dict.keys():
-                for state in impasse_states:
-                    self.arcs_by_state_dict[origin_state].pop(state, None)
-
-            # remove arcs for _arcs
-            self._arcs[:] = [arc for arc in self._arcs if ((arc.origin_state not in impasse_states) and
-                                                           (arc.terminal_state not in impasse_states))]
-
-            # remove states
-            self.states[:] = [state for state in self.states if state not in impasse_states]
-            self.final_states[:] = [state for state in self.final_states if state not in impasse_states]
-
-            # logger.debug("clear_dead_states: transducer after: %s", self)
+        live_states = get_live_states(self, with_impasse_states)
+        dead_states = {state for state in self.states if state not in live_states}
+        if not dead_states:
+            return
+
+        for state in dead_states:
+            self.arcs_by_state_dict.pop(state, None)
+        for arcs_by_terminal_state in self.arcs_by_state_dict.values():
+            for terminal_state in [state for state in arcs_by_terminal_state if state in dead_states]:
+                del arcs_by_terminal_state[terminal_state]
+
+        self._arcs[:] = [arc for arc in self._arcs if ((arc.origin_state not in dead_states) and
+                                                       (arc.terminal_state not in dead_states))]
+        self.states[:] = [state for state in self.states if state not in dead_states]
+        self.final_states[:] = [state for state in self.final_states if state not in dead_states]
 
     def get_length_of_cost_vectors(self):
         return self.length_of_cost_vectors
@@ -175,35 +124,30 @@ class Transducer:
             strings_by_state[state] = set()
         strings_by_state[self.initial_state].add('')
 
-        active_states = set([self.initial_state])
-
         sets_on_arcs_flag = isinstance(self._arcs[0].output, set)
 
-        while active_states:
-            next_pass_states = set()
-            for state in list(active_states):
-                arcs = self.get_arcs_by_origin_state(state)
-                state_strings = list(strings_by_state[state])
-                for arc in arcs:
-                    next_pass_states.add(arc.terminal_state)
-                    for string1 in state_strings:
-                        if sets_on_arcs_flag:
-                            if arc.output == {''}:
-                                strings_by_state[arc.terminal_state].add(string1)
-                            else:
-                                for string2 in arc.output:
-                                    strings_by_state[arc.terminal_state].add(string1 + string2)
-                        else:  # arc has a segment as output
-                            if arc.output == NULL_SEGMENT:
-                                strings_by_state[arc.terminal_state].add(string1)
-                            elif arc.output == JOKER_SEGMENT:
-                                for segment in self.alphabet:
-                                    string2 = segment.get_symbol()
-                                    strings_by_state[arc.terminal_state].add(string1 + string2)
-                            else:
-                                string2 = arc.output.get_symbol()
+        # every state is done once the states with arcs to it are
+        for state in get_topological_order([self.initial_state], self.arcs_by_state_dict):
+            arcs = self.get_arcs_by_origin_state(state)
+            state_strings = strings_by_state[state]
+            for arc in arcs:
+                for string1 in state_strings:
+                    if sets_on_arcs_flag:
+                        if arc.output == {''}:
+                            strings_by_state[arc.terminal_state].add(string1)
+                        else:
+                            for string2 in arc.output:
+                                strings_by_state[arc.terminal_state].add(string1 + string2)
+                    else:  # arc has a segment as output
+                        if arc.output == NULL_SEGMENT:
+                            strings_by_state[arc.terminal_state].add(string1)
+                        elif arc.output == JOKER_SEGMENT:
+                            for segment in self.alphabet:
+                                string2 = segment.get_symbol()
                                 strings_by_state[arc.terminal_state].add(string1 + string2)
-            active_states = next_pass_states
+                        else:
+                            string2 = arc.output.get_symbol()
+                            strings_by_state[arc.terminal_state].add(string1 + string2)
 
         strings = set()
         for state in self.get_final_states():
@@ -308,42 +252,105 @@ class Transducer:
         return str_io.getvalue()
 
     @classmethod
-    def _binary_intersection(cls, transducer1, transducer2):
-        """ Intersect two transducers
+    def intersection(cls, *transducers):
+        """ Intersect the transducers in a single pass
+
+        The result is the transducer that intersecting them pairwise from the left would give after
+        `clear_dead_states`, without making the intermediate products: its states are the tuples of states (one of
+        every transducer) reachable from the tuple of the initial states, labelled "q0|q1|...", and the cost vector of
+        an arc is the concatenation of the cost vectors of its component arcs.
 
-        :param transducer1: A transducer
-        :type transducer1: Transducer
-        :param transducer2: A transducer
-        :type transducer2: Transducer
+        The product is explored from the tuple of the initial states. The arcs of every tuple are matched one
+        transducer after the other, the arcs of the next transducer coming from its arcs index (see
+        `_get_arcs_index`) by the labels unified so far, instead of trying every combination of arcs. The states,
+        final states and arcs are in the order of the full product.
+
+        :type transducers: Transducer
         :rtype: Transducer
         """
+        if len(transducers) == 1:
+            return transducers[0]
 
-        alphabet = list(set(transducer1.alphabet) | set(transducer2.alphabet))
-        cost_vectors_length = transducer1.length_of_cost_vectors + transducer2.length_of_cost_vectors
+        first_transducer, *other_transducers = transducers
+        alphabet = first_transducer.alphabet
+        for other_transducer in other_transducers:
+            alphabet = list(set(alphabet) | set(other_transducer.alphabet))
+        cost_vectors_length = sum(component_transducer.length_of_cost_vectors for component_transducer in transducers)
 
         transducer = Transducer(alphabet, length_of_cost_vectors=cost_vectors_length)
 
-        transducer.initial_state = transducer1.initial_state & transducer2.initial_state
-
-        for state1, state2 in itertools.product(transducer1.states, transducer2.states):
-            transducer.states.append(state1 & state2)
-
-        for state1, state2 in itertools.product(transducer1.final_states, transducer2.final_states):
-            transducer.final_states.append(state1 & state2)
-
-        for arc1, arc2 in itertools.product(transducer1._arcs, transducer2._arcs):
-            intersected_arc = Arc.intersect(arc1, arc2)
-            if intersected_arc is not None:
-                transducer.add_arc(intersected_arc)
+        first_arcs_by_origin_state = defaultdict(list)
+        for first_position, first_arc in enumerate(first_transducer._arcs):
+            first_arcs_by_origin_state[first_arc.origin_state].append((first_position, first_arc))
+        other_arcs_indexes = [_get_arcs_index(other_transducer) for other_transducer in other_transducers]
+
+        initial_tuple = tuple(component_transducer.initial_state for component_transducer in transducers)
+        state_by_tuple = {initial_tuple: functools.reduce(operator.and_, initial_tuple)}
+        tuples_to_explore = [initial_tuple]
+        positioned_arcs = list()  # (positions of the component arcs, intersected arc)
+        while tuples_to_explore:
+            state_tuple = tuples_to_explore.pop()
+            origin_state = state_by_tuple[state_tuple]
+
+            # (positions, unified input, unified output, cost vector, terminal states) of the combinations of arcs
+            # that unify so far - the cost vectors are concatenated as lists
+            matches = [((first_position,), first_arc.input, first_arc.output, first_arc.cost_vector.vector,
+                        (first_arc.terminal_state,))
+                       for first_position, first_arc in first_arcs_by_origin_state.get(state_tuple[0], ())]
+            for state, arcs_index in zip(state_tuple[1:], other_arcs_indexes):
+                arcs_by_input = arcs_index.get(state)
+                if not matches or not arcs_by_input:
+                    matches = list()
+                    break
+                next_matches = list()
+                for positions, unified_input, unified_output, vector, terminal_tuple in matches:
+                    for input_key in _get_unifiable_keys(unified_input, arcs_by_input):
+                        arcs_by_output = arcs_by_input[input_key]
+                        for output_key in _get_unifiable_keys(unified_output, arcs_by_output):
+                            for position, arc in arcs_by_output[output_key]:
+                                next_input = Segment.intersect(unified_input, arc.input)
+                                next_output = Segment.intersect(unified_output, arc.output)
+                                if next_input is not None and next_output is not None:
+                                    next_matches.append((positions + (position,), next_input, next_output,
+                                                         vector + arc.cost_vector.vector,
+                                                         terminal_tuple + (arc.terminal_state,)))
+                matches = next_matches
+
+            for positions, unified_input, unified_output, vector, terminal_tuple in matches:
+                terminal_state = state_by_tuple.get(terminal_tuple)
+                if terminal_state is None:
+                    terminal_state = functools.reduce(operator.and_, terminal_tuple)
+                    state_by_tuple[terminal_tuple] = terminal_state
+                    tuples_to_explore.append(terminal_tuple)
+                positioned_arcs.append((positions, Arc(origin_state, unified_input, unified_output, CostVector(vector),
+                                                       terminal_state)))
+
+        transducer.initial_state = state_by_tuple[initial_tuple]
+
+        state_positions = [{state: position for position, state in enumerate(component_transducer.states)}
+                           for component_transducer in transducers]
+        positioned_states = list()  # (positions of the component states, state)
+        for state_tuple, state in state_by_tuple.items():
+            try:
+                positions = tuple([positions_of_states[component_state] for component_state, positions_of_states
+                                   in zip(state_tuple, state_positions)])
+            except KeyError:  # a state of an arc that is missing from the states of its transducer
+                continue
+            positioned_states.append((positions, state))
+        positioned_states.sort(key=operator.itemgetter(0))
+        transducer.states = [state for _, state in positioned_states]
+
+        for final_tuple in itertools.product(*(component_transducer.final_states for component_transducer in
+                                               transducers)):
+            if final_tuple in state_by_tuple:
+                transducer.final_states.append(state_by_tuple[final_tuple])
+
+        positioned_arcs.sort(key=operator.itemgetter(0))
+        for _, arc in positioned_arcs:
+            transducer.add_arc(arc)
 
         return transducer
 
-    @classmethod
-    def intersection(cls, *transducers):
-        intersected_transducer = functools.reduce(Transducer._binary_intersection, transducers)
-        intersected_transducer.clear_dead_states()
-        return intersected_transducer
-
     def __str__(self):
         str_io = StringIO()
         if self.name:
@@ -386,6 +393,38 @@ class Transducer:
         return result
 
 
+_SET_LABELS_KEY = None  # the index key of the arcs labelled by a set of strings rather than by a segment
+
+
+def _get_label_key(label) -> str | None:
+    """the key of an arc label in `_get_arcs_index`: the symbol of a segment - NULL and JOKER have their own"""
+    return label.symbol if isinstance(label, Segment) else _SET_LABELS_KEY
+
+
+def _get_arcs_index(transducer: Transducer) -> dict:
+    """
+    origin state -> input key -> output key -> [(position of the arc in transducer, arc)], the keys by
+    `_get_label_key`
+    """
+    arcs_index = dict()
+    for position, arc in enumerate(transducer.get_arcs()):
+        arcs_by_input = arcs_index.setdefault(arc.origin_state, dict())
+        arcs_by_output = arcs_by_input.setdefault(_get_label_key(arc.input), dict())
+        arcs_by_output.setdefault(_get_label_key(arc.output), list()).append((position, arc))
+    return arcs_index
+
+
+def _get_unifiable_keys(label, arcs_by_key: dict) -> list:
+    """
+    The keys of arcs_by_key whose labels may unify with label (see `Segment.__and__`): a segment unifies with itself,
+    JOKER and the sets containing its symbol, while JOKER and sets may unify with anything
+    """
+    label_key = _get_label_key(label)
+    if label_key is _SET_LABELS_KEY or label_key == JOKER_SEGMENT.symbol:
+        return list(arcs_by_key)
+    return [key for key in (label_key, JOKER_SEGMENT.symbol, _SET_LABELS_KEY) if key in arcs_by_key]
+
+
 class State:
     __slots__ = ["label", "index", "hash"]
 
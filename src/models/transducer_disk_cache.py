@@ -0,0 +1,77 @@
+"""
+An optional cache of compiled transducers on disk, shared by all the runs of a simulation folder (repeated runs, seed
+sweeps and restarts), turned on by the `transducer_disk_cache` setting.
+
+The transducers are kept under `transducer_cache_folder`, in a folder per compilation context - the feature table
+and the settings the transducers are compiled with - and a file per key: the constraint key, or the ranking (key) of
+the constraint set. They are loaded lazily, on a miss in the caches of `src.models.cache_manager`, and saved as
+`CompactTransducer`s.
+
+A grammar transducer breaks the ties between equally harmonic paths by the fingerprint of its ranking (see
+`Grammar.get_transducer`), so a run that loads it takes the same transducer it would have compiled.
+"""
+import logging
+import os
+import pickle
+import threading
+from hashlib import blake2b
+from typing import Callable, Hashable
+
+from src.models.compact_transducer import CompactTransducer
+from src.models.otml_configuration import RunConfiguration
+from src.models.transducer import Transducer
+from src.utils.fingerprint_tools import get_string_fingerprint
+
+logger = logging.getLogger(__name__)
+
+TRANSDUCER_DISK_CACHE_VERSION = 3  # bump when the compilation or the saved form of transducers changes
+
+
+def get_compilation_fingerprint(feature_table, config: RunConfiguration) -> int:
+    """identifies the feature table and the settings that transducers are compiled with"""
+    return get_string_fingerprint(f"{TRANSDUCER_DISK_CACHE_VERSION}:{feature_table.get_fingerprint()}:"
+                                  f"{config.allow_candidates_with_changed_segments}")
+
+
+class TransducerDiskCache:
+    def get_transducer(self, kind: str, feature_table, key: Hashable, make_transducer: Callable[[], Transducer],
+                       config: RunConfiguration) -> Transducer:
+        """
+        Load the transducer of kind ("constraint", "constraint_set" or "grammar") and key, or make and save it
+        """
+        if not config.transducer_disk_cache:
+            return make_transducer()
+
+        transducer_file = self._get_transducer_file(kind, feature_table, key, config)
+        try:
+            with open(transducer_file, "rb") as f:
+                return pickle.load(f).to_transducer()
+        except FileNotFoundError:
+            pass
+        except (OSError, pickle.UnpicklingError, EOFError, AttributeError) as ex:
+            logger.warning(f"Failed loading {transducer_file}, compiling it again: {ex!r}")
+
+        transducer = make_transducer()
+        self._save(transducer_file, transducer)
+        return transducer
+
+    @staticmethod
+    def _get_transducer_file(kind: str, feature_table, key: Hashable, config: RunConfiguration) -> str:
+        context_folder = f"{get_compilation_fingerprint(feature_table, config):016x}"
+        key_file_name = blake2b(repr(key).encode(), digest_size=16).hexdigest()
+        return os.path.join(config.transducer_cache_folder, context_folder, kind, f"{key_file_name}.pkl")
+
+    @staticmethod
+    def _save(transducer_file: str, transducer: Transducer):
+        """written atomically, since other runs (processes or threads) may be reading the same file"""
+        os.makedirs(os.path.dirname(transducer_file), exist_ok=True)
+        temporary_file = f"{transducer_file}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            with open(temporary_file, "wb") as f:
+                pickle.dump(CompactTransducer.from_transducer(transducer), f, -1)
+            os.replace(temporary_file, transducer_file)
+        except OSError as ex:
+            logger.warning(f"Failed saving {transducer_file}: {ex!r}")
+
+
+transducer_disk_cache = TransducerDiskCache()
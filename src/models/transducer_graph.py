@@ -0,0 +1,82 @@
+"""
+Graph algorithms on transducers, in O(V + E).
+
+They walk the arcs index of a transducer, `Transducer.arcs_by_state_dict` (origin state -> terminal state -> arcs),
+or its reversal, `get_reversed_arcs_index`, instead of scanning all the arcs for every state.
+"""
+from src.exceptions import TransducerError
+
+
+def get_reachable_states(sources, arcs_index: dict) -> set:
+    """the states that a path in arcs_index leads to from any of the sources, the sources included"""
+    reachable_states = set(sources)
+    states_to_explore = list(reachable_states)
+    while states_to_explore:
+        arcs_by_terminal_state = arcs_index.get(states_to_explore.pop())
+        if arcs_by_terminal_state:
+            for terminal_state, arcs in arcs_by_terminal_state.items():
+                if arcs and terminal_state not in reachable_states:
+                    reachable_states.add(terminal_state)
+                    states_to_explore.append(terminal_state)
+    return reachable_states
+
+
+def get_reversed_arcs_index(arcs_index: dict) -> dict:
+    """terminal state -> origin state -> arcs"""
+    reversed_arcs_index = dict()
+    for origin_state, arcs_by_terminal_state in arcs_index.items():
+        for terminal_state, arcs in arcs_by_terminal_state.items():
+            if arcs:
+                reversed_arcs_index.setdefault(terminal_state, dict())[origin_state] = arcs
+    return reversed_arcs_index
+
+
+def get_topological_order(sources, arcs_index: dict) -> list:
+    """
+    The states reachable from the sources, every state before the terminal states of its arcs
+
+    :raise TransducerError: if a path from the sources goes around a cycle
+    """
+    reachable_states = get_reachable_states(sources, arcs_index)
+    number_of_arcs_in = dict.fromkeys(reachable_states, 0)
+    for state in reachable_states:
+        for terminal_state, arcs in arcs_index.get(state, {}).items():
+            if arcs:
+                number_of_arcs_in[terminal_state] += 1
+
+    states_to_order = [state for state in dict.fromkeys(sources) if not number_of_arcs_in[state]]
+    ordered_states = list()
+    while states_to_order:
+        state = states_to_order.pop()
+        ordered_states.append(state)
+        for terminal_state, arcs in arcs_index.get(state, {}).items():
+            if arcs:
+                number_of_arcs_in[terminal_state] -= 1
+                if not number_of_arcs_in[terminal_state]:
+                    states_to_order.append(terminal_state)
+
+    if len(ordered_states) < len(reachable_states):
+        raise TransducerError("Cyclic transducer: no topological order")
+    return ordered_states
+
+
+def get_accessible_states(transducer) -> set:
+    """the states reachable from the initial state"""
+    return get_reachable_states([transducer.initial_state], transducer.arcs_by_state_dict)
+
+
+def get_coaccessible_states(transducer) -> set:
+    """the states that reach a final state"""
+    return get_reachable_states(transducer.final_states, get_reversed_arcs_index(transducer.arcs_by_state_dict))
+
+
+def get_live_states(transducer, with_impasse_states: bool = False) -> set:
+    """
+    The states reachable from the initial state - which, with_impasse_states, also reach a final state. The others
+    are the dead states of `Transducer.clear_dead_states`.
+    """
+    live_states = get_accessible_states(transducer)
+    if with_impasse_states:
+        # a path from an accessible state to a final state only goes through accessible states
+        live_states &= get_coaccessible_states(transducer)
+    return live_states
@@ -1,60 +1,306 @@
 # Python2 and Python 3 compatibility:
 from __future__ import absolute_import, division, print_function, unicode_literals
 
+import copy
 import logging
 import pickle
+import random
 import sys
+from collections import Counter, OrderedDict
+from typing import Iterable, Mapping
 from math import ceil, log
 
 from src.grammar.grammar import Grammar
-from src.models.otml_configuration import settings
+from src.grammar.lexicon import Word
+from src.grammar.undo_log import UndoLog
+from src.models.output_automaton import make_strings_trie
 
 logger = logging.getLogger(__name__)
 
 
 class TraversableGrammarHypothesis:
 
-    def __init__(self, grammar: Grammar, data: list[str]):
+    def __init__(self, grammar: Grammar, data: Iterable[str] | Mapping[str, int]):
+        """
+        data is either a list of words or the multiplicity of every distinct word (see `Corpus.get_word_counts`).
+        A data word of multiplicity m adds m times its length to the data length - as m copies of it would.
+        """
         self.grammar: Grammar = grammar
-        self.data: list[str] = data
-        self.data_parse: dict[str, set[tuple[str, int]]] | None = None
+        self.data: Counter[str] = Counter(data)
+        self._data_size: int = sum(self.data.values())  # the number of data words, counting multiplicities
+        self._data_trie: dict | None = None  # the data words looked up in output automata, see `_get_data_trie`
+        self._data_by_multiplicity: list[str] | None = None  # the data words, the most frequent first
 
         self.grammar_energy: int = sys.maxsize
         self.data_energy: int = sys.maxsize
         self.combined_energy: int = sys.maxsize
 
-    def update_energy(self) -> int:
-        data_length = self.get_data_length_given_grammar()
+        # The grammar is mutated in place, a rejected mutation is rolled back (see `mutate`)
+        self.undo_log: UndoLog = UndoLog()
+
+        # The data parse is kept per lexicon word, so that after a lexicon mutation only the changed words are
+        # generated again. A change of the constraint set invalidates all of it.
+        self._parsed_constraint_set: tuple | None = None  # key of the constraint set the parse below was made with
+        self._lexicon_word_counts: Counter[str] = Counter()
+        self._parse_by_input: dict[str, tuple[int, list[str]]] = dict()  # input -> (number_of_outputs,
+        #                                                                           its outputs which are in the data)
+        self._parses_by_output: dict[str, dict[str, int]] = dict()  # output -> {input: number_of_outputs}
+        self._output_choice_lengths: dict[str, int] = dict()  # shortest output encoding of every parsed data word
+        self._output_choice_lengths_sum: int = 0  # weighted by the multiplicities of the data words
+
+        # (grammar_energy, data_energy, combined_energy) of the recently evaluated grammars by their fingerprints
+        # (see `Grammar.get_fingerprint`), least recently used first
+        self._energy_cache: OrderedDict[tuple[int, int], tuple[int, int, int]] = OrderedDict()
+
+    def update_energy(self, max_energy: float | None = None) -> int:
+        """
+        Args:
+            max_energy: if given, the data is not parsed when the energy is sure to exceed it - the data length is
+                then INF, as if the data could not be parsed.
+
+        A grammar evaluated recently is not evaluated again - its energies are taken from the energy cache. The data
+        parse is not updated then, it is brought up to date before the next mutation (see `mutate`).
+        """
+        fingerprint = self.grammar.get_fingerprint()
+        if fingerprint in self._energy_cache:
+            self._energy_cache.move_to_end(fingerprint)
+            self._set_energies(*self._energy_cache[fingerprint])
+            return self.combined_energy
+
         grammar_length = self.grammar.get_encoding_length()
-        data_multiplier = settings.data_encoding_length_multiplier
-        grammar_multiplier = settings.grammar_encoding_length_multiplier
+        config = self.grammar.config
+        data_multiplier = config.data_encoding_length_multiplier
+        grammar_multiplier = config.grammar_encoding_length_multiplier
 
         self.grammar_energy = grammar_length * grammar_multiplier
+        max_data_length = None
+        if max_energy is not None and data_multiplier:
+            max_data_length = (max_energy - self.grammar_energy) / data_multiplier
+        data_length = self.get_data_length_given_grammar(max_data_length)
         self.data_energy = data_length * data_multiplier
         self.combined_energy = self.grammar_energy + self.data_energy
+        if data_length != sys.maxsize or max_data_length is None:  # a cut short evaluation is only good for its bound
+            self._cache_energies(fingerprint)
         return self.combined_energy
 
-    def get_data_length_given_grammar(self) -> int:
+    def _cache_energies(self, fingerprint: tuple[int, int]):
+        self._energy_cache[fingerprint] = (self.grammar_energy, self.data_energy, self.combined_energy)
+        while len(self._energy_cache) > self.grammar.config.energy_cache_size:
+            self._energy_cache.popitem(last=False)
+
+    def get_data_length_given_grammar(self, max_data_length: float | None = None) -> int:
+        """
+        The length of a data word is the length of its cheapest parse [parse = a pair (input, number_of_outputs)],
+        see `encode_output`. The parse is updated incrementally, see `_update_data_parse`.
+
+        The length is INF, without parsing the rest of the data, as soon as it is sure to exceed max_data_length:
+        - before parsing - if the length of choosing the inputs, and the lengths of the data words whose parses the
+          lexicon changes leave as they are, exceed it. The parse is then left as is - it is brought up to date before
+          the next mutation;
+        - while parsing the lexicon from scratch, see `_parse_lexicon`.
+        """
+        max_output_choice_lengths_sum = None
+        if max_data_length is not None:
+            input_choice_length = ceil(log(self.grammar.lexicon.get_number_of_distinct_words(), 2))
+            max_output_choice_lengths_sum = max_data_length - self._data_size * input_choice_length
+            if self._get_kept_output_choice_lengths_sum() > max_output_choice_lengths_sum:
+                return sys.maxsize
+
+        if not self._update_data_parse(max_output_choice_lengths_sum):
+            return sys.maxsize
+
+        if len(self._output_choice_lengths) != len(self.data):  # some data word has no parse
+            return sys.maxsize
+
+        input_choice_length = ceil(log(len(self._lexicon_word_counts), 2))
+        return self._data_size * input_choice_length + self._output_choice_lengths_sum
+
+    def _get_kept_output_choice_lengths_sum(self) -> int:
+        """
+        The output choice lengths of the data words that `_update_data_parse` will not parse again - a lower bound of
+        the output choice lengths after it, since the others are at least 0. None are kept when the constraint set
+        changed.
         """
-        data_parse_dict is a dictionary with:
+        if self.grammar.constraint_set.get_key() != self._parsed_constraint_set:
+            return 0
+        changed_outputs = set()
+        for old_word_string, _ in self.grammar.lexicon.get_word_changes():
+            changed_outputs.update(self._parse_by_input.get(old_word_string, (0, []))[1])
+        return self._output_choice_lengths_sum - sum(self._output_choice_lengths.get(output, 0) * self.data[output]
+                                                     for output in changed_outputs)
+
+    @property
+    def data_parse(self) -> dict[str, set[tuple[str, int]]] | None:
+        """
+        The parse of the grammar last evaluated without the energy cache. A dictionary with:
             keys: words of the data;
             values: sets of parses of a word [parse = a pair (input, number_of_outputs)]
+        """
+        if self._parsed_constraint_set is None:
+            return None
+        return {word: set(self._parses_by_output.get(word, dict()).items()) for word in self.data}
+
+    def _update_data_parse(self, max_output_choice_lengths_sum: float | None = None) -> bool:
+        """False if the parse of the lexicon from scratch was cut short, see `_parse_lexicon`"""
+        constraint_set_key = self.grammar.constraint_set.get_key()
+        word_changes = self.grammar.lexicon.pop_word_changes()
+        if constraint_set_key != self._parsed_constraint_set:
+            self.undo_log.record(self._set_parse, *self._get_parse())
+            return self._parse_lexicon(constraint_set_key, max_output_choice_lengths_sum)
 
+        changed_outputs = set()
+        for old_word_string, new_word_string in word_changes:
+            if old_word_string is not None:
+                changed_outputs.update(self._remove_input(old_word_string))
+            if new_word_string is not None:
+                changed_outputs.update(self._add_input(new_word_string))
+        for output in changed_outputs:
+            self._update_output_choice_length(output)
+        return True
+
+    def _parse_lexicon(self, constraint_set_key: tuple, max_output_choice_lengths_sum: float | None = None) -> bool:
+        """
+        Parse the lexicon words one by one. Once the output choice lengths are sure to exceed
+        max_output_choice_lengths_sum (see `_get_output_choice_lengths_lower_bound`), the parse is cut short: it is
+        left empty and False is returned. The sum of the output choice lengths so far is no such bound - an input
+        parsed later may parse a data word with fewer bits - and the lower bound is checked every 1/16 of the lexicon,
+        as checking it after every input takes longer than parsing with cached output automata.
         """
-        data_parse_dict = self.parse_data()
+        self._set_parse(constraint_set_key, Counter(), dict(), dict(), dict(), 0)
+        lexicon_word_counts = Counter(str(word) for word in self.grammar.lexicon.get_words())
+        shortest_output_choice_lengths = dict()  # of the data words parsed so far
+        bound_check_interval = max(1, len(lexicon_word_counts) // 16)
+        for number_of_parsed_inputs, (word_string, count) in enumerate(lexicon_word_counts.items(), 1):
+            number_of_outputs, outputs_in_data = self._generate_parse(word_string)
+            self._insert_input(word_string, number_of_outputs, outputs_in_data, count=count)
+            if max_output_choice_lengths_sum is None:
+                continue
+            for output in outputs_in_data:
+                output_choice_length = self.get_output_choice_length(number_of_outputs)
+                if output_choice_length < shortest_output_choice_lengths.get(output, sys.maxsize):
+                    shortest_output_choice_lengths[output] = output_choice_length
+            number_of_inputs_left = len(lexicon_word_counts) - number_of_parsed_inputs
+            if number_of_inputs_left == 0 or number_of_parsed_inputs % bound_check_interval:
+                continue
+            lower_bound = self._get_output_choice_lengths_lower_bound(
+                shortest_output_choice_lengths, number_of_inputs_left, max_output_choice_lengths_sum)
+            if lower_bound > max_output_choice_lengths_sum:
+                self._set_parse(None, Counter(), dict(), dict(), dict(), 0)
+                return False
 
-        for word in self.data:
-            if not data_parse_dict[word]:  # if data_parse_dict[word] is the empty set
-                return sys.maxsize
+        for output in self._parses_by_output:
+            self._set_output_choice_length(output, self._get_shortest_output_choice_length(output))
+        return True
+
+    def _get_output_choice_lengths_lower_bound(self, shortest_output_choice_lengths: dict[str, int],
+                                               number_of_inputs_left: int, max_lower_bound: float) -> int:
+        """
+        A lower bound of the output choice lengths sum once the inputs left are parsed too, given the shortest output
+        choice lengths of the data words parsed so far - computed until it exceeds max_lower_bound.
+
+        The sum is counted in layers: layer l has the data words of output choice length l or more, and the sum is
+        the multiplicities in all the layers. An input with n outputs parses each of them with ceil(log(n, 2)) bits,
+        so it takes at most 2 ** (l - 1) data words out of layer l - a lower bound of layer l is the data words in it
+        so far (those not parsed so far are in every layer) without the number_of_inputs_left * 2 ** (l - 1) most
+        frequent ones.
+        """
+        lower_bound = 0
+        words_in_layer = self._get_data_by_multiplicity()
+        layer = 1
+        while lower_bound <= max_lower_bound:
+            words_in_layer = [word for word in words_in_layer
+                              if shortest_output_choice_lengths.get(word, sys.maxsize) >= layer]
+            number_of_words_taken_out = number_of_inputs_left * 2 ** (layer - 1)
+            if len(words_in_layer) <= number_of_words_taken_out:
+                break
+            lower_bound += sum(self.data[word] for word in words_in_layer[number_of_words_taken_out:])
+            layer += 1
+        return lower_bound
 
-        input_choice_length = ceil(log(self.grammar.lexicon.get_number_of_distinct_words(), 2))
+    def _get_parse(self) -> tuple:
+        return (self._parsed_constraint_set, self._lexicon_word_counts, self._parse_by_input,
+                self._parses_by_output, self._output_choice_lengths, self._output_choice_lengths_sum)
 
-        total_length = 0
-        for word in self.data:
-            total_length += min([self.encode_output(parse, input_choice_length) for parse in data_parse_dict[word]])
+    def _set_parse(self, parsed_constraint_set, lexicon_word_counts, parse_by_input, parses_by_output,
+                   output_choice_lengths, output_choice_lengths_sum):
+        self._parsed_constraint_set = parsed_constraint_set
+        self._lexicon_word_counts = lexicon_word_counts
+        self._parse_by_input = parse_by_input
+        self._parses_by_output = parses_by_output
+        self._output_choice_lengths = output_choice_lengths
+        self._output_choice_lengths_sum = output_choice_lengths_sum
 
-        self.data_parse = data_parse_dict
-        return total_length
+    def _generate_parse(self, word_string: str) -> tuple[int, list[str]]:
+        """(the number of outputs of the input, its outputs which are in the data) - the outputs are not enumerated"""
+        output_automaton = self.grammar.get_output_automaton(Word(word_string, self.grammar.feature_table))
+        return output_automaton.get_number_of_outputs(), output_automaton.get_accepted_strings(self._get_data_trie())
+
+    def _get_data_trie(self) -> dict:
+        if self._data_trie is None:
+            self._data_trie = make_strings_trie(self.data)
+        return self._data_trie
+
+    def _get_data_by_multiplicity(self) -> list[str]:
+        if self._data_by_multiplicity is None:
+            self._data_by_multiplicity = [word for word, _ in self.data.most_common()]
+        return self._data_by_multiplicity
+
+    def _add_input(self, word_string: str) -> list[str]:
+        """returns the data words whose parses were changed"""
+        if word_string in self._lexicon_word_counts:  # already parsed
+            self._change_lexicon_word_count(word_string, 1)
+            self.undo_log.record(self._change_lexicon_word_count, word_string, -1)
+            return []
+
+        number_of_outputs, outputs_in_data = self._generate_parse(word_string)
+        self._insert_input(word_string, number_of_outputs, outputs_in_data)
+        self.undo_log.record(self._delete_input, word_string)
+        return outputs_in_data
+
+    def _remove_input(self, word_string: str) -> list[str]:
+        """returns the data words whose parses were changed"""
+        if self._lexicon_word_counts[word_string] > 1:  # other copies of the word are still in the lexicon
+            self._change_lexicon_word_count(word_string, -1)
+            self.undo_log.record(self._change_lexicon_word_count, word_string, 1)
+            return []
+
+        number_of_outputs, outputs_in_data = self._delete_input(word_string)
+        self.undo_log.record(self._insert_input, word_string, number_of_outputs, outputs_in_data)
+        return outputs_in_data
+
+    def _change_lexicon_word_count(self, word_string: str, difference: int):
+        self._lexicon_word_counts[word_string] += difference
+
+    def _insert_input(self, word_string: str, number_of_outputs: int, outputs_in_data: list[str], count: int = 1):
+        self._lexicon_word_counts[word_string] = count
+        self._parse_by_input[word_string] = (number_of_outputs, outputs_in_data)
+        for output in outputs_in_data:
+            self._parses_by_output.setdefault(output, dict())[word_string] = number_of_outputs
+
+    def _delete_input(self, word_string: str) -> tuple[int, list[str]]:
+        del self._lexicon_word_counts[word_string]
+        number_of_outputs, outputs_in_data = self._parse_by_input.pop(word_string)
+        for output in outputs_in_data:
+            del self._parses_by_output[output][word_string]
+        return number_of_outputs, outputs_in_data
+
+    def _update_output_choice_length(self, output: str):
+        self.undo_log.record(self._set_output_choice_length, output, self._output_choice_lengths.get(output))
+        self._set_output_choice_length(output, self._get_shortest_output_choice_length(output))
+
+    def _get_shortest_output_choice_length(self, output: str) -> int | None:
+        """None if the data word has no parse"""
+        parses = self._parses_by_output[output]
+        if not parses:
+            return None
+        return min(self.get_output_choice_length(number_of_outputs) for number_of_outputs in parses.values())
+
+    def _set_output_choice_length(self, output: str, output_choice_length: int | None):
+        old_output_choice_length = self._output_choice_lengths.pop(output, 0)
+        if output_choice_length is not None:
+            self._output_choice_lengths[output] = output_choice_length
+        difference = (output_choice_length or 0) - old_output_choice_length
+        self._output_choice_lengths_sum += difference * self.data[output]
 
     def get_recent_data_parse(self) -> str:
         if not self.data_parse:
@@ -83,7 +329,7 @@ class TraversableGrammarHypothesis:
         return f"Energy: {self.combined_energy:,} bits (Grammar = {self.grammar_energy:,}) + (Data = {self.data_energy:,})"
 
     def parse_data(self) -> dict[str, set[tuple[str, int]]]:
-        """Parses Words
+        """Parses Words from scratch (`get_data_length_given_grammar` uses an incremental parse instead)
 
         :rtype: A dictionary that has the Words in data as keys and the values are sets of tuples. Each tuple
         contains (Word, int) which the Word is able to generate the Word in the key of the dictionary and
@@ -98,30 +344,106 @@ class TraversableGrammarHypothesis:
         data_parse = {word: set() for word in self.data}
         lexicon_word_set = set(self.grammar.lexicon.get_words())
         for word_in_lexicon in lexicon_word_set:
-            outputs = self.grammar.generate(word_in_lexicon)  # outputs in a list of Words
-            number_of_outputs = len(outputs)
-            for output in outputs:
-                if output in self.data:
-                    parse = (word_in_lexicon, number_of_outputs)
-                    data_parse[output].add(parse)
+            output_automaton = self.grammar.get_output_automaton(word_in_lexicon)
+            number_of_outputs = output_automaton.get_number_of_outputs()
+            for output in output_automaton.get_accepted_strings(self._get_data_trie()):
+                parse = (word_in_lexicon, number_of_outputs)
+                data_parse[output].add(parse)
         return data_parse
 
     # @timeit
     @staticmethod
     def encode_output(parse: tuple[str, int], input_choice_length: int) -> int:
         input, number_of_outputs = parse
-        output_choice_length = ceil(log(number_of_outputs, 2))
+        output_choice_length = TraversableGrammarHypothesis.get_output_choice_length(number_of_outputs)
         return input_choice_length + output_choice_length
 
-    def get_neighbor(self):
+    @staticmethod
+    def get_output_choice_length(number_of_outputs: int) -> int:
+        return ceil(log(number_of_outputs, 2))
+
+    def mutate(self, rng: random.Random) -> bool:
+        """
+        Mutate the grammar in place. Until the next mutation, the mutation (and the energy update that follows it)
+        can be reverted with `rollback_mutation`.
+
+        rtype: boolean - the mutation success
+        """
+        self.catch_up_data_parse()
+        self.commit_mutation()
+        self.undo_log.record(self._set_energies, self.grammar_energy, self.data_energy, self.combined_energy)
+        return self.grammar.make_mutation(self.undo_log, rng)
+
+    def catch_up_data_parse(self):
+        """
+        Update the data parse of a grammar that was evaluated without it - from the energy cache, or cut short (see
+        `get_data_length_given_grammar`). Otherwise the word changes of that grammar would be taken by the next
+        evaluation, and lost when it is rolled back, and a parse of another constraint set would be restored by
+        every rollback. Done before every mutation, and on a hypothesis before it is copied to many neighbors - so
+        that the update isn't made again in each of them.
+        """
+        if self._parsed_constraint_set is not None:
+            self._update_data_parse()
+
+    def commit_mutation(self):
+        self.undo_log.commit()
+
+    def rollback_mutation(self):
+        self.undo_log.rollback()
+
+    def _set_energies(self, grammar_energy: int, data_energy: int, combined_energy: int):
+        self.grammar_energy = grammar_energy
+        self.data_energy = data_energy
+        self.combined_energy = combined_energy
+
+    def is_energy_cached(self) -> bool:
+        """whether `update_energy` takes the energies of the grammar from the energy cache"""
+        return self.grammar.get_fingerprint() in self._energy_cache
+
+    def get_evaluation(self) -> tuple:
+        """the energies and the data parse of the last evaluation, see `set_evaluation`"""
+        return (self.grammar_energy, self.data_energy, self.combined_energy), self._get_parse()
+
+    def set_evaluation(self, evaluation: tuple):
+        """
+        Take the evaluation of a copy of this hypothesis (see `get_evaluation`) - e.g. one evaluated in another
+        process - instead of evaluating the grammar again. Like `update_energy`, it can be rolled back.
+        """
+        energies, parse = evaluation
+        self.grammar.lexicon.pop_word_changes()  # they are in the parse
+        self.undo_log.record(self._set_parse, *self._get_parse())
+        self._set_parse(*parse)
+        self._set_energies(*energies)
+        self._cache_energies(self.grammar.get_fingerprint())
+
+    def get_detached_copy(self):
+        """a shallow copy of this hypothesis with an empty energy cache - to send to another process without it"""
+        hypothesis_copy = copy.copy(self)
+        hypothesis_copy._energy_cache = OrderedDict()
+        return hypothesis_copy
+
+    def get_neighbor(self, rng: random.Random):
+        """a mutated copy of this hypothesis - `mutate` changes this hypothesis in place instead"""
         new_hypothesis = self.get_hypothesis_copy()
-        mutation_result = new_hypothesis.grammar.make_mutation()
+        mutation_result = new_hypothesis.mutate(rng)
+        new_hypothesis.commit_mutation()
         return mutation_result, new_hypothesis
 
     # @timeit
     def get_hypothesis_copy(self):
+        """a copy of the grammar and of the data parse, which shares the energy cache - the energies are those of the
+        grammars, whichever hypothesis evaluated them"""
         grammar_copy = pickle.loads(pickle.dumps(self.grammar, -1))
-        return TraversableGrammarHypothesis(grammar_copy, self.data)
+        hypothesis_copy = TraversableGrammarHypothesis(grammar_copy, self.data)
+        hypothesis_copy._data_trie = self._data_trie
+        hypothesis_copy._data_by_multiplicity = self._data_by_multiplicity
+        hypothesis_copy._set_parse(self._parsed_constraint_set, self._lexicon_word_counts.copy(),
+                                   self._parse_by_input.copy(),
+                                   {output: parses.copy() for output, parses in self._parses_by_output.items()},
+                                   self._output_choice_lengths.copy(), self._output_choice_lengths_sum)
+        hypothesis_copy._energy_cache = self._energy_cache
+        return hypothesis_copy
 
     def __str__(self):
-        return "Hypothesis with energy: {0}".format(self.update_energy())
+        """the energy of the last evaluation, see `update_energy`"""
+        return "Hypothesis with energy: {0}".format(self.combined_energy)
@@ -9,6 +9,7 @@ from src.grammar.constraint_set import ConstraintSet
 from src.grammar.features.feature_table import FeatureTable
 from src.grammar.grammar import Grammar
 from src.grammar.lexicon import Lexicon
+from src.init_simulation import run_simulated_annealing_restarts
 from src.models.corpus import Corpus
 from src.models.otml_configuration import OtmlConfiguration, settings
 from src.models.traversable_grammar_hypothesis import TraversableGrammarHypothesis
@@ -19,24 +20,52 @@ from src.simulated_annealing import SimulatedAnnealing
 @click.option(
     "-c", "--configuration", "config_folder_path", required=True, help="Relative path to the configuration folder"
 )
-def main(config_folder_path):
+@click.option(
+    "--replica-exchange", "replica_exchange", is_flag=True, help="Run parallel tempering instead of a single chain"
+)
+@click.option(
+    "--resume", "resume", is_flag=True, help="Continue from the last checkpoint of the simulation"
+)
+@click.option(
+    "--restarts", "number_of_restarts", type=click.IntRange(min=1), default=1,
+    help="Run this many independent restarts in parallel - with the configured seed and the ones after it - and "
+         "keep the best"
+)
+def main(config_folder_path, replica_exchange, resume, number_of_restarts):
+    if resume and replica_exchange:
+        raise click.UsageError("--resume is not supported with --replica-exchange")
+    if number_of_restarts > 1 and (resume or replica_exchange):
+        raise click.UsageError("--restarts is not supported with --resume or --replica-exchange")
+
     # load configurations
     OtmlConfiguration.load(config_folder_path)
+    if number_of_restarts > 1 and settings.speculative_batch_size > 1:
+        raise click.UsageError("--restarts is not supported with a speculative_batch_size over 1")
 
-    # load grammar and data
-    feature_table = FeatureTable.load(settings.features_file)
-    corpus = Corpus.load(settings.corpus_file)
-    constraint_set = ConstraintSet.load(settings.constraints_file, feature_table)
-    lexicon = Lexicon(corpus.get_words(), feature_table)
-    grammar = Grammar(feature_table, constraint_set, lexicon)
-    data = corpus.get_words()
+    if resume:
+        simulated_annealing = SimulatedAnnealing.load_checkpoint(settings.checkpoint_file)
+    else:
+        # load grammar and data
+        feature_table = FeatureTable.load(settings.features_file)
+        corpus = Corpus.load(settings.corpus_file)
+        constraint_set = ConstraintSet.load(settings.constraints_file, feature_table)
+        lexicon = Lexicon(corpus.get_words(), feature_table)
+        grammar = Grammar(feature_table, constraint_set, lexicon)
+        data = corpus.get_word_counts()
 
-    # prepare data for optimization
-    traversable_hypothesis = TraversableGrammarHypothesis(grammar, data)
-    simulated_annealing = SimulatedAnnealing(traversable_hypothesis)
+        # prepare data for optimization
+        traversable_hypothesis = TraversableGrammarHypothesis(grammar, data)
+        simulated_annealing = SimulatedAnnealing(traversable_hypothesis)
 
     print("Starting optimization")
-    step, hypothesis = simulated_annealing.run()
+    if replica_exchange:
+        step, hypothesis = simulated_annealing.run_replica_exchange()
+    elif number_of_restarts > 1:
+        seed = simulated_annealing.config.seed
+        step, hypothesis = run_simulated_annealing_restarts(simulated_annealing,
+                                                            list(range(seed, seed + number_of_restarts)))
+    else:
+        step, hypothesis = simulated_annealing.run(resume=resume)
     print(f'Ran {step} steps. Final hypothesis: {hypothesis}')
     print("Done")
 
@@ -2,21 +2,19 @@
 from __future__ import absolute_import, division, print_function, unicode_literals
 
 import logging
+import multiprocessing
 import os
+import pickle
 import random
 import re
 import subprocess
 import sys
 import time
 from datetime import timedelta
-from math import exp
-from random import choice
-
-from src.grammar.constraint import Constraint
-from src.grammar.constraint_set import ConstraintSet
-from src.grammar.grammar import Grammar
-from src.grammar.lexicon import Word
-from src.models.otml_configuration import settings
+from math import exp, ceil, log
+
+from src.cooling_schedule import CoolingSchedule, GeometricCoolingSchedule, get_cooling_schedule
+from src.models.otml_configuration import RunConfiguration
 from src.models.traversable_grammar_hypothesis import TraversableGrammarHypothesis
 
 logger = logging.getLogger(__name__)
@@ -34,26 +32,37 @@ class SimulatedAnnealing(object):
                  target_lexicon_indicator_function: int | None = None,
                  sample_target_lexicon: int | None = None,
                  sample_target_outputs: int | None = None,
-                 target_energy: int | None = None):
+                 target_energy: int | None = None,
+                 seed: int | None = None,
+                 config: RunConfiguration | None = None):
 
         self.initial_hypothesis = initial_hypothesis
-        self.current_hypothesis = initial_hypothesis
+        self.current_hypothesis = initial_hypothesis.get_hypothesis_copy()  # mutated in place during the run
         self.target_lexicon_indicator_function = target_lexicon_indicator_function
         self.target_energy = target_energy
+        self.seed = seed  # overrides the configured seed, e.g. for restarts with different seeds
+        # the configuration of the run - the one of the grammar unless given
+        self.config: RunConfiguration = config or initial_hypothesis.grammar.config
+        # every random draw of the run - mutations and switches - is made from this generator, so runs in the same
+        # process do not disturb each other's sequences. The ties in the generation of outputs are not broken by the
+        # run, see `Grammar.get_transducer`
+        self.rng: random.Random = random.Random()
 
         # all these parameters are going to be set DURING RUN
         self.step = 0
         self.current_temperature = None
         self.threshold = None
-        self.cooling_parameter = None
+        self.cooling_schedule: CoolingSchedule | None = None
         self.current_hypothesis_energy = None
-        self.neighbor_hypothesis = None
         self.neighbor_hypothesis_energy = None
         self.step_limitation = None
         self.number_of_expected_steps = None
         self.start_time = None
         self.previous_interval_time = None
         self.previous_interval_energy = None
+        self.lowest_energy = None
+        self.lowest_energy_step = None
+        self.lowest_energy_time = None
         self.target_data = False
         self.sample_target_lexicon = None
         self.sample_target_outputs = None
@@ -63,67 +72,280 @@ class SimulatedAnnealing(object):
             self.sample_target_lexicon = sample_target_lexicon
             self.sample_target_outputs = sample_target_outputs
 
-    def run(self) -> tuple[int, TraversableGrammarHypothesis]:
+    def run(self, resume: bool = False) -> tuple[int, TraversableGrammarHypothesis]:
         """
         Run the simulated annealing.
 
+        Args:
+            resume: continue a run restored by `load_checkpoint` instead of starting a new one.
+
         Returns:
             The number of steps taken and the final hypothesis.
         """
-        self.before_loop()
+        if resume:
+            logger.info(f"Resuming at step {self.step + 1:,} at temperature {self.current_temperature}")
+        else:
+            self.before_loop()
+        self.pin_current_hypothesis_caching()
+
+        pool = None
+        if self.config.speculative_batch_size > 1:
+            # the workers get the configuration of the run with the neighbors, in their grammars
+            pool = multiprocessing.Pool(self.config.speculative_number_of_processes)
+        try:
+            while ((self.current_temperature > self.threshold) and (self.step != self.step_limitation) and
+                   not self._is_stopping()):
+                if self.step % 100 == 0:
+                    print(self.current_hypothesis.grammar)
+                if pool is None:
+                    self.make_step()
+                else:
+                    steps_to_checkpoint = self.config.checkpoint_interval - self.step % self.config.checkpoint_interval
+                    self.make_speculative_steps(pool, int(min(self.config.speculative_batch_size, steps_to_checkpoint,
+                                                              self.step_limitation - self.step)))
+                if self.current_hypothesis_energy < self.lowest_energy:
+                    self.lowest_energy = self.current_hypothesis_energy
+                    self.lowest_energy_step = self.step
+                    self.lowest_energy_time = time.time()
+                if not self.step % self.config.checkpoint_interval:
+                    self.save_checkpoint(self.config.checkpoint_file)
+        finally:
+            if pool is not None:
+                pool.terminate()
 
-        while (self.current_temperature > self.threshold) and (self.step != self.step_limitation):
-            if self.step % 100 == 0:
-                print(self.current_hypothesis.grammar)
-            self.make_step()
+        self._after_loop()
+        return self.step, self.current_hypothesis
+
+    def run_replica_exchange(self) -> tuple[int, TraversableGrammarHypothesis]:
+        """
+        Run parallel tempering (replica exchange) instead of a single cooling chain.
+
+        Every replica runs in its own worker process at a fixed temperature. The temperatures are geometrically
+        spaced between `replica_exchange_min_temp` and `initial_temp`. Every `replica_exchange_swap_interval` steps
+        the hypotheses of adjacent temperatures are swapped using the Metropolis swap criterion. Swapping is done by
+        exchanging the temperatures of the workers, so only energies travel between the processes. The stopping rules
+        (see `_is_stopping`) are checked between the rounds, on the lowest energy of the replicas.
+
+        Returns:
+            The number of steps taken by each replica and the lowest-energy final hypothesis.
+        """
+        self.before_loop()
 
+        number_of_replicas = self.config.replica_exchange_number_of_replicas or os.cpu_count()
+        swap_interval = self.config.replica_exchange_swap_interval
+        min_temp = self.config.replica_exchange_min_temp or self.config.threshold
+        temperatures = _get_geometric_temperatures(min_temp, self.config.initial_temp, number_of_replicas)
+        logger.info(f"Replica exchange temperatures: {temperatures}")
+
+        self.cooling_schedule = GeometricCoolingSchedule(1)  # every replica stays at the temperature it is given
+        connections = list()
+        workers = list()
+        for replica_index in range(number_of_replicas):
+            parent_connection, child_connection = multiprocessing.Pipe()
+            worker = multiprocessing.Process(target=_replica_exchange_worker,
+                                             args=(child_connection, self, self.rng.randrange(sys.maxsize)))
+            worker.start()
+            connections.append(parent_connection)
+            workers.append(worker)
+
+        replica_by_temperature = list(range(number_of_replicas))  # index of the worker holding each temperature
+        energies = [self.current_hypothesis_energy] * number_of_replicas  # energy by worker index
+        number_of_rounds = ceil(self.number_of_expected_steps / swap_interval)
+        number_of_swaps = 0
+        number_of_rounds_run = 0
+
+        for round_number in range(number_of_rounds):
+            if round_number and self._is_stopping():
+                break
+            number_of_rounds_run += 1
+            number_of_steps = min(swap_interval, self.number_of_expected_steps - self.step)
+            for temperature, replica_index in zip(temperatures, replica_by_temperature):
+                connections[replica_index].send((temperature, number_of_steps))
+            for replica_index, connection in enumerate(connections):
+                energies[replica_index] = connection.recv()
+            self.step += number_of_steps
+
+            number_of_swaps += _swap_replicas(temperatures, replica_by_temperature, energies, round_number, self.rng)
+
+            # the run is as good as its best replica - the stopping rules follow it
+            self.current_hypothesis_energy = min(energies)
+            if self.current_hypothesis_energy < self.lowest_energy:
+                self.lowest_energy = self.current_hypothesis_energy
+                self.lowest_energy_step = self.step
+                self.lowest_energy_time = time.time()
+            logger.info(f"Replica exchange step {self.step:,}: energies by temperature "
+                        f"{[energies[replica_index] for replica_index in replica_by_temperature]}")
+
+        final_hypotheses = list()
+        for connection, worker in zip(connections, workers):
+            connection.send(None)
+            final_hypotheses.append(connection.recv())
+            worker.join()
+
+        logger.info(f"Replica exchange made {number_of_swaps} swaps in {number_of_rounds_run} rounds")
+        self.current_hypothesis_energy, self.current_hypothesis = min(final_hypotheses, key=lambda item: item[0])
         self._after_loop()
         return self.step, self.current_hypothesis
 
     # @timeit
     def make_step(self):
         self.step += 1
-        self.current_temperature *= self.cooling_parameter
+        self.current_temperature = self.cooling_schedule.get_next_temperature(self.current_temperature)
 
         self._check_for_intervals()
 
-        mutation_result, neighbor_hypothesis = self.current_hypothesis.get_neighbor()
+        # the neighbor hypothesis is the current hypothesis mutated in place - it is rolled back if not switched to
+        mutation_result = self.current_hypothesis.mutate(self.rng)
         if not mutation_result:
+            self.current_hypothesis.rollback_mutation()
             return  # mutation failed - the neighbor hypothesis is the same as the current hypothesis
 
-        self.neighbor_hypothesis = neighbor_hypothesis
-        self.neighbor_hypothesis_energy = self.neighbor_hypothesis.update_energy()
+        # the number deciding the switch is drawn in advance, so that evaluating a neighbor that is sure to be
+        # rejected can be cut short
+        switch_draw = self.rng.random()
+        max_neighbor_energy = None  # a draw of 0 switches to any neighbor
+        if switch_draw:
+            max_neighbor_energy = self.current_hypothesis_energy - self.current_temperature * log(switch_draw)
+        self.neighbor_hypothesis_energy = self.current_hypothesis.update_energy(max_neighbor_energy)
+        switched = self._is_switching(switch_draw)
+        if switched:
+            self.current_hypothesis.commit_mutation()
+            self.current_hypothesis_energy = self.neighbor_hypothesis_energy
+            self.pin_current_hypothesis_caching()
+        else:
+            self.current_hypothesis.rollback_mutation()
+        self.cooling_schedule.record_step(self.current_temperature, self.current_hypothesis_energy, switched)
+
+    def make_speculative_steps(self, pool: multiprocessing.Pool, number_of_steps: int):
+        """
+        Make up to `number_of_steps` steps at once: draw a neighbor of the current hypothesis for every step,
+        evaluate their energies in parallel in the pool's processes, then walk the acceptance decisions in order.
+
+        A rejected neighbor leaves the current hypothesis as is, so until the first switch all the neighbors are
+        proposals from the same hypothesis - exactly what `make_step` would have proposed. The neighbors after
+        the first switch were drawn from the wrong hypothesis and are discarded, along with their steps.
+        """
+        neighbors = [self.current_hypothesis.get_neighbor(self.rng) for _ in range(number_of_steps)]
+        # the neighbors share the energy cache of the current hypothesis (see `get_hypothesis_copy`) - those not in it
+        # are evaluated in the pool's processes, and take the evaluation with its data parse, so an accepted neighbor
+        # is not evaluated again
+        neighbors_to_evaluate = list()
+        for mutation_result, neighbor in neighbors:
+            if mutation_result and neighbor.is_energy_cached():
+                neighbor.update_energy()
+            elif mutation_result:
+                neighbors_to_evaluate.append(neighbor)
+        evaluations = pool.map(_evaluate_neighbor, [neighbor.get_detached_copy() for neighbor in neighbors_to_evaluate])
+        for neighbor, evaluation in zip(neighbors_to_evaluate, evaluations):
+            neighbor.set_evaluation(evaluation)
+
+        for step_in_batch, (mutation_result, neighbor) in enumerate(neighbors):
+            if step_in_batch and (self.current_temperature <= self.threshold or self._is_stopping()):
+                break
+            self.step += 1
+            self.current_temperature = self.cooling_schedule.get_next_temperature(self.current_temperature)
+
+            self._check_for_intervals()
+
+            if not mutation_result:
+                continue  # mutation failed - the neighbor hypothesis is the same as the current hypothesis
+
+            self.neighbor_hypothesis_energy = neighbor.combined_energy
+            switched = self._is_switching(self.rng.random())
+            if switched:
+                self.current_hypothesis = neighbor
+                self.current_hypothesis_energy = self.neighbor_hypothesis_energy
+                self.pin_current_hypothesis_caching()
+                # the next batch copies the hypothesis - whose parse is behind its grammar if its energy was cached
+                self.current_hypothesis.catch_up_data_parse()
+            self.cooling_schedule.record_step(self.current_temperature, self.current_hypothesis_energy, switched)
+            if switched:
+                break
+
+    def _is_switching(self, switch_draw: float) -> bool:
+        """
+        The Metropolis criterion for switching from the current hypothesis to the neighbor hypothesis.
+        switch_draw is a uniform random number in [0, 1).
+        """
         delta = self.neighbor_hypothesis_energy - self.current_hypothesis_energy
 
         if delta < 0:
             p = 1
         else:
             p = exp(-delta / self.current_temperature)
-        if random.random() < p:
+        if switch_draw < p:
             logger.info("switch")
-            self.current_hypothesis = self.neighbor_hypothesis
-            self.current_hypothesis_energy = self.neighbor_hypothesis_energy
-        else:
-            logger.info("did not switch")
+            return True
+        logger.info("did not switch")
+        return False
+
+    def save_checkpoint(self, checkpoint_file: str):
+        """
+        Atomically write the whole annealing state (hypotheses, step, temperature, RNG state and optionally the
+        transducer caches) so that `load_checkpoint` can continue the run - from the step after `self.step`.
+
+        A resume continues the run bit-for-bit either way: without the saved caches it compiles the transducers
+        again, and gets the same ones (see `Grammar.get_transducer`).
+        """
+        checkpoint = {
+            "simulated_annealing": self,
+            "elapsed_time": time.time() - self.start_time,
+            "modules_caching": None,
+        }
+        if self.config.checkpoint_transducer_caches:
+            checkpoint["modules_caching"] = self.current_hypothesis.grammar.cache_manager.get_state()
+
+        temporary_file = f"{checkpoint_file}.tmp"
+        with open(temporary_file, "wb") as f:
+            pickle.dump(checkpoint, f, -1)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temporary_file, checkpoint_file)
+        logger.info(f"Checkpoint saved after step {self.step:,}")
+
+    @classmethod
+    def load_checkpoint(cls, checkpoint_file: str) -> "SimulatedAnnealing":
+        """
+        Restore an annealing saved by `save_checkpoint`. Continue it with `run(resume=True)`.
+        """
+        with open(checkpoint_file, "rb") as f:
+            checkpoint = pickle.load(f)
+
+        simulated_annealing = checkpoint["simulated_annealing"]
+        time_from_start_to_interval = simulated_annealing.previous_interval_time - simulated_annealing.start_time
+        time_from_start_to_lowest_energy = simulated_annealing.lowest_energy_time - simulated_annealing.start_time
+        simulated_annealing.start_time = time.time() - checkpoint["elapsed_time"]
+        simulated_annealing.previous_interval_time = simulated_annealing.start_time + time_from_start_to_interval
+        simulated_annealing.lowest_energy_time = simulated_annealing.start_time + time_from_start_to_lowest_energy
+
+        simulated_annealing.clear_modules_caching()
+        if checkpoint["modules_caching"] is not None:
+            simulated_annealing.current_hypothesis.grammar.cache_manager.set_state(checkpoint["modules_caching"])
+        return simulated_annealing
 
     def before_loop(self):
         self.start_time = time.time()
         self.previous_interval_time = self.start_time
         logger.info(f"Process Id: {process_id}")
-        if settings.random_seed:
-            seed = choice(range(1, 1000))
+        if self.seed is not None:
+            seed = self.seed
+            logger.info(f"Seed: {seed} - given to this run")
+        elif self.config.random_seed:
+            seed = random.Random().randrange(1, 1000)  # a new generator is seeded by the OS
             logger.info(f"Seed: {seed} - randomly selected")
         else:
-            seed = settings.seed
+            seed = self.config.seed
             logger.info(f"Seed: {seed} - specified")
-        random.seed(seed)
-        logger.info(settings)
+        self.rng.seed(seed)
+        logger.info(self.config)
         logger.info(self.current_hypothesis.grammar.feature_table)
-        self.step_limitation = settings.steps_limitation
+        self.cooling_schedule = get_cooling_schedule(self.config)
+        self.step_limitation = self.config.steps_limitation
         if self.step_limitation != sys.maxsize:
             self.number_of_expected_steps = self.step_limitation
         else:
-            self.number_of_expected_steps = self._calculate_num_of_steps()
+            self.number_of_expected_steps = self.cooling_schedule.get_expected_number_of_steps(
+                self.config.initial_temp, self.config.threshold)
 
         logger.info("Number of expected steps is: {:,}".format(self.number_of_expected_steps))
         self.current_hypothesis_energy = self.current_hypothesis.update_energy()
@@ -132,14 +354,31 @@ class SimulatedAnnealing(object):
 
         self._log_hypothesis_state()
         self.previous_interval_energy = self.current_hypothesis_energy
-        self.current_temperature = settings.initial_temp
-        self.threshold = settings.threshold
-        self.cooling_parameter = settings.cooling_factor
+        self.lowest_energy = self.current_hypothesis_energy
+        self.lowest_energy_step = self.step
+        self.lowest_energy_time = self.start_time
+        self.current_temperature = self.config.initial_temp
+        self.threshold = self.config.threshold
+
+    def _is_stopping(self) -> bool:
+        """the stopping rules checked before every step, besides the temperature threshold and the step limitation"""
+        current_time = time.time()
+        if self.target_energy is not None and self.current_hypothesis_energy <= self.target_energy:
+            logger.info(f"Stopping: reached the target energy {self.target_energy:,}")
+        elif self.step - self.lowest_energy_step >= self.config.plateau_steps:
+            logger.info(f"Stopping: no new lowest energy for {self.config.plateau_steps:,} steps")
+        elif current_time - self.lowest_energy_time >= self.config.plateau_seconds:
+            logger.info(f"Stopping: no new lowest energy for {_pretty_runtime_str(self.config.plateau_seconds)}")
+        elif current_time - self.start_time >= self.config.time_budget_seconds:
+            logger.info(f"Stopping: the time budget of {_pretty_runtime_str(self.config.time_budget_seconds)} is over")
+        else:
+            return False
+        return True
 
     def _check_for_intervals(self):
-        if not self.step % settings.debug_logging_interval:
+        if not self.step % self.config.debug_logging_interval:
             self._debug_interval()
-        if not self.step % settings.clear_modules_caching_interval:
+        if not self.step % self.config.clear_modules_caching_interval:
             self.clear_modules_caching()
 
     def _debug_interval(self):
@@ -154,6 +393,8 @@ class SimulatedAnnealing(object):
         logger.info(f"Expected simulation time: {_pretty_runtime_str(elapsed_time * (100 / percentage_completed))}")
         logger.info(f"Current temperature: {self.current_temperature}")
         self._log_hypothesis_state()
+        self.current_hypothesis.grammar.cache_manager.log_usage()
+        logger.info(f"Memory usage: {self._get_memory_usage()} MB")
         logger.info(
             f"Energy difference from last interval: {self.current_hypothesis_energy - self.previous_interval_energy}")
         self.previous_interval_energy = self.current_hypothesis_energy
@@ -164,23 +405,25 @@ class SimulatedAnnealing(object):
 
     def by_interval_time(self, time_from_last_interval):
         number_of_remaining_steps = self.number_of_expected_steps - self.step
-        number_of_remaining_intervals = int(number_of_remaining_steps / settings.debug_logging_interval) + 1
+        number_of_remaining_intervals = int(number_of_remaining_steps / self.config.debug_logging_interval) + 1
         expected_time = number_of_remaining_intervals * time_from_last_interval
         return _pretty_runtime_str(expected_time)
 
     def _after_loop(self):
         current_time = time.time()
         logger.info(HEADLINE_FORMAT.format(stars=_STARS, headline="Final Hypothesis"))
+        self.current_hypothesis.grammar.cache_manager.unpin(id(self))
         self._log_hypothesis_state()
         logger.info(f"simulated annealing runtime was: {_pretty_runtime_str(current_time - self.start_time)}")
 
     def _log_hypothesis_state(self):
         logger.info(f"Grammar with: {self.current_hypothesis.grammar.constraint_set}:")
-        if settings.restriction_on_alphabet:
+        if self.config.restriction_on_alphabet:
             restricted_alphabet = self.current_hypothesis.grammar.lexicon.get_distinct_segments()
             restricted_alphabet_list = [segment.symbol for segment in restricted_alphabet]
             logger.info(f"Alphabet: {restricted_alphabet_list}")
-        logger.info(f"Lexicon: {self.current_hypothesis.grammar.lexicon}")
+        lexicon = self.current_hypothesis.grammar.lexicon
+        logger.info(f"Lexicon: {lexicon.get_description(self.config.log_lexicon_words)}")
         logger.info(f"Parse: {self.current_hypothesis.get_recent_data_parse()}")
         logger.info(self.current_hypothesis.get_recent_energy_signature())
         if self.target_energy:
@@ -203,55 +446,63 @@ class SimulatedAnnealing(object):
         (output, err) = p.communicate()
         return int((int(output) / 1024))  # memory usage in MB
 
-    @staticmethod
-    def _calculate_num_of_steps():
-        step = 0
-        temp = settings.initial_temp
-        while temp > settings.threshold:
-            step += 1
-            temp *= settings.cooling_factor
-        return step
-
     def clear_modules_caching(self):
-        Grammar.clear_caching()
-        ConstraintSet.clear_caching()
-        Constraint.clear_caching()
-        Word.clear_caching()
-
-        diagnostics_flag = False
-        if diagnostics_flag:
-            def object_size_in_mb(object_):
-                from pympler.asizeof import asizeof
-
-                return int((asizeof(object_) / (1024 ** 2)))
-
-            import grammar.grammar
-            import grammar.constraint_set
-            import grammar.constraint
-            import grammar.lexicon
-
-            memoization_size = object_size_in_mb(grammar.grammar.generation_memoization)
-            grammar_transducers_size = object_size_in_mb(grammar.grammar.grammar_transducers)
-            constraint_set_transducers_size = object_size_in_mb(grammar.constraint_set.constraint_set_transducers)
-            constraint_transducers_size = object_size_in_mb(grammar.constraint.constraint_transducers)
-            word_transducers_size = object_size_in_mb(grammar.lexicon.word_transducers)
-
-            logger.info(f"asizeof generation_memoization: {memoization_size} MB")
-            logger.info(f"length generation_memoization: {len(grammar.grammar.generation_memoization)}")
-
-            logger.info("asizeof grammar_transducers: {} MB".format(grammar_transducers_size))
-            logger.info("length grammar_transducers: {}".format(len(grammar.grammar.grammar_transducers)))
-            logger.info("asizeof constraint_set_transducers: {} MB".format(constraint_set_transducers_size))
-            logger.info("asizeof constraint_transducers: {} MB".format(constraint_transducers_size))
-
-            logger.info("asizeof word_transducers: {} MB".format(word_transducers_size))
-            logger.info("length word_transducers: {}".format(len(grammar.lexicon.word_transducers)))
-
-            sum_asizeof = (memoization_size + grammar_transducers_size + constraint_set_transducers_size +
-                           constraint_transducers_size + word_transducers_size)
-
-            logger.info(f"sum asizeof: {sum_asizeof} MB")
-            logger.info(f"Memory usage: {self._get_memory_usage()} MB")
+        self.current_hypothesis.grammar.cache_manager.clear()
+
+    def pin_current_hypothesis_caching(self):
+        """Keep the cache entries of the current hypothesis when the caches are over their budgets"""
+        grammar = self.current_hypothesis.grammar
+        grammar.cache_manager.pin_grammar(id(self), grammar)
+
+
+def _get_geometric_temperatures(min_temp, max_temp, number_of_temperatures):
+    if number_of_temperatures == 1:
+        return [min_temp]
+    ratio = (max_temp / min_temp) ** (1 / (number_of_temperatures - 1))
+    return [min_temp * ratio ** i for i in range(number_of_temperatures)]
+
+
+def _swap_replicas(temperatures: list[float], replica_by_temperature: list[int], energies: list[int],
+                   round_number: int, rng: random.Random) -> int:
+    """
+    Swap the replicas of adjacent temperatures in replica_by_temperature (the index of the worker holding each
+    temperature), by the Metropolis swap criterion on their energies (by worker index). The even pairs of
+    temperatures are tried in even rounds, and the odd pairs in odd rounds. Returns the number of swaps.
+    """
+    number_of_swaps = 0
+    for i in range(round_number % 2, len(temperatures) - 1, 2):
+        colder, hotter = replica_by_temperature[i], replica_by_temperature[i + 1]
+        exponent = (1 / temperatures[i] - 1 / temperatures[i + 1]) * (energies[colder] - energies[hotter])
+        if exponent >= 0 or rng.random() < exp(exponent):
+            replica_by_temperature[i], replica_by_temperature[i + 1] = hotter, colder
+            number_of_swaps += 1
+    return number_of_swaps
+
+
+def _replica_exchange_worker(connection, simulated_annealing, seed):
+    """
+    Runs a single replica: receives (temperature, number_of_steps) requests and answers with the current energy.
+    A `None` request ends the worker, which then sends back its final (energy, hypothesis).
+    The replica runs with the configuration of simulated_annealing, `SimulatedAnnealing.config`.
+    """
+    simulated_annealing.rng.seed(seed)
+    while True:
+        request = connection.recv()
+        if request is None:
+            break
+        simulated_annealing.current_temperature, number_of_steps = request
+        for _ in range(number_of_steps):
+            simulated_annealing.make_step()
+        connection.send(simulated_annealing.current_hypothesis_energy)
+
+    connection.send((simulated_annealing.current_hypothesis_energy, simulated_annealing.current_hypothesis))
+    connection.close()
+
+
+def _evaluate_neighbor(neighbor_hypothesis: TraversableGrammarHypothesis) -> tuple:
+    """evaluate a neighbor in a pool process, and send back its evaluation - see `set_evaluation`"""
+    neighbor_hypothesis.update_energy()
+    return neighbor_hypothesis.get_evaluation()
 
 
 def _pretty_runtime_str(run_time_in_seconds):
@@ -0,0 +1,27 @@
+from functools import lru_cache
+from hashlib import blake2b
+
+FINGERPRINT_BITS = 64
+FINGERPRINT_MASK = (1 << FINGERPRINT_BITS) - 1
+
+
+@lru_cache(maxsize=2 ** 16)
+def get_string_fingerprint(string: str) -> int:
+    """
+    A 64-bit hash of a string. Unlike `hash`, it is the same in every process, so fingerprints can be pickled.
+
+    Fingerprints of collections are sums of the fingerprints of their elements (modulo 2 ** 64), Zobrist style: a
+    changed element changes the sum by the difference of its fingerprints, so it is updated in O(1).
+    """
+    return int.from_bytes(blake2b(string.encode(), digest_size=FINGERPRINT_BITS // 8).digest(), "little")
+
+
+def get_ranked_fingerprint(fingerprint: int, rank: int) -> int:
+    """
+    The fingerprint of an element at a rank, from the fingerprint of the element, in O(1) - the splitmix64 finalizer
+    of their combination
+    """
+    fingerprint = (fingerprint + (rank + 1) * 0x9E3779B97F4A7C15) & FINGERPRINT_MASK
+    fingerprint = ((fingerprint ^ (fingerprint >> 30)) * 0xBF58476D1CE4E5B9) & FINGERPRINT_MASK
+    fingerprint = ((fingerprint ^ (fingerprint >> 27)) * 0x94D049BB133111EB) & FINGERPRINT_MASK
+    return fingerprint ^ (fingerprint >> 31)
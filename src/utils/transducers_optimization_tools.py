@@ -1,7 +1,7 @@
 # Python2 and Python 3 compatibility:
 from __future__ import absolute_import, division, print_function, unicode_literals
 
-import itertools
+import copy
 import logging
 import pickle
 import random
@@ -9,13 +9,14 @@ from functools import reduce
 
 from src.exceptions import TransducerOptimizationError
 from src.grammar.lexicon import Word
+from src.models.cache_manager import CacheManager
 from src.models.transducer import Transducer, CostVector, Arc
 
 logger = logging.getLogger(__name__)
 
 
-def get_cheapest_state(list_of_states, cost_by_state_dict):
-    most_harmonic_state = random.choice(list_of_states)
+def get_cheapest_state(list_of_states, cost_by_state_dict, rng: random.Random):
+    most_harmonic_state = rng.choice(list_of_states)
     try:  # TODO for debug prints
         most_harmonic_cost_vector = cost_by_state_dict[most_harmonic_state]
     except KeyError as ex:
@@ -28,19 +29,19 @@ def get_cheapest_state(list_of_states, cost_by_state_dict):
     return most_harmonic_state
 
 
-def remove_suboptimal_paths(transducer):
+def remove_suboptimal_paths(transducer, rng: random.Random):
     active_states = set(transducer.states)
     costs = {state: CostVector.get_inf_vector() for state in active_states}
     costs[transducer.initial_state] = CostVector.get_vector(transducer.get_length_of_cost_vectors(), 0)
 
     while active_states:
-        cheapest_state = get_cheapest_state(list(active_states), costs)
+        cheapest_state = get_cheapest_state(list(active_states), costs, rng)
         active_states.remove(cheapest_state)
         for state in active_states:
             for arc in transducer.get_arcs_by_origin_and_terminal_state(cheapest_state, state):
                 costs[state] = max(costs[state], costs[cheapest_state] + arc.cost_vector)
     try:  # TODO for debug prints
-        most_harmonic_final = get_cheapest_state(transducer.get_final_states(), costs)
+        most_harmonic_final = get_cheapest_state(transducer.get_final_states(), costs, rng)
     except KeyError as ex:
         raise ex
     transducer.set_final_state(most_harmonic_final)
@@ -71,32 +72,46 @@ def _get_path_cost(transducer):
     return path_cost
 
 
-def make_optimal_paths(transducer_input, feature_table):
+def _get_machine_from_state(intersected_machine, initial_state, final_states):
+    """a copy of intersected_machine from initial_state to final_states, with its dead states cleared"""
+    machine = Transducer(intersected_machine.get_alphabet(),
+                         length_of_cost_vectors=intersected_machine.get_length_of_cost_vectors())
+    machine.states = intersected_machine.get_states()[:]
+    machine.set_arcs(intersected_machine.get_arcs())
+    machine.initial_state = initial_state
+    machine.set_final_states(final_states[:])
+    machine.clear_dead_states()
+    return machine
+
+
+def make_optimal_paths(transducer_input, feature_table, cache_manager: CacheManager, rng: random.Random):
+    """ties between equally harmonic paths are broken by rng"""
     transducer = pickle.loads(pickle.dumps(transducer_input, -1))
     alphabet = transducer.get_alphabet()
     new_arcs = list()
     for segment in alphabet:
         word = Word(segment.get_symbol(), feature_table)
-        word_transducer = word.get_transducer()
+        word_transducer = word.get_transducer(cache_manager)
 
         intersected_machine = Transducer.intersection(word_transducer, transducer)
         states = transducer.get_states()
-        for state1, state2 in itertools.product(states, states):
-            initial_state = word_transducer.initial_state & state1
-            final_state = word_transducer.get_a_final_state() & state2
-            temp_transducer = pickle.loads(pickle.dumps(intersected_machine, -1))
-            temp_transducer.initial_state = initial_state
-            temp_transducer.set_final_state(final_state)
-            temp_transducer.clear_dead_states()
-            if final_state in temp_transducer.get_final_states():  # otherwise no path.
-                try:
-                    temp_transducer = remove_suboptimal_paths(temp_transducer)
-                    # write_to_dot(temp_transducer, "temp_transducer")
-                    range = temp_transducer.get_range()
-                    arc = Arc(state1, segment, range, _get_path_cost(temp_transducer), state2)
-                    new_arcs.append(arc)
-                except KeyError:
-                    pass
+        final_states = [word_transducer.get_a_final_state() & state2 for state2 in states]
+        for state1 in states:
+            # the paths from state1 to any of the final states: the dead states are cleared once for all of them
+            machine_from_state1 = _get_machine_from_state(intersected_machine, word_transducer.initial_state & state1,
+                                                          final_states)
+            for state2, final_state in zip(states, final_states):
+                if final_state in machine_from_state1.get_final_states():  # otherwise no path.
+                    temp_transducer = copy.copy(machine_from_state1)  # shares the states and arcs, which are kept
+                    temp_transducer.set_final_state(final_state)
+                    try:
+                        temp_transducer = remove_suboptimal_paths(temp_transducer, rng)
+                        # write_to_dot(temp_transducer, "temp_transducer")
+                        range = temp_transducer.get_range()
+                        arc = Arc(state1, segment, range, _get_path_cost(temp_transducer), state2)
+                        new_arcs.append(arc)
+                    except KeyError:
+                        pass
 
     transducer.set_arcs(new_arcs)
     return transducer
@@ -0,0 +1,10 @@
+import pytest
+
+from src.models.cache_manager import clear_cache_managers
+
+
+@pytest.fixture(autouse=True)
+def _clear_cache_managers():
+    """every test starts with empty caches, as in a new process - its cache hits and evictions don't depend on the
+    tests before it"""
+    clear_cache_managers()
@@ -0,0 +1,80 @@
+import random
+
+from src.init_simulation import init_simulated_annealing
+from src.models.cache_manager import LRUCache, clear_cache_managers, interned_constraint_keys
+from src.utils.fingerprint_tools import get_string_fingerprint
+
+
+def _make_cache(budget: int, keys: str, get_entry_size=None) -> LRUCache:
+    cache = LRUCache("test", budget, get_entry_size)
+    for key in keys:
+        cache[key] = key * 2
+    return cache
+
+
+def test_eviction_order():
+    """over its budget, the cache evicts its least recently used entries - set or got"""
+    cache = _make_cache(3, "abc")
+    assert cache.get("a") == "aa"
+    cache["d"] = "dd"
+    assert [key for key, _ in cache.items()] == ["c", "a", "d"]
+    cache["c"] = "cc"  # set again - the most recently used
+    cache["e"] = "ee"
+    assert [key for key, _ in cache.items()] == ["d", "c", "e"]
+    assert cache.get("a") is None
+    assert cache.number_of_evictions == 2
+
+
+def test_eviction_by_entry_sizes():
+    """the budget is of the sizes of the entries - as many entries are evicted as it takes to get under it"""
+    cache = _make_cache(6, "abc", len)
+    assert cache.size == 6
+    cache["d"] = "dddd"
+    assert [key for key, _ in cache.items()] == ["c", "d"]
+    assert cache.size == 6
+    cache["c"] = "c"
+    assert cache.size == 5
+    assert cache.number_of_evictions == 2
+
+
+def test_pinned_entries_survive_eviction():
+    """pinned entries are not evicted - the least recently used of the others are - until they are unpinned"""
+    cache = _make_cache(3, "abc")
+    cache.pin("owner", {"a", "b"})
+    cache.pin("other owner", {"c"})
+    cache["d"] = "dd"  # the only entry that isn't pinned
+    assert {key for key, _ in cache.items()} == {"a", "b", "c"}
+
+    cache.pin("owner", {"a"})  # replaces the keys pinned by the owner
+    cache["e"] = "ee"
+    assert {key for key, _ in cache.items()} == {"a", "c", "e"}
+    assert cache.number_of_evictions == 2
+
+    cache.unpin("other owner")
+    cache["f"] = "ff"
+    assert {key for key, _ in cache.items()} == {"a", "e", "f"}
+
+    cache.pin("owner", {"a", "e", "f", "g"})
+    cache["g"] = "gg"
+    assert {key for key, _ in cache.items()} == {"a", "e", "f", "g"}  # over the budget, as everything is pinned
+    assert cache.size == 4
+
+
+def test_interned_constraint_keys(monkeypatch):
+    """the interned constraint keys are kept within their budget - an evicted key is made again, equal - and cleared
+    with the cache managers"""
+    monkeypatch.setattr(interned_constraint_keys, "budget", 5)
+    hypothesis = init_simulated_annealing("abnese").current_hypothesis
+    rng = random.Random(0)
+    constraint_keys = set()
+    for _ in range(300):
+        hypothesis.mutate(rng)
+        hypothesis.commit_mutation()
+        for constraint in hypothesis.grammar.constraint_set.constraints:
+            constraint_keys.add(constraint.get_key())
+            assert constraint.get_key_fingerprint() == get_string_fingerprint(repr(constraint.get_key()))
+        assert len(interned_constraint_keys) <= 5
+    assert len(constraint_keys) > 5
+
+    clear_cache_managers()
+    assert not len(interned_constraint_keys)
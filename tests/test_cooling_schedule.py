@@ -0,0 +1,63 @@
+import os
+from math import exp
+
+import pytest
+
+from src.cooling_schedule import AdaptiveCoolingSchedule, get_cooling_schedule
+from src.init_simulation import SIMULATIONS_DIR
+from src.models.otml_configuration import AdaptiveCooling, OtmlConfiguration, settings
+
+
+def _get_adaptive_cooling_schedule() -> AdaptiveCoolingSchedule:
+    """a factor between 0.9 ** 4 and 0.9 ** (1 / 4), tuned every 4 steps when 1 to 3 of them switch"""
+    return AdaptiveCoolingSchedule(0.9, window=4, min_acceptance_ratio=0.25, max_acceptance_ratio=0.75, speedup=4,
+                                   variance_factor=0.5)
+
+
+def _record_window(cooling_schedule: AdaptiveCoolingSchedule, temperature: float, energies: list[int],
+                   switches: list[bool]):
+    for energy, switched in zip(energies, switches):
+        cooling_schedule.record_step(temperature, energy, switched)
+
+
+def test_adaptive_cooling_factor():
+    """the factor is exp(-variance_factor * T / sigma) of the last window - kept as is until the window is full"""
+    cooling_schedule = _get_adaptive_cooling_schedule()
+    _record_window(cooling_schedule, 1, [100, 110, 90], [True, False, False])
+    assert cooling_schedule.cooling_factor == 0.9
+    assert cooling_schedule.get_next_temperature(10) == pytest.approx(9)
+
+    cooling_schedule.record_step(1, 100, False)  # energy deviation 50 ** 0.5
+    assert cooling_schedule.cooling_factor == pytest.approx(exp(-0.5 / 50 ** 0.5))
+    assert cooling_schedule.get_next_temperature(10) == pytest.approx(10 * exp(-0.5 / 50 ** 0.5))
+
+    # the next window is counted from scratch
+    _record_window(cooling_schedule, 2, [100, 120, 80], [True, True, False])
+    assert cooling_schedule.cooling_factor == pytest.approx(exp(-0.5 / 50 ** 0.5))
+    cooling_schedule.record_step(2, 100, False)  # energy deviation 200 ** 0.5
+    assert cooling_schedule.cooling_factor == pytest.approx(exp(-0.5 * 2 / 200 ** 0.5))
+
+
+@pytest.mark.parametrize("temperature, energies, switches, cooling_factor", [
+    (10, [100, 110, 90, 100], [False] * 4, 0.9 ** 4),  # nothing is accepted
+    (10, [100, 110, 90, 100], [True] * 4, 0.9 ** 4),  # everything is accepted
+    (10, [100, 100, 100, 100], [True, False, False, False], 0.9 ** 4),  # the energy doesn't change
+    (100, [100, 110, 90, 100], [True, False, False, False], 0.9 ** 4),  # too fast - cooled at the fastest
+    (0.01, [100, 110, 90, 100], [True, False, False, False], 0.9 ** (1 / 4)),  # too slow - cooled at the slowest
+])
+def test_adaptive_cooling_factor_bounds(temperature: float, energies: list[int], switches: list[bool],
+                                        cooling_factor: float):
+    """the factor is the fastest where the temperature makes no difference, and within the bounds otherwise"""
+    cooling_schedule = _get_adaptive_cooling_schedule()
+    _record_window(cooling_schedule, temperature, energies, switches)
+    assert cooling_schedule.cooling_factor == pytest.approx(cooling_factor)
+
+
+def test_adaptive_cooling_schedule_from_config():
+    OtmlConfiguration.load(os.path.join(SIMULATIONS_DIR, "aa_bb_demote_only"))
+    config = settings.update(cooling_schedule="adaptive", cooling_factor=0.99,
+                             adaptive_cooling=AdaptiveCooling(window=50, speedup=2)).freeze()
+    cooling_schedule = get_cooling_schedule(config)
+    assert isinstance(cooling_schedule, AdaptiveCoolingSchedule)
+    assert (cooling_schedule.base_cooling_factor, cooling_schedule.window, cooling_schedule.speedup) == (0.99, 50, 2)
+    assert cooling_schedule.min_acceptance_ratio == config.adaptive_cooling.min_acceptance_ratio
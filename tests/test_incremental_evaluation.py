@@ -0,0 +1,254 @@
+import pickle
+import random
+import sys
+from collections import Counter
+
+import pytest
+
+from src.grammar.constraint_set import ConstraintSet
+from src.grammar.grammar import Grammar
+from src.grammar.lexicon import Lexicon
+from src.init_simulation import init_simulated_annealing
+from src.models.otml_configuration import settings
+from src.models.traversable_grammar_hypothesis import TraversableGrammarHypothesis
+
+
+def _get_hypothesis_from_scratch(hypothesis: TraversableGrammarHypothesis) -> TraversableGrammarHypothesis:
+    """a new hypothesis of the grammar of the hypothesis - which evaluates it without any incremental parse"""
+    grammar_copy = pickle.loads(pickle.dumps(hypothesis.grammar, -1))
+    return TraversableGrammarHypothesis(grammar_copy, hypothesis.data)
+
+
+def _get_energy_from_scratch(hypothesis: TraversableGrammarHypothesis) -> int:
+    return _get_hypothesis_from_scratch(hypothesis).update_energy()
+
+
+def _get_data_length_from_scratch(hypothesis: TraversableGrammarHypothesis) -> int:
+    return _get_hypothesis_from_scratch(hypothesis).get_data_length_given_grammar()
+
+
+def _get_parse_from_scratch(hypothesis: TraversableGrammarHypothesis) -> dict[str, set[tuple[str, int]]]:
+    return {word: {(str(input_word), number_of_outputs) for input_word, number_of_outputs in parses}
+            for word, parses in hypothesis.parse_data().items()}
+
+
+def _get_grammar_from_scratch_state(hypothesis: TraversableGrammarHypothesis) -> tuple:
+    """the state of `_get_grammar_state` of a new constraint set and a new lexicon, printed the same"""
+    grammar = hypothesis.grammar
+    constraint_set = ConstraintSet.load_from_printed_string_representation(
+        str(grammar.constraint_set).removeprefix("Constraint Set: "), grammar.feature_table)
+    lexicon = Lexicon([str(word) for word in grammar.lexicon.get_words()], grammar.feature_table)
+    return _get_constraint_set_state(constraint_set) + _get_lexicon_state(lexicon, grammar.config)
+
+
+def _get_grammar_state(hypothesis: TraversableGrammarHypothesis) -> tuple:
+    """the grammar, and everything kept up to date by its mutations"""
+    grammar = hypothesis.grammar
+    return _get_constraint_set_state(grammar.constraint_set) + _get_lexicon_state(grammar.lexicon, grammar.config)
+
+
+def _get_constraint_set_state(constraint_set: ConstraintSet) -> tuple:
+    return (str(constraint_set), constraint_set.get_key(), constraint_set.get_fingerprint(),
+            constraint_set.get_encoding_length())
+
+
+def _get_lexicon_state(lexicon: Lexicon, config) -> tuple:
+    return ([str(word) for word in lexicon.get_words()], len(set(map(id, lexicon.get_words()))),  # distinct objects
+            lexicon.get_fingerprint(), lexicon.get_encoding_length(config),
+            dict(lexicon._word_counts), dict(lexicon._segment_counts), lexicon._number_of_segments,
+            lexicon._segments_encoding_length)
+
+
+def _make_random_steps(hypothesis: TraversableGrammarHypothesis, rng: random.Random, number_of_steps: int):
+    """mutate the hypothesis in place and commit or roll back every mutation at random, as the annealing does"""
+    for _ in range(number_of_steps):
+        if not hypothesis.mutate(rng):
+            hypothesis.rollback_mutation()
+            continue
+        energy = hypothesis.update_energy()
+        assert energy == _get_energy_from_scratch(hypothesis), str(hypothesis.grammar)
+        if rng.random() < 0.5:
+            hypothesis.commit_mutation()
+        else:
+            hypothesis.rollback_mutation()
+
+
+@pytest.mark.parametrize("simulation_name", ["aa_bb_demote_only", "french_deletion"])
+def test_energy_cache_hits(simulation_name: str):
+    """
+    Every evaluation - from the incremental parse or from the energy cache - must give the energy of a new hypothesis
+    of the same grammar, also after a lexicon mutation evaluated from the energy cache was committed.
+    """
+    hypothesis = init_simulated_annealing(simulation_name).current_hypothesis
+    rng = random.Random(0)
+    hypothesis.update_energy()
+
+    # a rejected lexicon mutation, which is made again and evaluated from the energy cache
+    lexicon_fingerprint = hypothesis.grammar.lexicon.get_fingerprint()
+    mutation_rng_state = rng.getstate()
+    while not (hypothesis.mutate(rng) and hypothesis.grammar.lexicon.get_fingerprint() != lexicon_fingerprint):
+        hypothesis.rollback_mutation()
+        mutation_rng_state = rng.getstate()
+    hypothesis.update_energy()
+    hypothesis.rollback_mutation()
+    mutation_rng = random.Random()
+    mutation_rng.setstate(mutation_rng_state)
+    hypothesis.mutate(mutation_rng)
+    assert hypothesis.grammar.get_fingerprint() in hypothesis._energy_cache
+    assert hypothesis.update_energy() == _get_energy_from_scratch(hypothesis)
+    hypothesis.commit_mutation()
+
+    # a rejected mutation evaluated without the energy cache
+    while not hypothesis.mutate(rng) or hypothesis.grammar.get_fingerprint() in hypothesis._energy_cache:
+        hypothesis.rollback_mutation()
+    hypothesis.update_energy()
+    hypothesis.rollback_mutation()
+    assert hypothesis.get_data_length_given_grammar() == _get_data_length_from_scratch(hypothesis)
+    assert hypothesis.data_parse == _get_parse_from_scratch(hypothesis)
+
+    _make_random_steps(hypothesis, rng, 100)
+
+
+@pytest.mark.parametrize("simulation_name", ["aa_bb_demote_only", "abnese", "french_deletion"])
+def test_random_steps(simulation_name: str):
+    """the incremental parse and energies, and the grammar kept up to date by mutations, equal those from scratch"""
+    hypothesis = init_simulated_annealing(simulation_name).current_hypothesis
+    rng = random.Random(0)
+    hypothesis.update_energy()
+
+    _make_random_steps(hypothesis, rng, 100)
+    assert _get_grammar_state(hypothesis) == _get_grammar_from_scratch_state(hypothesis)
+    hypothesis.get_data_length_given_grammar()
+    assert hypothesis.data_parse == _get_parse_from_scratch(hypothesis)
+
+
+@pytest.mark.parametrize("simulation_name", ["aa_bb_demote_only", "abnese", "french_deletion"])
+def test_rollback(simulation_name: str):
+    """rolling back a mutation, and the evaluation that followed it, restores the hypothesis exactly"""
+    hypothesis = init_simulated_annealing(simulation_name).current_hypothesis
+    rng = random.Random(0)
+    hypothesis.update_energy()
+
+    for _ in range(100):
+        grammar_state = _get_grammar_state(hypothesis)
+        energies = (hypothesis.grammar_energy, hypothesis.data_energy, hypothesis.combined_energy)
+        if hypothesis.mutate(rng):
+            hypothesis.update_energy()
+        hypothesis.rollback_mutation()
+        assert _get_grammar_state(hypothesis) == grammar_state
+        assert (hypothesis.grammar_energy, hypothesis.data_energy, hypothesis.combined_energy) == energies
+
+        if hypothesis.mutate(rng):  # move on to another grammar
+            hypothesis.update_energy()
+        hypothesis.commit_mutation()
+    assert _get_grammar_state(hypothesis) == _get_grammar_from_scratch_state(hypothesis)
+
+
+@pytest.mark.parametrize("simulation_name", ["aa_bb_demote_only", "french_deletion"])
+def test_set_evaluation(simulation_name: str):
+    """a neighbor that takes the evaluation of its copy, as from another process, is evaluated exactly"""
+    hypothesis = init_simulated_annealing(simulation_name).current_hypothesis
+    rng = random.Random(0)
+    hypothesis.update_energy()
+
+    for _ in range(20):
+        mutation_result, neighbor = hypothesis.get_neighbor(rng)
+        if not mutation_result or neighbor.is_energy_cached():
+            continue
+        neighbor_copy = pickle.loads(pickle.dumps(neighbor.get_detached_copy(), -1))
+        energy = neighbor_copy.update_energy()
+        neighbor.set_evaluation(neighbor_copy.get_evaluation())
+        assert neighbor.combined_energy == energy == _get_energy_from_scratch(neighbor)
+        assert neighbor.is_energy_cached()
+        hypothesis = neighbor
+
+    _make_random_steps(hypothesis, rng, 50)
+    hypothesis.get_data_length_given_grammar()
+    assert hypothesis.data_parse == _get_parse_from_scratch(hypothesis)
+
+
+@pytest.mark.parametrize("simulation_name", ["aa_bb_demote_only", "abnese", "french_deletion"])
+def test_cut_short_evaluation(simulation_name: str):
+    """a data length cut short by max_data_length is INF only when the data length exceeds it"""
+    hypothesis = init_simulated_annealing(simulation_name).current_hypothesis
+    rng = random.Random(0)
+    hypothesis.get_data_length_given_grammar()
+
+    number_of_cut_short_evaluations = 0
+    for _ in range(100):
+        if not hypothesis.mutate(rng):
+            hypothesis.rollback_mutation()
+            continue
+        data_length_from_scratch = _get_data_length_from_scratch(hypothesis)
+        max_data_length = rng.uniform(0.8, 1.2) * min(data_length_from_scratch, 10_000)
+        data_length = hypothesis.get_data_length_given_grammar(max_data_length)
+        if data_length == sys.maxsize:
+            assert data_length_from_scratch > max_data_length
+            number_of_cut_short_evaluations += 1
+        else:
+            assert data_length == data_length_from_scratch
+        if rng.random() < 0.5:
+            hypothesis.commit_mutation()
+        else:
+            hypothesis.rollback_mutation()
+    assert number_of_cut_short_evaluations
+
+    hypothesis.get_data_length_given_grammar()
+    assert hypothesis.data_parse == _get_parse_from_scratch(hypothesis)
+
+
+@pytest.mark.parametrize("simulation_name", ["aa_bb_demote_only", "abnese"])
+def test_cut_short_parse(simulation_name: str, monkeypatch):
+    """a neighbor over max_data_length after a constraint set mutation is cut short in the middle of its parse"""
+    simulated_annealing = init_simulated_annealing(simulation_name)
+    simulated_annealing.config = settings.update(steps_limitation=500).freeze()
+    simulated_annealing.run()
+    hypothesis = simulated_annealing.current_hypothesis
+    max_data_length = hypothesis.get_data_length_given_grammar()
+    rng = random.Random(0)
+    parsed_inputs = list()
+    get_output_automaton = Grammar.get_output_automaton
+    monkeypatch.setattr(Grammar, "get_output_automaton",
+                        lambda grammar, word: parsed_inputs.append(word) or get_output_automaton(grammar, word))
+
+    number_of_cut_short_parses = 0
+    for _ in range(50):
+        constraint_set_key = hypothesis.grammar.constraint_set.get_key()
+        if not hypothesis.mutate(rng) or hypothesis.grammar.constraint_set.get_key() == constraint_set_key:
+            hypothesis.rollback_mutation()
+            continue
+        data_length_from_scratch = _get_data_length_from_scratch(hypothesis)
+        parsed_inputs.clear()
+        data_length = hypothesis.get_data_length_given_grammar(max_data_length)
+        if data_length_from_scratch > max_data_length:
+            assert data_length == sys.maxsize
+            if len(parsed_inputs) < hypothesis.grammar.lexicon.get_number_of_distinct_words():
+                number_of_cut_short_parses += 1
+        else:
+            assert data_length == data_length_from_scratch
+        hypothesis.rollback_mutation()
+    assert number_of_cut_short_parses
+
+    hypothesis.get_data_length_given_grammar()
+    assert hypothesis.data_parse == _get_parse_from_scratch(hypothesis)
+
+
+@pytest.mark.parametrize("simulation_name", ["aa_bb_demote_only", "abnese"])
+def test_weighted_data_length(simulation_name: str):
+    """the data length of the multiplicities of the data words is that of the words repeated as many times - for the
+    grammars of an annealing"""
+    simulated_annealing = init_simulated_annealing(simulation_name)
+    simulated_annealing.before_loop()
+    rng = random.Random(0)
+    word_counts = Counter({word: rng.randint(1, 5) for word in simulated_annealing.current_hypothesis.data})
+    duplicated_words = list(word_counts.elements())
+    rng.shuffle(duplicated_words)
+    for _ in range(5):
+        grammar = simulated_annealing.current_hypothesis.grammar
+        weighted_hypothesis = TraversableGrammarHypothesis(pickle.loads(pickle.dumps(grammar, -1)), word_counts)
+        duplicated_hypothesis = TraversableGrammarHypothesis(pickle.loads(pickle.dumps(grammar, -1)),
+                                                             duplicated_words)
+        assert weighted_hypothesis.update_energy() == duplicated_hypothesis.update_energy()
+        assert weighted_hypothesis.data_energy == duplicated_hypothesis.data_energy < sys.maxsize
+        for _ in range(50):
+            simulated_annealing.make_step()
@@ -0,0 +1,176 @@
+import multiprocessing
+import pickle
+import random
+import time
+
+import pytest
+
+from src.exceptions import OtmlConfigurationError
+from src.init_simulation import init_simulated_annealing, run_simulated_annealing_restarts
+from src.models.otml_configuration import settings
+from src.models.traversable_grammar_hypothesis import TraversableGrammarHypothesis
+from src.simulated_annealing import SimulatedAnnealing, _swap_replicas
+
+
+def _get_simulated_annealing(simulation_name: str, **config_updates) -> SimulatedAnnealing:
+    """the simulated annealing of the simulation, with its run configuration updated"""
+    simulated_annealing = init_simulated_annealing(simulation_name)
+    simulated_annealing.config = settings.update(**config_updates).freeze()
+    return simulated_annealing
+
+
+def _get_run_state(simulated_annealing: SimulatedAnnealing) -> tuple:
+    grammar = simulated_annealing.current_hypothesis.grammar
+    return (simulated_annealing.step, simulated_annealing.current_temperature,
+            simulated_annealing.current_hypothesis_energy, simulated_annealing.lowest_energy,
+            simulated_annealing.lowest_energy_step, str(grammar.constraint_set),
+            [str(word) for word in grammar.lexicon.get_words()], simulated_annealing.rng.getstate())
+
+
+def test_resume(tmp_path):
+    """a run resumed from its last checkpoint - whose caches are not saved - ends as the run itself"""
+    checkpoint_file = str(tmp_path / "checkpoint.pkl")
+    simulated_annealing = _get_simulated_annealing("aa_bb_demote_only", steps_limitation=700,
+                                                   checkpoint_interval=300, checkpoint_file=checkpoint_file)
+    simulated_annealing.run()
+
+    resumed_simulated_annealing = SimulatedAnnealing.load_checkpoint(checkpoint_file)
+    assert resumed_simulated_annealing.step == 600  # saved after the last step of the interval
+    resumed_simulated_annealing.run(resume=True)
+    assert _get_run_state(resumed_simulated_annealing) == _get_run_state(simulated_annealing)
+
+
+def test_restarts():
+    """the restarts return the best of the runs of their seeds"""
+    simulated_annealing = _get_simulated_annealing("aa_bb_demote_only", steps_limitation=200)
+    step, hypothesis = run_simulated_annealing_restarts(simulated_annealing, [3, 4], number_of_processes=2)
+
+    standalone_simulated_annealings = list()
+    for seed in [3, 4]:
+        standalone_simulated_annealing = _get_simulated_annealing("aa_bb_demote_only", steps_limitation=200)
+        standalone_simulated_annealing.seed = seed
+        standalone_simulated_annealing.run()
+        standalone_simulated_annealings.append(standalone_simulated_annealing)
+    assert (standalone_simulated_annealings[0].current_hypothesis_energy !=
+            standalone_simulated_annealings[1].current_hypothesis_energy)
+    best_simulated_annealing = min(standalone_simulated_annealings,
+                                   key=lambda item: item.current_hypothesis_energy)
+    assert step == best_simulated_annealing.step
+    assert hypothesis.combined_energy == best_simulated_annealing.current_hypothesis_energy
+    assert str(hypothesis.grammar) == str(best_simulated_annealing.current_hypothesis.grammar)
+
+
+def test_restarts_without_speculative_steps():
+    """restarts run in pool processes, which can't have pools of their own"""
+    simulated_annealing = _get_simulated_annealing("aa_bb_demote_only", speculative_batch_size=2)
+    with pytest.raises(OtmlConfigurationError):
+        run_simulated_annealing_restarts(simulated_annealing, [3, 4])
+
+
+def test_speculative_steps_parse():
+    """a hypothesis switched to in a batch has the parse of its grammar - even if its energy was cached"""
+    simulated_annealing = _get_simulated_annealing("abnese")
+    simulated_annealing.before_loop()
+    number_of_switches = 0
+    with multiprocessing.Pool(2) as pool:
+        for _ in range(100):
+            hypothesis = simulated_annealing.current_hypothesis
+            simulated_annealing.make_speculative_steps(pool, 4)
+            if simulated_annealing.current_hypothesis is hypothesis:
+                continue
+            number_of_switches += 1
+            hypothesis = simulated_annealing.current_hypothesis
+            hypothesis_from_scratch = TraversableGrammarHypothesis(pickle.loads(pickle.dumps(hypothesis.grammar, -1)),
+                                                                   hypothesis.data)
+            hypothesis_from_scratch.get_data_length_given_grammar()
+            assert hypothesis.data_parse == hypothesis_from_scratch.data_parse
+    assert number_of_switches
+
+
+class _FixedDraws(random.Random):
+    """a generator whose uniform draws are all the given one"""
+
+    def __init__(self, draw: float):
+        super().__init__()
+        self.draw = draw
+
+    def random(self) -> float:
+        return self.draw
+
+
+def test_swap_replicas():
+    """adjacent replicas swap - even pairs in even rounds, odd pairs in odd rounds - when the colder one has more
+    energy, and otherwise with the Metropolis probability"""
+    temperatures = [1, 2, 4, 8]
+    replica_by_temperature = [0, 1, 2, 3]
+    energies = [40, 30, 20, 10]  # by replica
+    assert _swap_replicas(temperatures, replica_by_temperature, energies, 0, _FixedDraws(0.99)) == 2
+    assert replica_by_temperature == [1, 0, 3, 2]
+    assert _swap_replicas(temperatures, replica_by_temperature, energies, 1, _FixedDraws(0.99)) == 1
+    assert replica_by_temperature == [1, 3, 0, 2]
+    assert _swap_replicas(temperatures, replica_by_temperature, energies, 0, _FixedDraws(0.99)) == 2
+    assert replica_by_temperature == [3, 1, 2, 0]  # the lower the energy, the colder
+
+    # (1 / 1 - 1 / 2) * (10 - 12) = -1: a swap with probability exp(-1) = 0.37
+    replica_by_temperature = [0, 1]
+    assert _swap_replicas([1, 2], replica_by_temperature, [10, 12], 0, _FixedDraws(0.4)) == 0
+    assert replica_by_temperature == [0, 1]
+    assert _swap_replicas([1, 2], replica_by_temperature, [10, 12], 0, _FixedDraws(0.3)) == 1
+    assert replica_by_temperature == [1, 0]
+
+
+def test_replica_exchange():
+    """the replicas take all the steps, and the run returns the lowest energy final hypothesis"""
+    simulated_annealing = _get_simulated_annealing("aa_bb_demote_only", steps_limitation=200,
+                                                   replica_exchange_number_of_replicas=3,
+                                                   replica_exchange_swap_interval=50)
+    step, hypothesis = simulated_annealing.run_replica_exchange()
+    assert step == 200
+    hypothesis_from_scratch = TraversableGrammarHypothesis(pickle.loads(pickle.dumps(hypothesis.grammar, -1)),
+                                                           hypothesis.data)
+    assert hypothesis_from_scratch.update_energy() == simulated_annealing.current_hypothesis_energy
+    assert simulated_annealing.lowest_energy <= simulated_annealing.current_hypothesis_energy
+
+
+@pytest.mark.parametrize("rule", ["target_energy", "plateau_steps", "plateau_seconds", "time_budget_seconds"])
+def test_stopping_rule(rule: str):
+    """each stopping rule stops the run when its limit is reached, and not before"""
+    simulated_annealing = _get_simulated_annealing("aa_bb_demote_only", plateau_steps=100, plateau_seconds=60,
+                                                   time_budget_seconds=600)
+    simulated_annealing.before_loop()
+    simulated_annealing.current_hypothesis_energy = simulated_annealing.lowest_energy = 1000
+    now = time.time()
+    simulated_annealing.step, simulated_annealing.lowest_energy_step = 150, 51
+    simulated_annealing.start_time, simulated_annealing.lowest_energy_time = now - 500, now - 50
+    simulated_annealing.target_energy = 999
+    assert not simulated_annealing._is_stopping()
+
+    if rule == "target_energy":
+        simulated_annealing.current_hypothesis_energy = 999
+    elif rule == "plateau_steps":
+        simulated_annealing.step = 151
+    elif rule == "plateau_seconds":
+        simulated_annealing.lowest_energy_time = now - 60
+    else:
+        simulated_annealing.start_time = now - 600
+    assert simulated_annealing._is_stopping()
+
+
+def test_plateau_steps():
+    """a run without a new lowest energy for plateau_steps steps stops"""
+    simulated_annealing = _get_simulated_annealing("aa_bb_demote_only", plateau_steps=50)
+    step, _ = simulated_annealing.run()
+    assert step == simulated_annealing.lowest_energy_step + 50 < simulated_annealing.number_of_expected_steps
+
+
+def test_target_energy():
+    """a run stops once it reaches its target energy"""
+    simulated_annealing = _get_simulated_annealing("aa_bb_demote_only", steps_limitation=300)
+    simulated_annealing.run()
+    target_energy = simulated_annealing.lowest_energy
+
+    simulated_annealing = _get_simulated_annealing("aa_bb_demote_only", steps_limitation=300)
+    simulated_annealing.target_energy = target_energy
+    step, _ = simulated_annealing.run()
+    assert simulated_annealing.current_hypothesis_energy <= target_energy
+    assert step == simulated_annealing.lowest_energy_step < 300
@@ -0,0 +1,322 @@
+import functools
+import itertools
+import os
+import pickle
+import random
+import sqlite3
+
+import pytest
+
+from src.grammar.features.feature_table import NULL_SEGMENT, JOKER_SEGMENT
+from src.grammar.grammar import Grammar
+from src.init_simulation import init_simulated_annealing
+from src.models.compact_transducer import CompactTransducer
+from src.models.generation_store import GenerationStore
+from src.models.otml_configuration import settings
+from src.models.output_automaton import OutputAutomaton, make_strings_trie
+from src.models.transducer import Transducer, Arc
+from src.models.transducer_disk_cache import TransducerDiskCache
+from src.utils.transducers_optimization_tools import optimize_transducer_grammar_for_word
+
+SIMULATION_NAMES = ["aa_bb_demote_only", "abnese", "french_deletion"]
+
+
+def _get_pairwise_intersection(*transducers) -> Transducer:
+    """the intersection as it was made before `Transducer.intersection` - the full product of every pair, from the
+    left, with its dead states cleared once"""
+    def intersect(transducer1, transducer2):
+        alphabet = list(set(transducer1.alphabet) | set(transducer2.alphabet))
+        transducer = Transducer(alphabet, length_of_cost_vectors=(transducer1.length_of_cost_vectors +
+                                                                  transducer2.length_of_cost_vectors))
+        transducer.initial_state = transducer1.initial_state & transducer2.initial_state
+        for state1, state2 in itertools.product(transducer1.states, transducer2.states):
+            transducer.states.append(state1 & state2)
+        for state1, state2 in itertools.product(transducer1.final_states, transducer2.final_states):
+            transducer.final_states.append(state1 & state2)
+        for arc1, arc2 in itertools.product(transducer1.get_arcs(), transducer2.get_arcs()):
+            intersected_arc = Arc.intersect(arc1, arc2)
+            if intersected_arc is not None:
+                transducer.add_arc(intersected_arc)
+        return transducer
+
+    intersected_transducer = functools.reduce(intersect, transducers)
+    _clear_dead_states_by_fixpoint(intersected_transducer)
+    return intersected_transducer
+
+
+def _clear_dead_states_by_fixpoint(transducer: Transducer, with_impasse_states: bool = False):
+    """`Transducer.clear_dead_states` as it was - passes over all the arcs until no state changes"""
+    def clear_states(dead_states):
+        for state in dead_states:
+            transducer.arcs_by_state_dict.pop(state, None)
+        for arcs_by_terminal_state in transducer.arcs_by_state_dict.values():
+            for state in dead_states:
+                arcs_by_terminal_state.pop(state, None)
+        transducer.get_arcs()[:] = [arc for arc in transducer.get_arcs()
+                                    if arc.origin_state not in dead_states and arc.terminal_state not in dead_states]
+        transducer.states[:] = [state for state in transducer.states if state not in dead_states]
+        transducer.final_states[:] = [state for state in transducer.final_states if state not in dead_states]
+
+    reachable_states = {transducer.initial_state}
+    while True:
+        new_states = {arc.terminal_state for arc in transducer.get_arcs()
+                      if arc.origin_state in reachable_states} - reachable_states
+        if not new_states:
+            break
+        reachable_states |= new_states
+    clear_states(set(transducer.states) - reachable_states)
+
+    if with_impasse_states:
+        coreachable_states = set(transducer.final_states)
+        while True:
+            new_states = {arc.origin_state for arc in transducer.get_arcs()
+                          if arc.terminal_state in coreachable_states} - coreachable_states
+            if not new_states:
+                break
+            coreachable_states |= new_states
+        clear_states(set(transducer.states) - coreachable_states)
+
+
+def _get_range_by_passes(transducer: Transducer) -> set[str]:
+    """`Transducer.get_range` as it was - passes from the initial state over the arcs of the states last reached"""
+    strings_by_state = {state: set() for state in transducer.states}
+    strings_by_state[transducer.initial_state].add("")
+    active_states = {transducer.initial_state}
+    while active_states:
+        next_states = set()
+        for state in active_states:
+            for arc in transducer.get_arcs_by_origin_state(state):
+                next_states.add(arc.terminal_state)
+                for string in list(strings_by_state[state]):
+                    if isinstance(arc.output, set):
+                        strings_by_state[arc.terminal_state].update(string + output for output in arc.output)
+                    elif arc.output == NULL_SEGMENT:
+                        strings_by_state[arc.terminal_state].add(string)
+                    elif arc.output == JOKER_SEGMENT:
+                        strings_by_state[arc.terminal_state].update(string + segment.get_symbol()
+                                                                    for segment in transducer.alphabet)
+                    else:
+                        strings_by_state[arc.terminal_state].add(string + arc.output.get_symbol())
+        active_states = next_states
+    return set().union(*(strings_by_state[state] for state in transducer.final_states))
+
+
+def _get_transducer_state(transducer: Transducer) -> tuple:
+    """the transducer in its orders - of the states, final states and arcs - and its arcs index"""
+    return (str(transducer.initial_state), [str(state) for state in transducer.states],
+            [str(state) for state in transducer.final_states], [_get_arc_state(arc) for arc in transducer.get_arcs()],
+            {str(origin_state): {str(terminal_state): [_get_arc_state(arc) for arc in arcs]
+                                 for terminal_state, arcs in arcs_by_terminal_state.items()}
+             for origin_state, arcs_by_terminal_state in transducer.arcs_by_state_dict.items()})
+
+
+def _get_arc_state(arc: Arc) -> tuple:
+    """an output set is sorted - its order may change when it is pickled"""
+    output = sorted(arc.output) if isinstance(arc.output, set) else arc.output.get_symbol()
+    return (str(arc.origin_state), arc.input.get_symbol(), output, arc.cost_vector.vector, str(arc.terminal_state))
+
+
+def _get_grammars(simulation_name: str, number_of_grammars: int = 4) -> list[Grammar]:
+    """the initial grammar of the simulation and grammars a few random mutations away from it"""
+    hypothesis = init_simulated_annealing(simulation_name).current_hypothesis
+    rng = random.Random(0)
+    grammars = list()
+    for _ in range(number_of_grammars):
+        grammars.append(pickle.loads(pickle.dumps(hypothesis.grammar, -1)))
+        for _ in range(5):
+            hypothesis.mutate(rng)
+            hypothesis.commit_mutation()
+    return grammars
+
+
+def _get_constraint_transducers(grammar: Grammar) -> list[Transducer]:
+    return [constraint.get_transducer(grammar.cache_manager, grammar.config)
+            for constraint in grammar.constraint_set.constraints]
+
+
+def _get_word_transducers(grammar: Grammar) -> list[tuple]:
+    """(word, the transducer of the word and the grammar before its dead states are cleared) for every lexicon word"""
+    grammar_transducer = grammar.get_transducer()
+    words = {str(word): word for word in grammar.lexicon.get_words()}
+    return [(word, Transducer.intersection(word.get_transducer(grammar.cache_manager), grammar_transducer))
+            for _, word in sorted(words.items())]
+
+
+def _get_optimized_word_transducers(grammar: Grammar) -> list[Transducer]:
+    """the transducers whose ranges are the outputs of the lexicon words, as `Grammar.get_output_automaton` makes"""
+    optimized_transducers = list()
+    for word, intersected_transducer in _get_word_transducers(grammar):
+        intersected_transducer.clear_dead_states()
+        optimized_transducers.append(optimize_transducer_grammar_for_word(word, intersected_transducer))
+    return optimized_transducers
+
+
+@pytest.mark.parametrize("simulation_name", SIMULATION_NAMES)
+def test_intersection(simulation_name: str):
+    """intersecting in a single pass gives the pairwise intersection after `clear_dead_states`, in its orders"""
+    for grammar in _get_grammars(simulation_name):
+        constraint_transducers = _get_constraint_transducers(grammar)
+        for number_of_transducers in range(2, len(constraint_transducers) + 1):
+            transducers = constraint_transducers[:number_of_transducers]
+            transducer = Transducer.intersection(*transducers)
+            pairwise_transducer = _get_pairwise_intersection(*transducers)
+            assert _get_transducer_state(transducer) == _get_transducer_state(pairwise_transducer)
+            assert transducer.length_of_cost_vectors == pairwise_transducer.length_of_cost_vectors
+
+        word = grammar.lexicon.get_words()[0]
+        transducers = [word.get_transducer(grammar.cache_manager)] + constraint_transducers
+        assert (_get_transducer_state(Transducer.intersection(*transducers)) ==
+                _get_transducer_state(_get_pairwise_intersection(*transducers)))
+
+
+@pytest.mark.parametrize("simulation_name", SIMULATION_NAMES)
+def test_compact_transducer(simulation_name: str):
+    """a compact transducer gives back the transducer it was made from, also after pickling"""
+    grammar = _get_grammars(simulation_name, 1)[0]
+    transducers = (_get_constraint_transducers(grammar) + [grammar.get_transducer()] +
+                   [transducer for _, transducer in _get_word_transducers(grammar)[:5]])
+    for transducer in transducers:
+        compact_transducer = CompactTransducer.from_transducer(transducer)
+        assert compact_transducer.get_number_of_arcs() == len(transducer.get_arcs())
+        for round_trip_transducer in [compact_transducer.to_transducer(),
+                                      pickle.loads(pickle.dumps(compact_transducer, -1)).to_transducer()]:
+            assert _get_transducer_state(round_trip_transducer) == _get_transducer_state(transducer)
+            assert round_trip_transducer.length_of_cost_vectors == transducer.length_of_cost_vectors
+
+
+@pytest.mark.parametrize("simulation_name", SIMULATION_NAMES)
+def test_transducer_disk_cache(simulation_name: str, tmp_path):
+    """a transducer saved on disk is loaded as it was made - and made again when its file is corrupt or missing"""
+    grammar = _get_grammars(simulation_name, 1)[0]
+    config = settings.update(transducer_disk_cache=True, transducer_cache_folder=str(tmp_path)).freeze()
+    transducer_disk_cache = TransducerDiskCache()
+    transducer = grammar.get_transducer()
+    made_transducers = list()
+
+    def get_transducer() -> Transducer:
+        return transducer_disk_cache.get_transducer("grammar", grammar.feature_table, grammar.constraint_set.get_key(),
+                                                    lambda: made_transducers.append(transducer) or transducer, config)
+
+    assert get_transducer() is transducer
+    transducer_file = transducer_disk_cache._get_transducer_file("grammar", grammar.feature_table,
+                                                                 grammar.constraint_set.get_key(), config)
+    assert os.path.exists(transducer_file)
+    with open(transducer_file, "rb") as f:
+        transducer_bytes = f.read()
+    for file_bytes in [None, b"", b"not a pickle", transducer_bytes[:len(transducer_bytes) // 2]]:
+        loaded_transducer = get_transducer()
+        assert loaded_transducer is not transducer
+        assert _get_transducer_state(loaded_transducer) == _get_transducer_state(transducer)
+        assert loaded_transducer.length_of_cost_vectors == transducer.length_of_cost_vectors
+        number_of_made_transducers = len(made_transducers)
+        if file_bytes is None:
+            os.remove(transducer_file)
+        else:
+            with open(transducer_file, "wb") as f:
+                f.write(file_bytes)
+        assert get_transducer() is transducer  # made and saved again
+        assert len(made_transducers) == number_of_made_transducers + 1
+
+
+@pytest.mark.parametrize("simulation_name", SIMULATION_NAMES)
+def test_clear_dead_states(simulation_name: str):
+    """clearing dead states in linear time clears the states that passes until no state changes would"""
+    number_of_cleared_states = {False: 0, True: 0}
+    for grammar in _get_grammars(simulation_name, 2):
+        for _, intersected_transducer in _get_word_transducers(grammar):
+            # the transducer, and machines between two of its states - as in `make_optimal_paths`
+            middle_state = intersected_transducer.states[len(intersected_transducer.states) // 2]
+            machines = [intersected_transducer]
+            for initial_state, final_states in [(intersected_transducer.initial_state, [middle_state]),
+                                                (middle_state, intersected_transducer.final_states)]:
+                machine = pickle.loads(pickle.dumps(intersected_transducer, -1))
+                machine.initial_state = machine.states[intersected_transducer.states.index(initial_state)]
+                machine.final_states = [machine.states[intersected_transducer.states.index(state)]
+                                        for state in final_states]
+                machines.append(machine)
+
+            for machine, with_impasse_states in itertools.product(machines, [False, True]):
+                transducer = pickle.loads(pickle.dumps(machine, -1))
+                transducer.clear_dead_states(with_impasse_states)
+                fixpoint_transducer = pickle.loads(pickle.dumps(machine, -1))
+                _clear_dead_states_by_fixpoint(fixpoint_transducer, with_impasse_states)
+                assert _get_transducer_state(transducer) == _get_transducer_state(fixpoint_transducer)
+                number_of_cleared_states[with_impasse_states] += len(machine.states) - len(transducer.states)
+    assert number_of_cleared_states[True] > number_of_cleared_states[False] > 0
+
+
+@pytest.mark.parametrize("simulation_name", SIMULATION_NAMES)
+def test_get_range(simulation_name: str):
+    """the outputs of a word are those that passes over the arcs until no string changes would find"""
+    for grammar in _get_grammars(simulation_name, 2):
+        for transducer in _get_optimized_word_transducers(grammar):
+            assert transducer.get_range() == _get_range_by_passes(transducer)
+
+
+@pytest.mark.parametrize("simulation_name", SIMULATION_NAMES)
+def test_output_automaton(simulation_name: str):
+    """the output automaton of a word counts, accepts and finds in a trie the outputs of `get_range`"""
+    data_words = list(init_simulated_annealing(simulation_name).current_hypothesis.data)
+    for grammar in _get_grammars(simulation_name, 2):
+        for transducer in _get_optimized_word_transducers(grammar):
+            outputs = transducer.get_range()
+            non_outputs = {string for string in data_words + [output + "a" for output in outputs] + [""]
+                           if string not in outputs}
+            output_automaton = OutputAutomaton.from_transducer(transducer)
+            for automaton in [output_automaton, output_automaton.get_compact(),
+                              OutputAutomaton.loads(output_automaton.dumps())]:
+                assert automaton.get_outputs() == outputs
+                assert automaton.get_number_of_outputs() == len(outputs)
+                assert all(automaton.accepts(output) for output in outputs)
+                assert not any(automaton.accepts(string) for string in non_outputs)
+                assert (sorted(automaton.get_accepted_strings(make_strings_trie(data_words))) ==
+                        sorted(outputs.intersection(data_words)))
+                assert (sorted(automaton.get_accepted_strings(make_strings_trie(non_outputs | outputs))) ==
+                        sorted(outputs))
+
+
+@pytest.mark.parametrize("simulation_name", SIMULATION_NAMES)
+def test_generation_store(simulation_name: str, tmp_path):
+    """an output automaton stored by a run is loaded by the next - and made when the store is corrupt or missing"""
+    grammar = _get_grammars(simulation_name, 1)[0]
+    generation_store_file = str(tmp_path / "generation_store.sqlite")
+    config = settings.update(generation_store=True, generation_store_file=generation_store_file).freeze()
+    words = sorted({str(word): word for word in grammar.lexicon.get_words()}.items())[:5]
+    output_automata = {word_string: grammar.get_output_automaton(word) for word_string, word in words}
+    made_output_automata = list()
+
+    def get_output_automata() -> dict[str, OutputAutomaton]:
+        generation_store = GenerationStore()  # a new connection - of the next run
+        return {word_string: generation_store.get_output_automaton(
+            grammar.feature_table, grammar.constraint_set.get_key(), word_string,
+            lambda: made_output_automata.append(word_string) or output_automata[word_string], config)
+            for word_string in output_automata}
+
+    assert get_output_automata() == output_automata
+    assert len(made_output_automata) == len(output_automata)
+    for word_string, output_automaton in get_output_automata().items():
+        assert output_automaton is not output_automata[word_string]
+        assert output_automaton.get_outputs() == output_automata[word_string].get_outputs()
+    assert len(made_output_automata) == len(output_automata)
+
+    with sqlite3.connect(generation_store_file) as connection:
+        connection.execute("UPDATE output_automata SET automaton = 'not an automaton'")
+    connection.close()
+    assert get_output_automata() == output_automata
+    assert len(made_output_automata) == 2 * len(output_automata)
+    get_output_automata()  # stored again
+    assert len(made_output_automata) == 2 * len(output_automata)
+
+    for file_suffix in ["", "-wal", "-shm"]:  # the database, with its log
+        if os.path.exists(generation_store_file + file_suffix):
+            os.remove(generation_store_file + file_suffix)
+    assert get_output_automata() == output_automata
+    assert len(made_output_automata) == 3 * len(output_automata)
+
+    for file_suffix in ["-wal", "-shm"]:
+        if os.path.exists(generation_store_file + file_suffix):
+            os.remove(generation_store_file + file_suffix)
+    with open(generation_store_file, "wb") as f:
+        f.write(b"not a database" * 100)
+    assert get_output_automata() == output_automata
+    assert len(made_output_automata) == 4 * len(output_automata)